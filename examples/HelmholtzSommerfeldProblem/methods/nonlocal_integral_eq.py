@@ -1,305 +1,940 @@
+from time import perf_counter
+import numpy as np
+import scipy.linalg as la
+
 from firedrake import Function, FacetNormal, TestFunction, assemble, inner, ds, \
-    TrialFunction, grad, dx, Constant
+    TrialFunction, grad, dx, DirichletBC
 from firedrake.petsc import PETSc, OptionsManager
 from sumpy.kernel import HelmholtzKernel
 from .preconditioners.two_D_helmholtz import AMGTransmissionPreconditioner
+from .recycling import is_flexible
 
 import fd2mm
 
 
-def nonlocal_integral_eq(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
-                         options_prefix=None, solver_parameters=None,
-                         fspace=None, vfspace=None,
-                         true_sol_grad=None,
-                         queue=None, fspace_analog=None, qbx_kwargs=None,
-                         ):
-    r"""
-        see run_method for descriptions of unlisted args
+relaxation_strategies = ['bouras-fraysse', 'simoncini-szyld']
 
-        args:
 
-        :arg queue: A command queue for the computing context
+def fmm_accuracy(ambient_dim, fmm_order):
+    """
+        Return the (heuristic) relative accuracy of an FMM of order
+        *fmm_order*, as printed by run_trial. This does not account
+        for the QBX truncation error.
+    """
+    if ambient_dim == 2:
+        c = 0.5
+    else:
+        c = 0.75
+    return c**(fmm_order + 1)
 
-        gamma and beta are used to precondition
-        with the following equation:
 
-        \Delta u - \kappa^2 \gamma u = 0
-        (\partial_n - i\kappa\beta) u |_\Sigma = 0
-    """
-    with_refinement = True
-    # away from the excluded region, but firedrake and meshmode point
-    # into
-    pyt_inner_normal_sign = -1
+class MatrixFreeB(object):
+    def __init__(self, A, pyt_grad_op, pyt_op, queue, kappa,
+                 fspace, vfspace, bdy_mass, bdy_normal_proj,
+                 relaxed_ops=None):
+        """
+        :arg kappa: The wave number
+        :arg bdy_mass: The assembled outer bdy mass matrix
+            (see :class:`NonlocalIntegralEquation`)
+        :arg bdy_normal_proj: The assembled outer bdy normal
+            projection (see :class:`NonlocalIntegralEquation`)
+        :arg relaxed_ops: A list of *(accuracy, pyt_grad_op, pyt_op)*
+            of cheaper, less accurate, bindings of the operators.
+            These are used in place of *pyt_grad_op* and *pyt_op*
+            once the residual is small enough (see :meth:`set_relaxation`).
+        """
 
-    ambient_dim = mesh.geometric_dimension()
+        self.queue = queue
+        self.k = kappa
+        self.pyt_op = pyt_op
+        self.pyt_grad_op = pyt_grad_op
+        self.A = A
 
-    # {{{ Create operator
-    from pytential import sym
+        # {{{ Accuracy levels for inexact Krylov
 
-    r"""
-    ..math:
+        # level 0 is the given operators, then from most to least accurate
+        if relaxed_ops is None:
+            relaxed_ops = []
+        relaxed_ops = sorted(relaxed_ops, key=lambda level: level[0])
+        self.accuracies = [0.0] + [acc for acc, _, _ in relaxed_ops]
+        self.ops = [(pyt_grad_op, pyt_op)] \
+            + [(grad_op, op) for _, grad_op, op in relaxed_ops]
 
-    x \in \Sigma
+        self.set_relaxation(None)
 
-    grad_op(x) =
-        \nabla(
-            \int_\Gamma(
-                u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
-            )d\gamma(y)
-        )
-    """
-    grad_op = pyt_inner_normal_sign * sym.grad(
-        ambient_dim, sym.D(HelmholtzKernel(ambient_dim),
-                           sym.var("u"), k=sym.var("k"),
-                           qbx_forced_limit=None))
+        # }}}
 
-    r"""
-    ..math:
+        # {{{ Create some functions needed for multing
+        self.x_fntn = Function(fspace)
 
-    x \in \Sigma
+        self.potential_int = Function(fspace)
+        self.potential_int.dat.data[:] = 0.0
+        self.grad_potential_int = Function(vfspace)
+        self.grad_potential_int.dat.data[:] = 0.0
+        # }}}
 
-    op(x) =
-        i \kappa \cdot
-        \int_\Gamma(
-            u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
-        )d\gamma(y)
-    """
-    op = pyt_inner_normal_sign * 1j * sym.var("k") * (
-        sym.D(HelmholtzKernel(ambient_dim),
-              sym.var("u"), k=sym.var("k"),
-              qbx_forced_limit=None)
-        )
-
-    pyt_grad_op = fd2mm.fd_bind(queue.context, fspace_analog, grad_op,
-                                source=(fspace, scatterer_bdy_id),
-                                target=(vfspace, outer_bdy_id),
-                                with_refinement=with_refinement,
-                                qbx_kwargs=qbx_kwargs,
-                                )
-
-    pyt_op = fd2mm.fd_bind(queue.context, fspace_analog, op,
-                           source=(fspace, scatterer_bdy_id),
-                           target=(fspace, outer_bdy_id),
-                           with_refinement=with_refinement,
-                           qbx_kwargs=qbx_kwargs,
-                           )
-
-    # }}}
-
-    class MatrixFreeB(object):
-        def __init__(self, A, pyt_grad_op, pyt_op, queue, kappa):
-            """
-            :arg kappa: The wave number
-            """
-
-            self.queue = queue
-            self.k = kappa
-            self.pyt_op = pyt_op
-            self.pyt_grad_op = pyt_grad_op
-            self.A = A
-
-            # {{{ Create some functions needed for multing
-            self.x_fntn = Function(fspace)
-
-            self.potential_int = Function(fspace)
-            self.potential_int.dat.data[:] = 0.0
-            self.grad_potential_int = Function(vfspace)
-            self.grad_potential_int.dat.data[:] = 0.0
-            self.pyt_result = Function(fspace)
-
-            self.n = FacetNormal(mesh)
-            self.v = TestFunction(fspace)
-            # }}}
-
-        def mult(self, mat, x, y):
-            # Perform pytential operation
-            self.x_fntn.dat.data[:] = x[:]
-
-            self.pyt_op(self.queue, self.potential_int,
-                        u=self.x_fntn, k=self.k)
-            self.pyt_grad_op(self.queue, self.grad_potential_int,
-                             u=self.x_fntn, k=self.k)
-
-            # Integrate the potential
-            r"""
-            Compute the inner products using firedrake. Note this
-            will be subtracted later, hence appears off by a sign.
+        # Bdy integrals are assembled once, so that mult only needs
+        # matrix-vector products
+        self.bdy_mass = bdy_mass
+        self.bdy_normal_proj = bdy_normal_proj
 
-            .. math::
+        # Holds the projected gradient
+        self.tmp = self.bdy_mass.createVecLeft()
 
-                \langle
-                    n(x) \cdot \nabla(
-                        \int_\Gamma(
-                            u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
-                        )d\gamma(y)
-                    ), v
-                \rangle_\Sigma
-                - \langle
-                    i \kappa \cdot
+    def set_relaxation(self, relaxation):
+        r"""
+            Set the relaxation strategy used to choose the accuracy
+            of each application, and reset the residual norms and
+            the counts of :meth:`work_report`.
+
+            :arg relaxation: *None* to always use the most accurate
+                operators, or one of *relaxation_strategies*.
+                With residual norms :math:`r_k` and target residual norm
+                :math:`\epsilon` (from the tolerances of the KSP),
+                the operators applied at iteration *k* are the cheapest
+                ones with accuracy below
+
+                * *'bouras-fraysse'*: :math:`\epsilon / r_k`
+                * *'simoncini-szyld'*: :math:`\epsilon / (m r_k)`,
+                  *m* the maximum number of iterations
+
+            The residual norms are only known if :meth:`monitor`
+            is set as a monitor of the KSP.
+        """
+        if relaxation is not None and relaxation not in relaxation_strategies:
+            raise ValueError("relaxation must be *None* or one of %s, not '%s'"
+                             % (relaxation_strategies, relaxation))
+        self.relaxation = relaxation
+        self.target_rnorm = None
+        self.rnorm = None
+        self.max_it = None
+
+        self.napplications = [0 for _ in self.ops]
+        self.times = [0.0 for _ in self.ops]
+
+    def monitor(self, ksp, its, rnorm):
+        """
+            A KSP monitor recording the residual norm
+        """
+        if its == 0:
+            rtol, atol, _, max_it = ksp.getTolerances()
+            self.target_rnorm = max(rtol * rnorm, atol)
+            self.max_it = max_it
+        self.rnorm = rnorm
+
+    def get_level(self):
+        """
+            Return the index into *self.ops* of the operators
+            to apply next
+        """
+        if self.relaxation is None or not self.rnorm \
+                or self.target_rnorm is None:
+            return 0
+
+        tol = self.target_rnorm / self.rnorm
+        if self.relaxation == 'simoncini-szyld':
+            tol /= self.max_it
+
+        level = 0
+        for i, accuracy in enumerate(self.accuracies):
+            if accuracy <= tol:
+                level = i
+        return level
+
+    def work_report(self):
+        """
+            Return a dict with
+
+            * *'napplications'*: The number of applications at each
+              level of accuracy, most accurate first
+            * *'times'*: The time (in seconds) spent in the layer potentials
+              at each level of accuracy
+            * *'work_saved'*: The estimated time saved against applying
+              the most accurate operators every time (*None* if those were
+              never applied)
+            * *'work_saved_fraction'*: *'work_saved'* as a fraction of the
+              estimated time of the fixed accuracy run
+        """
+        report = {'napplications': list(self.napplications),
+                  'times': list(self.times),
+                  'work_saved': None,
+                  'work_saved_fraction': None}
+
+        if self.napplications[0] > 0:
+            fixed_time = self.times[0] / self.napplications[0] \
+                * sum(self.napplications)
+            report['work_saved'] = fixed_time - sum(self.times)
+            if fixed_time > 0:
+                report['work_saved_fraction'] = report['work_saved'] / fixed_time
+
+        return report
+
+    def mult(self, mat, x, y):
+        level = self.get_level()
+
+        # y <- Ax + nonlocal coupling
+        self.A.mult(x, y)
+
+        start = perf_counter()
+        self.add_coupling(x, y, level=level)
+        self.times[level] += perf_counter() - start
+        self.napplications[level] += 1
+
+    def add_coupling(self, x, y, level=0):
+        """
+            y <- y + (the nonlocal coupling applied to x), using
+            the operators at accuracy level *level*
+        """
+        # Perform pytential operation
+        self.x_fntn.dat.data[:] = x[:]
+
+        pyt_grad_op, pyt_op = self.ops[level]
+        pyt_op(self.queue, self.potential_int,
+               u=self.x_fntn, k=self.k)
+        pyt_grad_op(self.queue, self.grad_potential_int,
+                    u=self.x_fntn, k=self.k)
+
+        # Integrate the potential
+        r"""
+        Compute the inner products with the preassembled bdy
+        matrices. Note this
+        will be subtracted later, hence appears off by a sign.
+
+        .. math::
+
+            \langle
+                n(x) \cdot \nabla(
                     \int_\Gamma(
                         u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
-                    )d\gamma(y), v
-                \rangle_\Sigma
-            """
-            self.pyt_result = assemble(
-                inner(inner(self.grad_potential_int, self.n),
-                      self.v) * ds(outer_bdy_id)
-                - inner(self.potential_int, self.v) * ds(outer_bdy_id)
-            )
+                    )d\gamma(y)
+                ), v
+            \rangle_\Sigma
+            - \langle
+                i \kappa \cdot
+                \int_\Gamma(
+                    u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
+                )d\gamma(y), v
+            \rangle_\Sigma
+        """
+        # y <- y - evaluated potential
+        with self.grad_potential_int.dat.vec_ro as grad_potential:
+            self.bdy_normal_proj.mult(grad_potential, self.tmp)
+        y.axpy(-1, self.tmp)
+        with self.potential_int.dat.vec_ro as potential:
+            self.bdy_mass.multAdd(potential, y, y)
 
-            # y <- Ax - evaluated potential
-            self.A.mult(x, y)
-            with self.pyt_result.dat.vec_ro as ep:
-                y.axpy(-1, ep)
 
-    # {{{ Compute normal helmholtz operator
-    u = TrialFunction(fspace)
-    v = TestFunction(fspace)
+class NestedNonlocalPreconditioner(object):
+    """
+        A python preconditioner applying a few iterations of gmres
+        on a cheaper (less accurate) nonlocal operator.
+        Since this varies from application to application,
+        the outer ksp must be flexible (fgmres or gcr).
+
+        .. attribute:: napplications
+
+            The number of times the preconditioner has been applied
+
+        .. attribute:: niterations
+
+            The total number of inner iterations
+    """
+    def __init__(self, B_inner, P, rtol=1e-2, maxiter=10, pc_type='ilu',
+                 pc_context=None, options_prefix=None):
+        """
+            :arg B_inner: The cheap nonlocal operator, a python matrix
+                with a :class:`MatrixFreeB` context
+            :arg P: The matrix to build the inner preconditioner from
+            :arg rtol: The relative tolerance of the inner solve
+            :arg maxiter: The maximum number of inner iterations
+            :arg pc_type: The PETSc pc type of the inner solve,
+                ignored if *pc_context* is not *None*
+            :arg pc_context: If not *None*, the context of a
+                python pc to use for the inner solve
+                (e.g. an :class:`AMGTransmissionPreconditioner`)
+            :arg options_prefix: If not *None*, the inner ksp is also
+                set from the PETSc options with this prefix
+        """
+        self.ksp = PETSc.KSP().create()
+        self.ksp.setOperators(B_inner, P)
+        self.ksp.setType(PETSc.KSP.Type.GMRES)
+        self.ksp.setTolerances(rtol=rtol, max_it=maxiter)
+
+        pc = self.ksp.pc
+        if pc_context is not None:
+            pc.setType(pc.Type.PYTHON)
+            pc.setPythonContext(pc_context)
+        else:
+            pc.setType(pc_type)
 
+        if options_prefix is not None:
+            self.ksp.setOptionsPrefix(options_prefix)
+            self.ksp.setFromOptions()
+
+        self.napplications = 0
+        self.niterations = 0
+
+    def apply(self, pc, x, y):
+        # y <- (approximately) B_inner^{-1} x
+        self.ksp.solve(x, y)
+        self.napplications += 1
+        self.niterations += self.ksp.getIterationNumber()
+
+
+class WoodburyPreconditioner(object):
     r"""
-    .. math::
-
-        \langle
-            \nabla u, \nabla v
-        \rangle
-        - \kappa^2 \cdot \langle
-            u, v
-        \rangle
-        - i \kappa \langle
-            u, v
-        \rangle_\Sigma
+        A python preconditioner applying the inverse of the
+        nonlocal operator :math:`A + C`, where *A* is the (sparse)
+        Helmholtz matrix and *C* the nonlocal coupling.
+        *C* only has nonzero rows at outer bdy dofs and nonzero columns
+        at scatterer bdy dofs, and this dense block is compressed
+        with a truncated SVD to :math:`U V`, with *U* of rank *r*.
+        *A* is factored once with a sparse LU, and
+
+        .. math::
+
+            (A + UV)^{-1} = A^{-1} - A^{-1} U (I + V A^{-1} U)^{-1} V A^{-1}
+
+        so that each application costs one pair of triangular solves with
+        *A* and some small dense operations.
+
+        Up to the truncation, this is exact, so it can be used with
+        ksp_type *'preonly'* as a direct solver.
+
+        .. attribute:: rank
+
+            The rank *r* of the compressed coupling
     """
-    a = inner(grad(u), grad(v)) * dx \
-        - Constant(wave_number**2) * inner(u, v) * dx \
-        - Constant(1j * wave_number) * inner(u, v) * ds(outer_bdy_id)
+    def __init__(self, A, coupling, outer_nodes, scatterer_nodes, tol=1e-12,
+                 mat_solver_type=None, options_prefix=None):
+        """
+            :arg A: The assembled Helmholtz matrix
+            :arg coupling: The dense block of *C* of shape
+                *(len(outer_nodes), len(scatterer_nodes))*
+            :arg outer_nodes: The indices of the outer bdy dofs
+            :arg scatterer_nodes: The indices of the scatterer bdy dofs
+            :arg tol: Singular values of *coupling* below *tol* times
+                the largest are dropped
+            :arg mat_solver_type: If not *None*, the solver package
+                factoring *A* (e.g. *'mumps'*)
+            :arg options_prefix: If not *None*, the ksp factoring *A*
+                is also set from the PETSc options with this prefix
 
-    # get the concrete matrix from a general bilinear form
-    A = assemble(a).M.handle
-    # }}}
+            Only runs in serial, since dofs are indexed by global
+            node number.
+        """
+        if A.getComm().getSize() > 1:
+            raise NotImplementedError("WoodburyPreconditioner only runs"
+                                      " in serial")
 
-    # {{{ Setup Python matrix
-    B = PETSc.Mat().create()
+        # {{{ Factor A
 
-    # build matrix context
-    Bctx = MatrixFreeB(A, pyt_grad_op, pyt_op, queue, wave_number)
+        self.lu = PETSc.KSP().create()
+        self.lu.setOperators(A)
+        self.lu.setType(PETSc.KSP.Type.PREONLY)
+        self.lu.pc.setType(PETSc.PC.Type.LU)
+        if mat_solver_type is not None:
+            self.lu.pc.setFactorSolverType(mat_solver_type)
+        if options_prefix is not None:
+            self.lu.setOptionsPrefix(options_prefix)
+            self.lu.setFromOptions()
+        self.lu.setUp()
 
-    # set up B as same size as A
-    B.setSizes(*A.getSizes())
+        # }}}
 
-    B.setType(B.Type.PYTHON)
-    B.setPythonContext(Bctx)
-    B.setUp()
-    # }}}
+        # {{{ Compress the coupling
 
-    # {{{ Create rhs
+        U, sing_vals, V = np.linalg.svd(coupling, full_matrices=False)
+        if sing_vals.size and sing_vals[0] > 0:
+            self.rank = int(np.sum(sing_vals > tol * sing_vals[0]))
+        else:
+            self.rank = 0
+        U = U[:, :self.rank] * sing_vals[:self.rank]
+        self.V = V[:self.rank]
 
-    # Remember f is \partial_n(true_sol)|_\Gamma
-    # so we just need to compute \int_\Gamma\partial_n(true_sol) H(x-y)
-    from pytential import sym
+        # }}}
 
-    sigma = sym.make_sym_vector("sigma", ambient_dim)
-    r"""
-    ..math:
+        # {{{ Compute A^{-1} U and factor the capacitance matrix
 
-    x \in \Sigma
+        self.scatterer_nodes = scatterer_nodes
+        x, b = A.createVecs()
+        self.AinvU = np.empty((x.getLocalSize(), self.rank), dtype=U.dtype)
+        for i in range(self.rank):
+            b.set(0)
+            b.array[outer_nodes] = U[:, i]
+            self.lu.solve(b, x)
+            self.AinvU[:, i] = x.array
 
-    grad_op(x) =
-        \nabla(
-            \int_\Gamma(
-                f(y) H_0^{(1)}(\kappa |x - y|)
-            )d\gamma(y)
-        )
+        capacitance = np.eye(self.rank, dtype=U.dtype) \
+            + self.V.dot(self.AinvU[scatterer_nodes])
+        self.capacitance = la.lu_factor(capacitance)
+
+        # }}}
+
+    def apply(self, pc, x, y):
+        # y <- A^{-1} x
+        self.lu.solve(x, y)
+        if self.rank == 0:
+            return
+
+        # y <- y - A^{-1} U (I + V A^{-1} U)^{-1} V y
+        correction = la.lu_solve(self.capacitance,
+                                 self.V.dot(y.array[self.scatterer_nodes]))
+        y.array[:] -= self.AinvU.dot(correction)
+
+
+def _python_mat(sizes, context):
     """
-    grad_op = pyt_inner_normal_sign * \
-        sym.grad(ambient_dim, sym.S(HelmholtzKernel(ambient_dim),
-                                    sym.n_dot(sigma),
-                                    k=sym.var("k"), qbx_forced_limit=None))
+        Return a PETSc matrix of type python with context *context*
+    """
+    mat = PETSc.Mat().create()
+    mat.setSizes(*sizes)
+    mat.setType(mat.Type.PYTHON)
+    mat.setPythonContext(context)
+    mat.setUp()
+    return mat
+
+
+class NonlocalIntegralEquation:
     r"""
-    ..math:
+        The nonlocal method, set up once for a mesh, function spaces and
+        qbx parameters, and then solved for any number of wave numbers
+        with :meth:`solve`.
 
-    x \in \Sigma
+        Everything which does not depend on the wave number
+        (the bound :mod:`pytential` operators along with their
+        refined sources and bdy targets, the stiffness and mass matrices,
+        and the outer bdy matrices) is built in the constructor.
+        The wave number is an argument of the bound operators
+        (*sym.var("k")*), and the Helmholtz matrix is formed as
+        :math:`K - \kappa^2 M - i \kappa M_\Sigma` from
+        preassembled matrices.
 
-    op(x) =
-        i \kappa \cdot
-        \int_\Gamma(
-            f(y) H_0^{(1)}(\kappa |x - y|)
-        )d\gamma(y)
-        )
+        see run_method for descriptions of the args
     """
-    op = 1j * sym.var("k") * pyt_inner_normal_sign * \
-        sym.S(HelmholtzKernel(ambient_dim),
-              sym.n_dot(sigma),
-              k=sym.var("k"),
-              qbx_forced_limit=None)
-
-    rhs_grad_op = fd2mm.fd_bind(queue.context, fspace_analog, grad_op,
-                                source=(vfspace, scatterer_bdy_id),
-                                target=(vfspace, outer_bdy_id),
-                                with_refinement=with_refinement,
-                                qbx_kwargs=qbx_kwargs,
-                                )
-    rhs_op = fd2mm.fd_bind(queue.context, fspace_analog, op,
-                           source=(vfspace, scatterer_bdy_id),
-                           target=(fspace, outer_bdy_id),
-                           with_refinement=with_refinement,
-                           qbx_kwargs=qbx_kwargs,
-                           )
-
-    f_grad_convoluted = Function(vfspace)
-    f_convoluted = Function(fspace)
-    rhs_grad_op(queue, f_grad_convoluted,
-                sigma=true_sol_grad, k=wave_number)
-    rhs_op(queue, f_convoluted,
-           sigma=true_sol_grad, k=wave_number)
+    def __init__(self, mesh, scatterer_bdy_id, outer_bdy_id,
+                 fspace=None, vfspace=None,
+                 queue=None, fspace_analog=None, qbx_kwargs=None,
+                 relaxed_qbx_kwargs=None, inner_qbx_kwargs=None,
+                 inner_mode=None):
+        """
+            :arg queue: A command queue for the computing context
+            :arg relaxed_qbx_kwargs: A list of dicts, one for each cheaper
+                level of accuracy to bind the operators at for inexact Krylov
+                (see :meth:`solve`). Each updates *qbx_kwargs*
+                (e.g. with a lower *'fmm_order'* or *'qbx_order'*),
+                and may have an *'accuracy'* entry, else the accuracy
+                is estimated from the *'fmm_order'* with
+                :func:`fmm_accuracy`. Since that estimate does not
+                account for the QBX error, levels lowering the
+                *'qbx_order'* should have an *'accuracy'*.
+            :arg inner_qbx_kwargs: If not *None*, a dict updating *qbx_kwargs*
+                to bind a cheaper copy of the nonlocal operator at, used
+                by the *'nonlocal'* pc_type (see :meth:`solve`)
+            :arg inner_mode: The *mode* (see :func:`fd2mm.fd_bind`)
+                to bind the cheaper copy of the nonlocal operator with,
+                e.g. *'dense'*, *'hmatrix'* or *'numpy'*. All of these
+                handle both nonlocal operators (the double layer and
+                its gradient) since the outer bdy is well separated from
+                the scatterer. If this is not *None*
+                and *inner_qbx_kwargs* is, *inner_qbx_kwargs*
+                defaults to *{}*.
+        """
+        self.mesh = mesh
+        self.scatterer_bdy_id = scatterer_bdy_id
+        self.outer_bdy_id = outer_bdy_id
+        self.fspace = fspace
+        self.vfspace = vfspace
+        self.queue = queue
 
-    r"""
-        \langle
-            f, v
-        \rangle_\Gamma
-        + \langle
-            i \kappa \cdot \int_\Gamma(
-                f(y) H_0^{(1)}(\kappa |x - y|)
-            )d\gamma(y), v
-        \rangle_\Sigma
-        - \langle
-            n(x) \cdot \nabla(
+        with_refinement = True
+        # away from the excluded region, but firedrake and meshmode point
+        # into
+        pyt_inner_normal_sign = -1
+
+        ambient_dim = mesh.geometric_dimension()
+
+        # {{{ Create operator
+        from pytential import sym
+
+        r"""
+        ..math:
+
+        x \in \Sigma
+
+        grad_op(x) =
+            \nabla(
+                \int_\Gamma(
+                    u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
+                )d\gamma(y)
+            )
+        """
+        grad_op = pyt_inner_normal_sign * sym.grad(
+            ambient_dim, sym.D(HelmholtzKernel(ambient_dim),
+                               sym.var("u"), k=sym.var("k"),
+                               qbx_forced_limit=None))
+
+        r"""
+        ..math:
+
+        x \in \Sigma
+
+        op(x) =
+            i \kappa \cdot
+            \int_\Gamma(
+                u(y) \partial_n H_0^{(1)}(\kappa |x - y|)
+            )d\gamma(y)
+        """
+        op = pyt_inner_normal_sign * 1j * sym.var("k") * (
+            sym.D(HelmholtzKernel(ambient_dim),
+                  sym.var("u"), k=sym.var("k"),
+                  qbx_forced_limit=None)
+            )
+
+        def bind_ops(level_qbx_kwargs, mode='fmm'):
+            # sources are not refined in numpy mode
+            refine = with_refinement and mode != 'numpy'
+            pyt_grad_op = fd2mm.fd_bind(queue.context, fspace_analog, grad_op,
+                                        source=(fspace, scatterer_bdy_id),
+                                        target=(vfspace, outer_bdy_id),
+                                        with_refinement=refine,
+                                        qbx_kwargs=level_qbx_kwargs,
+                                        mode=mode,
+                                        )
+
+            pyt_op = fd2mm.fd_bind(queue.context, fspace_analog, op,
+                                   source=(fspace, scatterer_bdy_id),
+                                   target=(fspace, outer_bdy_id),
+                                   with_refinement=refine,
+                                   qbx_kwargs=level_qbx_kwargs,
+                                   mode=mode,
+                                   )
+            return pyt_grad_op, pyt_op
+
+        self.pyt_grad_op, self.pyt_op = bind_ops(qbx_kwargs)
+
+        # *(mode, ops)* of the last binding with another mode for
+        # :meth:`coupling_block`, bound on first use
+        self._bind_coupling_ops = \
+            lambda mode: bind_ops(qbx_kwargs, mode=mode)
+        self._coupling_ops = None
+
+        # Cheaper bindings for inexact Krylov
+        relaxed_ops = []
+        for level_kwargs in relaxed_qbx_kwargs or []:
+            level_kwargs = dict(level_kwargs)
+            level_qbx_kwargs = dict(qbx_kwargs or {})
+            accuracy = level_kwargs.pop('accuracy', None)
+            level_qbx_kwargs.update(level_kwargs)
+            if accuracy is None:
+                if 'fmm_order' not in level_qbx_kwargs:
+                    raise ValueError("Each entry of relaxed_qbx_kwargs needs an"
+                                     " 'fmm_order' or an 'accuracy'")
+                accuracy = fmm_accuracy(ambient_dim,
+                                        level_qbx_kwargs['fmm_order'])
+            relaxed_ops.append((accuracy,) + bind_ops(level_qbx_kwargs))
+
+        # Cheap binding for the inner solve of the 'nonlocal' pc_type
+        if inner_qbx_kwargs is None and inner_mode is not None:
+            inner_qbx_kwargs = {}
+        inner_ops = None
+        if inner_qbx_kwargs is not None:
+            level_qbx_kwargs = dict(qbx_kwargs or {})
+            level_qbx_kwargs.update(inner_qbx_kwargs)
+            inner_ops = bind_ops(level_qbx_kwargs, mode=inner_mode or 'fmm')
+
+        # }}}
+
+        # {{{ Create rhs operators
+
+        # Remember f is \partial_n(true_sol)|_\Gamma
+        # so we just need to compute \int_\Gamma\partial_n(true_sol) H(x-y)
+
+        sigma = sym.make_sym_vector("sigma", ambient_dim)
+        r"""
+        ..math:
+
+        x \in \Sigma
+
+        grad_op(x) =
+            \nabla(
                 \int_\Gamma(
                     f(y) H_0^{(1)}(\kappa |x - y|)
                 )d\gamma(y)
-            ), v
-        \rangle_\Sigma
-    """
-    rhs_form = inner(inner(true_sol_grad, FacetNormal(mesh)),
-                     v) * ds(scatterer_bdy_id) \
-        + inner(f_convoluted, v) * ds(outer_bdy_id) \
-        - inner(inner(f_grad_convoluted, FacetNormal(mesh)),
-                v) * ds(outer_bdy_id)
+            )
+        """
+        grad_op = pyt_inner_normal_sign * \
+            sym.grad(ambient_dim, sym.S(HelmholtzKernel(ambient_dim),
+                                        sym.n_dot(sigma),
+                                        k=sym.var("k"), qbx_forced_limit=None))
+        r"""
+        ..math:
 
-    rhs = assemble(rhs_form)
+        x \in \Sigma
 
-    # {{{ set up a solver:
-    solution = Function(fspace, name="Computed Solution")
+        op(x) =
+            i \kappa \cdot
+            \int_\Gamma(
+                f(y) H_0^{(1)}(\kappa |x - y|)
+            )d\gamma(y)
+            )
+        """
+        op = 1j * sym.var("k") * pyt_inner_normal_sign * \
+            sym.S(HelmholtzKernel(ambient_dim),
+                  sym.n_dot(sigma),
+                  k=sym.var("k"),
+                  qbx_forced_limit=None)
 
-    #       {{{ Used for preconditioning
-    if 'gamma' in solver_parameters or 'beta' in solver_parameters:
-        gamma = complex(solver_parameters.pop('gamma', 1.0))
+        self.rhs_grad_op = fd2mm.fd_bind(queue.context, fspace_analog, grad_op,
+                                         source=(vfspace, scatterer_bdy_id),
+                                         target=(vfspace, outer_bdy_id),
+                                         with_refinement=with_refinement,
+                                         qbx_kwargs=qbx_kwargs,
+                                         )
+        self.rhs_op = fd2mm.fd_bind(queue.context, fspace_analog, op,
+                                    source=(vfspace, scatterer_bdy_id),
+                                    target=(fspace, outer_bdy_id),
+                                    with_refinement=with_refinement,
+                                    qbx_kwargs=qbx_kwargs,
+                                    )
 
-        import cmath
-        beta = complex(solver_parameters.pop('beta', cmath.sqrt(gamma)))
+        # }}}
 
-        p = inner(grad(u), grad(v)) * dx \
-            - Constant(wave_number**2 * gamma) * inner(u, v) * dx \
-            - Constant(1j * wave_number * beta) * inner(u, v) * ds(outer_bdy_id)
-        P = assemble(p).M.handle
+        # {{{ Assemble the wave number independent matrices
 
-    else:
-        P = A
-    #       }}}
+        u = TrialFunction(fspace)
+        v = TestFunction(fspace)
+        n = FacetNormal(mesh)
+
+        r"""
+        .. math::
+
+            \langle \nabla u, \nabla v \rangle,
+            \qquad \langle u, v \rangle,
+            \qquad \langle u, v \rangle_\Sigma,
+            \qquad \langle n \cdot w, v \rangle_\Sigma
+
+        for *w* in the vector function space
+        """
+        self.stiffness = assemble(inner(grad(u), grad(v)) * dx).M.handle
+        self.mass = assemble(inner(u, v) * dx).M.handle
+        self.bdy_mass = assemble(inner(u, v) * ds(outer_bdy_id)).M.handle
+        self.bdy_normal_proj = assemble(
+            inner(inner(TrialFunction(vfspace), n), v) * ds(outer_bdy_id)
+            ).M.handle
+
+        # }}}
+
+        # Helmholtz matrix, and the matrix-free operator using it
+        self.A = self.stiffness.duplicate(copy=True)
+        Bctx = MatrixFreeB(self.A, self.pyt_grad_op, self.pyt_op, queue, None,
+                           fspace, vfspace, self.bdy_mass, self.bdy_normal_proj,
+                           relaxed_ops=relaxed_ops)
+
+        # {{{ Setup Python matrices
+
+        # set up B as same size as A
+        self.B = _python_mat(self.A.getSizes(), Bctx)
+
+        self.B_inner = None
+        if inner_ops is not None:
+            inner_grad_op, inner_op = inner_ops
+            inner_Bctx = MatrixFreeB(self.A, inner_grad_op, inner_op, queue, None,
+                                     fspace, vfspace, self.bdy_mass,
+                                     self.bdy_normal_proj)
+            self.B_inner = _python_mat(self.A.getSizes(), inner_Bctx)
+
+        # }}}
+
+        # (key, preconditioner) of the last woodbury preconditioner built
+        self._woodbury = None
+
+    def helmholtz_matrix(self, wave_number, gamma=1.0, beta=1.0, out=None):
+        r"""
+            Return the assembled matrix of
+
+            .. math::
+
+                \langle
+                    \nabla u, \nabla v
+                \rangle
+                - \kappa^2 \gamma \cdot \langle
+                    u, v
+                \rangle
+                - i \kappa \beta \langle
+                    u, v
+                \rangle_\Sigma
+
+            written into *out* if *out* is not *None*
+        """
+        subset = PETSc.Mat.Structure.SUBSET_NONZERO_PATTERN
+        if out is None:
+            out = self.stiffness.duplicate(copy=True)
+        else:
+            self.stiffness.copy(out, structure=PETSc.Mat.Structure.SAME)
+        out.axpy(-wave_number**2 * gamma, self.mass, structure=subset)
+        out.axpy(-1j * wave_number * beta, self.bdy_mass, structure=subset)
+        return out
+
+    def coupling_block(self, wave_number, mode=None, batch_size=64):
+        """
+            Returns *(coupling, outer_nodes, scatterer_nodes)*, where
+            *coupling* is the dense block of the nonlocal coupling at
+            wave number *wave_number* from the scatterer bdy dofs
+            *scatterer_nodes* to the outer bdy dofs *outer_nodes*.
+
+            :arg mode: If *None*, the columns are computed with the same
+                operators as :attr:`B`, so this is the block :attr:`B`
+                applies, but each column costs one application of each
+                operator (geometry is shared, see
+                :meth:`fd2mm.op.OpConnection.evaluate_many`). Otherwise
+                the operators are bound again with this *mode* (see
+                :func:`fd2mm.fd_bind`), e.g. *'dense'* to assemble each
+                once per wave number and apply *batch_size* columns in a
+                single matrix-matrix product. Such a block uses direct
+                quadrature, so differs from the one :attr:`B` applies
+                (see :func:`fd2mm.dense.check_separation`).
+
+            Only runs in serial, since the columns are read by
+            global node number.
+        """
+        if self.A.getComm().getSize() > 1:
+            raise NotImplementedError("coupling_block only runs in serial")
+
+        outer_nodes = DirichletBC(self.fspace, 0, self.outer_bdy_id).nodes
+        scatterer_nodes = DirichletBC(self.fspace, 0,
+                                      self.scatterer_bdy_id).nodes
+
+        if mode is None:
+            pyt_grad_op, pyt_op = self.pyt_grad_op, self.pyt_op
+        else:
+            if self._coupling_ops is None or self._coupling_ops[0] != mode:
+                # Drop the old binding before making the new one
+                self._coupling_ops = None
+                self._coupling_ops = (mode, self._bind_coupling_ops(mode))
+            pyt_grad_op, pyt_op = self._coupling_ops[1]
+
+        nbatch = min(batch_size, len(scatterer_nodes))
+        densities = [Function(self.fspace) for _ in range(nbatch)]
+        potentials = [Function(self.fspace) for _ in range(nbatch)]
+        grad_potentials = [Function(self.vfspace) for _ in range(nbatch)]
+
+        y = self.A.createVecLeft()
+        coupling = np.empty((len(outer_nodes), len(scatterer_nodes)),
+                            dtype=np.complex128)
+        for start in range(0, len(scatterer_nodes), nbatch):
+            nodes = scatterer_nodes[start:start + nbatch]
+            for density, node in zip(densities, nodes):
+                density.dat.data[:] = 0
+                density.dat.data[node] = 1
+
+            pyt_op.apply_many(self.queue, potentials[:len(nodes)],
+                              u=densities[:len(nodes)], k=wave_number)
+            pyt_grad_op.apply_many(self.queue, grad_potentials[:len(nodes)],
+                                   u=densities[:len(nodes)], k=wave_number)
+
+            # -<n \cdot grad_potential, v>_\Sigma + <potential, v>_\Sigma
+            for j, (potential, grad_potential) in \
+                    enumerate(zip(potentials, grad_potentials[:len(nodes)])):
+                with grad_potential.dat.vec_ro as grad_potential_vec:
+                    self.bdy_normal_proj.mult(grad_potential_vec, y)
+                y.scale(-1)
+                with potential.dat.vec_ro as potential_vec:
+                    self.bdy_mass.multAdd(potential_vec, y, y)
+                coupling[:, start + j] = y.array_r[outer_nodes]
+
+        return coupling, outer_nodes, scatterer_nodes
+
+    def woodbury_preconditioner(self, wave_number, tol=1e-12,
+                                mat_solver_type=None, options_prefix=None,
+                                coupling_mode=None):
+        """
+            Return a :class:`WoodburyPreconditioner` at wave number
+            *wave_number*. The last one built is kept, so solving again
+            at the same wave number (e.g. with a new right-hand side)
+            only costs the triangular solves.
+
+            :arg coupling_mode: The *mode* of :meth:`coupling_block`
+
+            See :class:`WoodburyPreconditioner` for the other args
+        """
+        key = (wave_number, tol, mat_solver_type, options_prefix, coupling_mode)
+        if self._woodbury is None or self._woodbury[0] != key:
+            # Drop the old one before building the new one
+            self._woodbury = None
+
+            coupling, outer_nodes, scatterer_nodes = \
+                self.coupling_block(wave_number, mode=coupling_mode)
+            woodbury = WoodburyPreconditioner(
+                self.helmholtz_matrix(wave_number), coupling,
+                outer_nodes, scatterer_nodes, tol=tol,
+                mat_solver_type=mat_solver_type, options_prefix=options_prefix)
+            self._woodbury = (key, woodbury)
+
+        return self._woodbury[1]
+
+    def solve(self, wave_number, true_sol_grad,
+              options_prefix=None, solver_parameters=None, relaxation=None,
+              ksp=None, warm_start=None, initial_guess=None):
+        r"""
+            Returns *(ksp, solution)*
+
+            :arg initial_guess: If not *None*, a function in *fspace* to
+                start the solve from (ignored if *warm_start*
+                is not *None*)
+
+            :arg warm_start: If not *None*, a
+                :class:`methods.recycling.ProjectedWarmStart` to
+                take the initial guess from, and to which the solution
+                is added. The relative residual of the initial guess
+                is attached to the ksp as its *'projected_residual'*
+                attribute. Its applications of *B* are not counted in the
+                *'inexact_work_report'*.
+
+            :arg ksp: If not *None*, the PETSc KSP to solve with (and
+                return) instead of a new one, e.g. a
+                :func:`methods.recycling.recycling_ksp` to carry its recycled
+                subspace from solve to solve
+
+            :arg relaxation: If not *None*, solve with inexact Krylov:
+                the operators bound with *relaxed_qbx_kwargs* are applied
+                once the residual is small enough according to
+                the strategy *relaxation* (see
+                :meth:`MatrixFreeB.set_relaxation`). This is only sound
+                for a Krylov method which allows a changing operator,
+                so the ksp must be flexible (fgmres, gcr, or hpddm
+                with *'ksp_hpddm_variant': 'flexible'*). The
+                :meth:`MatrixFreeB.work_report` of the solve is
+                attached to the ksp as its *'inexact_work_report'* attribute
+                (see :meth:`petsc4py.PETSc.Object.getAttr`)
+
+            If the *pc_type* in *solver_parameters* is *'nonlocal'*,
+            the preconditioner is a :class:`NestedNonlocalPreconditioner`
+            solving with the cheap operator bound with *inner_qbx_kwargs*
+            and *inner_mode*. It is configured by the *solver_parameters*
+
+            * *'nonlocal_inner_rtol'*: The inner relative tolerance,
+              default *1e-2*
+            * *'nonlocal_inner_maxiter'*: The maximum number of inner
+              iterations, default *10*
+            * *'nonlocal_inner_pc_type'*: The pc type of the inner
+              solve, default *'ilu'*. *'pyamg'* uses an
+              :class:`AMGTransmissionPreconditioner` (configured by
+              *'pyamg_tol'* and *'pyamg_maxiter'*)
 
-    # Set up options to contain solver parameters:
-    ksp = PETSc.KSP().create()
-    if solver_parameters['pc_type'] == 'pyamg':
-        del solver_parameters['pc_type']  # We are using the AMG preconditioner
+            The total number of inner iterations is attached to the ksp
+            as its *'inner_iteration_number'* attribute. The outer
+            ksp must be flexible (as for *relaxation*), else a
+            :class:`ValueError` is raised.
+
+            If the *pc_type* is *'woodbury'*, the preconditioner is
+            a :class:`WoodburyPreconditioner` (see
+            :meth:`woodbury_preconditioner`), which is a direct solver
+            when used with *'ksp_type': 'preonly'*. It is configured by the
+            *solver_parameters*
+
+            * *'woodbury_tol'*: The relative truncation tolerance
+              of the coupling, default *1e-12*
+            * *'woodbury_mat_solver_type'*: The solver package factoring
+              the Helmholtz matrix (e.g. *'mumps'*), default PETSc's
+            * *'woodbury_coupling_mode'*: The *mode* of
+              :meth:`coupling_block`, default *None* (the operators
+              of :attr:`B`)
+
+            The rank of the compressed coupling is attached to the
+            ksp as its *'woodbury_rank'* attribute. With
+            *'ksp_type': 'preonly'*, the relative residual of the
+            solution against :attr:`B` (which differs from zero by the
+            truncation, and by the quadrature if *'woodbury_coupling_mode'*
+            is set) is attached as its *'woodbury_residual'* attribute.
+
+            gamma and beta are used to precondition
+            with the following equation:
+
+            \Delta u - \kappa^2 \gamma u = 0
+            (\partial_n - i\kappa\beta) u |_\Sigma = 0
+        """
+        solver_parameters = dict(solver_parameters)
+        fspace = self.fspace
+        v = TestFunction(fspace)
+
+        # {{{ Compute normal helmholtz operator
+        r"""
+        .. math::
+
+            \langle
+                \nabla u, \nabla v
+            \rangle
+            - \kappa^2 \cdot \langle
+                u, v
+            \rangle
+            - i \kappa \langle
+                u, v
+            \rangle_\Sigma
+        """
+        A = self.helmholtz_matrix(wave_number, out=self.A)
+        Bctx = self.B.getPythonContext()
+        Bctx.k = wave_number
+        Bctx.set_relaxation(relaxation)
+        if self.B_inner is not None:
+            self.B_inner.getPythonContext().k = wave_number
+        # }}}
+
+        # {{{ Create rhs
+        f_grad_convoluted = Function(self.vfspace)
+        f_convoluted = Function(fspace)
+        self.rhs_grad_op(self.queue, f_grad_convoluted,
+                         sigma=true_sol_grad, k=wave_number)
+        self.rhs_op(self.queue, f_convoluted,
+                    sigma=true_sol_grad, k=wave_number)
+
+        r"""
+            \langle
+                f, v
+            \rangle_\Gamma
+            + \langle
+                i \kappa \cdot \int_\Gamma(
+                    f(y) H_0^{(1)}(\kappa |x - y|)
+                )d\gamma(y), v
+            \rangle_\Sigma
+            - \langle
+                n(x) \cdot \nabla(
+                    \int_\Gamma(
+                        f(y) H_0^{(1)}(\kappa |x - y|)
+                    )d\gamma(y)
+                ), v
+            \rangle_\Sigma
+        """
+        rhs_form = inner(inner(true_sol_grad, FacetNormal(self.mesh)),
+                         v) * ds(self.scatterer_bdy_id) \
+            + inner(f_convoluted, v) * ds(self.outer_bdy_id) \
+            - inner(inner(f_grad_convoluted, FacetNormal(self.mesh)),
+                    v) * ds(self.outer_bdy_id)
+
+        rhs = assemble(rhs_form)
+        # }}}
+
+        # {{{ set up a solver:
+        solution = Function(fspace, name="Computed Solution")
+
+        #       {{{ Used for preconditioning
+        if 'gamma' in solver_parameters or 'beta' in solver_parameters:
+            gamma = complex(solver_parameters.pop('gamma', 1.0))
+
+            import cmath
+            beta = complex(solver_parameters.pop('beta', cmath.sqrt(gamma)))
+
+            P = self.helmholtz_matrix(wave_number, gamma=gamma, beta=beta)
+        else:
+            P = A
+        #       }}}
+
+        # Set up options to contain solver parameters:
+        if ksp is None:
+            ksp = PETSc.KSP().create()
+        else:
+            # The monitors are set again below
+            ksp.cancelMonitor()
 
         pyamg_tol = solver_parameters.get('pyamg_tol', None)
         if pyamg_tol is not None:
@@ -307,26 +942,176 @@ def nonlocal_integral_eq(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
         pyamg_maxiter = solver_parameters.get('pyamg_maxiter', None)
         if pyamg_maxiter is not None:
             pyamg_maxiter = int(pyamg_maxiter)
-        ksp.setOperators(B)
-        ksp.setUp()
-        pc = ksp.pc
-        pc.setType(pc.Type.PYTHON)
-        pc.setPythonContext(AMGTransmissionPreconditioner(wave_number,
-                                                          fspace,
-                                                          A,
-                                                          tol=pyamg_tol,
-                                                          maxiter=pyamg_maxiter,
-                                                          use_plane_waves=True))
-    # Otherwise use regular preconditioner
-    else:
-        ksp.setOperators(B, P)
+        pyamg_cache_dir = solver_parameters.pop('pyamg_cache_dir', None)
+        pyamg_verbose = bool(solver_parameters.pop('pyamg_verbose', False))
+
+        nested_pc = None
+        woodbury = None
+        if solver_parameters['pc_type'] == 'pyamg':
+            del solver_parameters['pc_type']  # We are using the AMG preconditioner
+
+            ksp.setOperators(self.B)
+            ksp.setUp()
+            pc = ksp.pc
+            pc.setType(pc.Type.PYTHON)
+            amg_pc = AMGTransmissionPreconditioner(wave_number,
+                                                   fspace,
+                                                   A,
+                                                   tol=pyamg_tol,
+                                                   maxiter=pyamg_maxiter,
+                                                   use_plane_waves=True,
+                                                   cache_dir=pyamg_cache_dir,
+                                                   verbose=pyamg_verbose)
+            pc.setPythonContext(amg_pc)
+            ksp.setAttr('pyamg_stats', amg_pc.stats)
+        # Precondition with an inner solve on the cheap nonlocal operator
+        elif solver_parameters['pc_type'] == 'nonlocal':
+            if self.B_inner is None:
+                raise ValueError("pc_type 'nonlocal' requires inner_qbx_kwargs"
+                                 " or inner_mode to be set")
+            del solver_parameters['pc_type']
+
+            inner_rtol = float(solver_parameters.pop('nonlocal_inner_rtol', 1e-2))
+            inner_maxiter = int(solver_parameters.pop('nonlocal_inner_maxiter', 10))
+            inner_pc_type = solver_parameters.pop('nonlocal_inner_pc_type', 'ilu')
+            inner_pc_context = None
+            if inner_pc_type == 'pyamg':
+                inner_pc_context = AMGTransmissionPreconditioner(
+                    wave_number, fspace, P, tol=pyamg_tol, maxiter=pyamg_maxiter,
+                    use_plane_waves=True, cache_dir=pyamg_cache_dir,
+                    verbose=pyamg_verbose)
+                ksp.setAttr('pyamg_stats', inner_pc_context.stats)
+
+            inner_prefix = None
+            if options_prefix is not None:
+                inner_prefix = options_prefix.rstrip('_') + '_inner_'
+            nested_pc = NestedNonlocalPreconditioner(
+                self.B_inner, P, rtol=inner_rtol, maxiter=inner_maxiter,
+                pc_type=inner_pc_type, pc_context=inner_pc_context,
+                options_prefix=inner_prefix)
+
+            ksp.setOperators(self.B, P)
+            pc = ksp.pc
+            pc.setType(pc.Type.PYTHON)
+            pc.setPythonContext(nested_pc)
+        # Invert the operator with a sparse LU and a low-rank update
+        elif solver_parameters['pc_type'] == 'woodbury':
+            del solver_parameters['pc_type']
+
+            woodbury_tol = float(solver_parameters.pop('woodbury_tol', 1e-12))
+            mat_solver_type = solver_parameters.pop('woodbury_mat_solver_type',
+                                                    None)
+            coupling_mode = solver_parameters.pop('woodbury_coupling_mode',
+                                                  None)
+            woodbury_prefix = None
+            if options_prefix is not None:
+                woodbury_prefix = options_prefix.rstrip('_') + '_woodbury_'
+            woodbury = self.woodbury_preconditioner(
+                wave_number, tol=woodbury_tol, mat_solver_type=mat_solver_type,
+                options_prefix=woodbury_prefix, coupling_mode=coupling_mode)
+
+            ksp.setOperators(self.B, P)
+            pc = ksp.pc
+            pc.setType(pc.Type.PYTHON)
+            pc.setPythonContext(woodbury)
+            ksp.setAttr('woodbury_rank', woodbury.rank)
+        # Otherwise use regular preconditioner
+        else:
+            ksp.setOperators(self.B, P)
+
+        options_manager = OptionsManager(solver_parameters, options_prefix)
+        options_manager.set_from_options(ksp)
+        flexible = is_flexible(ksp, solver_parameters)
+        if relaxation is not None:
+            if not flexible:
+                raise ValueError("relaxation changes the operator between"
+                                 " iterations, so the ksp must be flexible"
+                                 " (fgmres, gcr, or hpddm with the flexible"
+                                 " variant), not '%s'" % ksp.getType())
+            ksp.setMonitor(Bctx.monitor)
+        if nested_pc is not None and not flexible:
+            raise ValueError("pc_type 'nonlocal' varies between applications,"
+                             " so the ksp must be flexible (fgmres, gcr, or"
+                             " hpddm with the flexible variant), not '%s'"
+                             % ksp.getType())
 
-    options_manager = OptionsManager(solver_parameters, options_prefix)
-    options_manager.set_from_options(ksp)
+        # preonly does not take an initial guess
+        if ksp.getType() == PETSc.KSP.Type.PREONLY:
+            warm_start = None
+            initial_guess = None
 
-    with rhs.dat.vec_ro as b:
-        with solution.dat.vec as x:
-            ksp.solve(b, x)
-    # }}}
+        if initial_guess is not None:
+            solution.assign(initial_guess)
+        ksp.setInitialGuessNonzero(warm_start is not None
+                                   or initial_guess is not None)
 
-    return ksp, solution
+        with rhs.dat.vec_ro as b:
+            with solution.dat.vec as x:
+                if warm_start is not None:
+                    ksp.setAttr('projected_residual',
+                                warm_start.initial_guess(self.B, b, x))
+                    # Only count the applications of B in the solve
+                    Bctx.set_relaxation(relaxation)
+                ksp.solve(b, x)
+                if warm_start is not None:
+                    warm_start.add(x)
+                if relaxation is not None:
+                    ksp.setAttr('inexact_work_report', Bctx.work_report())
+
+                # A direct solve with the woodbury pc only inverts B up to
+                # the truncation (and the coupling mode), so check it
+                if woodbury is not None \
+                        and ksp.getType() == PETSc.KSP.Type.PREONLY:
+                    residual = b.duplicate()
+                    self.B.mult(x, residual)
+                    residual.aypx(-1, b)
+                    b_norm = b.norm()
+                    ksp.setAttr('woodbury_residual',
+                                residual.norm() / (b_norm if b_norm else 1.0))
+        # }}}
+
+        if nested_pc is not None:
+            ksp.setAttr('inner_iteration_number', nested_pc.niterations)
+
+        return ksp, solution
+
+
+def nonlocal_integral_eq(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
+                         options_prefix=None, solver_parameters=None,
+                         fspace=None, vfspace=None,
+                         true_sol_grad=None,
+                         queue=None, fspace_analog=None, qbx_kwargs=None,
+                         relaxed_qbx_kwargs=None, relaxation=None,
+                         inner_qbx_kwargs=None, inner_mode=None,
+                         ksp=None, warm_start=None, initial_guess=None,
+                         ):
+    r"""
+        see run_method for descriptions of unlisted args
+
+        args:
+
+        :arg queue: A command queue for the computing context
+
+        gamma and beta are used to precondition
+        with the following equation:
+
+        \Delta u - \kappa^2 \gamma u = 0
+        (\partial_n - i\kappa\beta) u |_\Sigma = 0
+
+        To solve for several wave numbers, build one
+        :class:`NonlocalIntegralEquation` and call its
+        :meth:`NonlocalIntegralEquation.solve` for each instead.
+    """
+    solver = NonlocalIntegralEquation(mesh, scatterer_bdy_id, outer_bdy_id,
+                                      fspace=fspace, vfspace=vfspace,
+                                      queue=queue, fspace_analog=fspace_analog,
+                                      qbx_kwargs=qbx_kwargs,
+                                      relaxed_qbx_kwargs=relaxed_qbx_kwargs,
+                                      inner_qbx_kwargs=inner_qbx_kwargs,
+                                      inner_mode=inner_mode)
+    return solver.solve(wave_number, true_sol_grad,
+                        options_prefix=options_prefix,
+                        solver_parameters=solver_parameters,
+                        relaxation=relaxation,
+                        ksp=ksp, warm_start=warm_start,
+                        initial_guess=initial_guess)
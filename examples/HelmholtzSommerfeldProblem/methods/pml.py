@@ -2,7 +2,8 @@ import firedrake.variational_solver as vs
 from firedrake import Constant, SpatialCoordinate, as_tensor, \
     Function, TrialFunction, TestFunction, \
     inner, grad, solve, dx, ds, DirichletBC, dot, FacetNormal, \
-    conditional, real
+    conditional, real, assemble
+from .recycling import set_rhs_relative_tolerance
 
 
 def pml(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
@@ -10,7 +11,7 @@ def pml(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
         inner_region=None,
         fspace=None, tfspace=None, true_sol_grad=None,
         pml_type=None, delta=None, quad_const=None, speed=None,
-        pml_min=None, pml_max=None):
+        pml_min=None, pml_max=None, initial_guess=None):
     """
         For unlisted arg descriptions, see run_method
 
@@ -23,6 +24,8 @@ def pml(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
         :arg pml_min: A list, *pml_min[i]* is where to begin pml layer in direction
                       *i*
         :arg pml_max: A list, *pml_max[i]* is where to end pml layer in direction *i*
+        :arg initial_guess: If not *None*, a function in *fspace* to start
+                            the solve from
     """
     # Handle defauls
     if pml_type is None:
@@ -101,6 +104,8 @@ def pml(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
     bc = DirichletBC(fspace, Constant(0), outer_bdy_id)
 
     solution = Function(fspace)
+    if initial_guess is not None:
+        solution.assign(initial_guess)
 
     #solve(a == L, solution, bcs=[bc], options_prefix=options_prefix)
     # Create a solver and return the KSP object with the solution so that can get
@@ -110,6 +115,11 @@ def pml(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
     # Create solver and call solve
     solver = vs.LinearVariationalSolver(problem, solver_parameters=solver_parameters,
                                         options_prefix=options_prefix)
+    # The linear solve is for the correction to *solution*, so make its
+    # tolerance relative to the right-hand side
+    if initial_guess is not None:
+        with assemble(L).dat.vec_ro as b:
+            set_rhs_relative_tolerance(solver.snes.getKSP(), b)
     solver.solve()
 
     return solver.snes, solution
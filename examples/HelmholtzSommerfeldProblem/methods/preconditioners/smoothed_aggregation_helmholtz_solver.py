@@ -19,7 +19,8 @@ from pyamg.aggregation.smooth import jacobi_prolongation_smoother, \
                     richardson_prolongation_smoother, energy_prolongation_smoother
 
  
-__all__ = ['smoothed_aggregation_helmholtz_solver', 'planewaves']
+__all__ = ['smoothed_aggregation_helmholtz_solver', 'planewaves',
+           'predefined_graph_phase']
 
 def planewaves(X, Y, omega=1.0, angles=[0.0]):
     """
@@ -100,6 +101,42 @@ def planewaves3D(X, Y, Z, omega=1.0, angles=[0.0]):
     W = W.T.copy()
     return W
 
+def predefined_graph_phase(ml):
+    """
+    Return the strength of connection and aggregation of each level of
+    a hierarchy built by :func:`smoothed_aggregation_helmholtz_solver`
+
+    Parameters
+    ----------
+
+    ml : {multilevel_solver}
+        A hierarchy built by :func:`smoothed_aggregation_helmholtz_solver`
+
+    Returns
+    -------
+    (strength, aggregate), lists of ('predefined', {'C': C}) and
+    ('predefined', {'AggOp': AggOp}) which, passed as the strength and
+    aggregate of :func:`smoothed_aggregation_helmholtz_solver`, reproduce
+    the aggregates of *ml* without computing them again.
+
+    Notes
+    -----
+    These only depend on the sparsity pattern of the matrix (and the
+    mesh vertices, for distance based strength) and the number of
+    candidates on each level, not on the matrix values, if the
+    strength considers all connections strong on the coarse levels
+    (e.g. ('symmetric', {'theta': 0.0})). For Helmholtz problems they
+    can then be computed once per mesh and reused for every wave number,
+    only recomputing the (wave number dependent) candidates, prolongator
+    smoothing and coarse operators.
+
+    """
+    strength = [('predefined', {'C': level.C}) for level in ml.levels[:-1]]
+    aggregate = [('predefined', {'AggOp': level.AggOp})
+                 for level in ml.levels[:-1]]
+    return strength, aggregate
+
+
 def preprocess_planewaves(planewaves, max_levels):
     # Helper function for smoothed_aggregation_solver.   
     # Will extend planewaves to a length max_levels list, repeating
@@ -3,20 +3,262 @@ ADAPTED FROM pyamg-examples/ComplexSymmetric/demo_two_D_helmholtz.py
 
 2D Helmholz Problem preconditioner
 """
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+from time import perf_counter
+
 import numpy as np
 import scipy
 import pyamg
 import firedrake as fd
+from pyamg.multilevel import multilevel_solver
+from pyamg.relaxation.smoothing import change_smoothers
 
 from .smoothed_aggregation_helmholtz_solver import \
-    smoothed_aggregation_helmholtz_solver, planewaves, planewaves3D
+    smoothed_aggregation_helmholtz_solver, planewaves, planewaves3D, \
+    predefined_graph_phase
 
 from .my_vis import my_vis, shrink_elmts
 
 
+# {{{ Hierarchy cache
+
+# Maximum number of hierarchies (and of graph phases) kept in memory
+hierarchy_cache_size = 8
+
+# maps fingerprints to hierarchies (:class:`pyamg.multilevel.multilevel_solver`),
+# least recently used first
+_hierarchy_cache = OrderedDict()
+
+# maps graph fingerprints to the (wave number independent) strength
+# and aggregation of each level, see :func:`predefined_graph_phase`,
+# least recently used first
+_graph_phase_cache = OrderedDict()
+
+# level attributes needed to rebuild a hierarchy
+_level_attributes = ['A', 'P', 'R', 'B']
+
+
+def hierarchy_fingerprint(Asp, vertices, setup_parameters, with_values=True):
+    """
+        Return a hex digest identifying the hierarchy built for
+        the scipy sparse matrix *Asp* on mesh vertices *vertices*
+        with (hashable by repr) *setup_parameters*.
+
+        The matrix values are rounded to single precision,
+        so that the same matrix assembled in a different order
+        (e.g. by the transmission and the nonlocal method) matches.
+        If *with_values* is *False*, only the sparsity pattern of *Asp*
+        is used.
+    """
+    sha = hashlib.sha1()
+    sha.update(repr((Asp.shape, setup_parameters)).encode())
+    sha.update(np.ascontiguousarray(Asp.indptr).tobytes())
+    sha.update(np.ascontiguousarray(Asp.indices).tobytes())
+    if with_values:
+        sha.update(Asp.data.astype(np.complex64).tobytes())
+    sha.update(vertices.astype(np.float32).tobytes())
+    return sha.hexdigest()
+
+
+def clear_hierarchy_cache():
+    """
+        Drop all hierarchies and graph phases held in memory
+    """
+    _hierarchy_cache.clear()
+    _graph_phase_cache.clear()
+
+
+def _cache_file_name(cache_dir, fingerprint):
+    return os.path.join(cache_dir, 'pyamg-hierarchy-%s.pickle' % fingerprint)
+
+
+def _load_hierarchy(cache_dir, fingerprint, smoother, coarse_solver):
+    """
+        Return the hierarchy with *fingerprint* pickled in *cache_dir*,
+        or *None* if there is none, or it cannot be read (e.g. a truncated
+        pickle, or one written by an incompatible version of pyamg or scipy)
+    """
+    try:
+        with open(_cache_file_name(cache_dir, fingerprint), 'rb') as in_file:
+            level_dicts = pickle.load(in_file)
+    except (OSError, IOError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, IndexError):
+        return None
+
+    levels = []
+    for level_dict in level_dicts:
+        levels.append(multilevel_solver.level())
+        levels[-1].__dict__.update(level_dict)
+
+    # smoothers are closures, so are not pickled, but set up again
+    ml = multilevel_solver(levels, coarse_solver=coarse_solver)
+    change_smoothers(ml, smoother, smoother)
+    return ml
+
+
+def _save_hierarchy(cache_dir, fingerprint, ml):
+    """
+        Pickle the matrices of the hierarchy *ml* to *cache_dir*
+    """
+    level_dicts = [{attr: getattr(level, attr) for attr in _level_attributes
+                    if hasattr(level, attr)}
+                   for level in ml.levels]
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    file_name = _cache_file_name(cache_dir, fingerprint)
+    # Write to a temporary file first so that a reader never
+    # sees a partial pickle
+    with open(file_name + '.tmp', 'wb') as out_file:
+        pickle.dump(level_dicts, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_name + '.tmp', file_name)
+
+# }}}
+
+
+class AMGPreconditionerStats:
+    """
+        Setup and application statistics of an
+        :class:`AMGTransmissionPreconditioner`
+
+        .. attribute:: setup_time
+
+            Time (in seconds) spent setting up the hierarchy
+
+        .. attribute:: setup_source
+
+            Where the hierarchy came from, one of *'built'*,
+            *'reused aggregates'* (see :func:`predefined_graph_phase`),
+            *'memory'*, or *'disk'*
+
+        .. attribute:: operator_complexity
+
+        .. attribute:: grid_complexity
+
+        .. attribute:: level_sizes
+
+            The number of unknowns on each level, finest first
+
+        .. attribute:: napplications
+
+            The number of times the preconditioner was applied
+
+        .. attribute:: apply_time
+
+            The total time (in seconds) spent applying the preconditioner
+
+        .. attribute:: nreductions
+
+            The number of applications whose residual reduction
+            was recorded (see :meth:`add_residuals`)
+
+        .. attribute:: log_reduction_sum
+
+            The sum over those applications of the log of the ratio
+            of final to initial residual norm. Only this summary is
+            kept, so the statistics do not grow with the number of
+            applications.
+    """
+    def __init__(self):
+        self.setup_time = 0.0
+        self.setup_source = None
+        self.operator_complexity = None
+        self.grid_complexity = None
+        self.level_sizes = []
+        self.napplications = 0
+        self.apply_time = 0.0
+        self.nreductions = 0
+        self.log_reduction_sum = 0.0
+
+    def set_hierarchy(self, ml):
+        """
+            Record the complexities and level sizes of the
+            hierarchy *ml*
+        """
+        self.operator_complexity = ml.operator_complexity()
+        self.grid_complexity = ml.grid_complexity()
+        self.level_sizes = [level.A.shape[0] for level in ml.levels]
+
+    def add_residuals(self, residuals):
+        """
+            Record the residual reduction of an application, from the
+            list *residuals* of residual norms of its pyamg iterations
+        """
+        if len(residuals) > 1 and residuals[0] > 0:
+            self.nreductions += 1
+            self.log_reduction_sum += float(np.log(residuals[-1] / residuals[0]))
+
+    def mean_residual_reduction(self):
+        """
+            Return the geometric mean over all applications of the ratio
+            of final to initial residual norm (*None* if not applied)
+        """
+        if not self.nreductions:
+            return None
+        return float(np.exp(self.log_reduction_sum / self.nreductions))
+
+    def as_dict(self, prefix='pyamg_'):
+        """
+            Return a flat dict of the statistics with keys starting
+            with *prefix*, e.g. to add to a row of results
+        """
+        return {prefix + 'setup_time': self.setup_time,
+                prefix + 'setup_source': self.setup_source,
+                prefix + 'operator_complexity': self.operator_complexity,
+                prefix + 'grid_complexity': self.grid_complexity,
+                prefix + 'level_sizes': ' '.join(str(size)
+                                                 for size in self.level_sizes),
+                prefix + 'napplications': self.napplications,
+                prefix + 'apply_time': self.apply_time,
+                prefix + 'residual_reduction': self.mean_residual_reduction()}
+
+    def summary(self):
+        """
+            Return the statistics as a string
+        """
+        lines = ["pyamg setup (%s): %.4gs" % (self.setup_source, self.setup_time),
+                 "  operator complexity %s, grid complexity %s"
+                 % (self.operator_complexity, self.grid_complexity),
+                 "  level sizes: %s" % self.level_sizes,
+                 "  %d applications, %.4gs total"
+                 % (self.napplications, self.apply_time),
+                 "  mean residual reduction: %s" % self.mean_residual_reduction()]
+        return '\n'.join(lines)
+
+    def print_summary(self):
+        print(self.summary())
+
+
+# names of the entries of :meth:`AMGPreconditionerStats.as_dict`
+stats_field_names = sorted(AMGPreconditionerStats().as_dict().keys())
+
+
 class AMGTransmissionPreconditioner:
     def __init__(self, kappa, fspace, fd_mat, use_plane_waves=False,
-                 tol=None, maxiter=None):
+                 tol=None, maxiter=None, cache_dir=None, verbose=False):
+        """
+            :arg cache_dir: If not *None*, a directory to pickle
+                the hierarchy to (and load it from), in addition
+                to keeping it in memory.
+            :arg verbose: If *True*, print the residuals of
+                each application
+
+            Statistics of the setup and of each application are
+            collected in :attr:`stats`, an :class:`AMGPreconditionerStats`.
+
+            The hierarchy is cached by a fingerprint of *fd_mat*,
+            the mesh vertices and the setup parameters
+            (see :func:`hierarchy_fingerprint`), so solving with
+            the same matrix again (e.g. with another method)
+            skips the setup.
+        """
+        self.verbose = verbose
+        self.stats = AMGPreconditionerStats()
+        setup_start = perf_counter()
+
         #FIXME
         three_D = False
         if fspace.mesh().geometric_dimension() == 3:
@@ -122,18 +364,74 @@ class AMGTransmissionPreconditioner:
             use_constant = (True, {'last_level': 10})
             pwave_args = [None]
 
-        self.sa = smoothed_aggregation_helmholtz_solver(Asp,
-                                                        planewaves=pwave_args,
-                                                        use_constant=use_constant,
-                                                        strength=strength,
-                                                        smooth=smooth,
-                                                        aggregate=aggregate,
-                                                        improve_candidates=improve_candidates,
-                                                        presmoother=smoother,
-                                                        postsmoother=smoother,
-                                                        **SA_build_args)
+        # {{{ Get the hierarchy from the cache, or build it
+
+        fingerprint = hierarchy_fingerprint(
+            Asp, vertices, (omega, use_plane_waves, sorted(SA_build_args.items())))
+
+        self.sa = _hierarchy_cache.pop(fingerprint, None)
+        self.stats.setup_source = 'memory'
+        if self.sa is None and cache_dir is not None:
+            self.sa = _load_hierarchy(cache_dir, fingerprint, smoother,
+                                      SA_build_args['coarse_solver'])
+            self.stats.setup_source = 'disk'
+        if self.sa is None:
+            # The strength and aggregation only depend on the mesh, sparsity
+            # pattern and number of candidates (all coarse connections are
+            # strong), so are computed once and reused for every kappa
+            graph_fingerprint = hierarchy_fingerprint(
+                Asp, vertices, (use_plane_waves, sorted(SA_build_args.items())),
+                with_values=False)
+            graph_phase = _graph_phase_cache.pop(graph_fingerprint, None)
+
+            def build_hierarchy(strength, aggregate):
+                # (planewaves is extended in place, so pass a copy)
+                return smoothed_aggregation_helmholtz_solver(
+                    Asp, planewaves=list(pwave_args), use_constant=use_constant,
+                    strength=strength, smooth=smooth, aggregate=aggregate,
+                    improve_candidates=improve_candidates,
+                    presmoother=smoother, postsmoother=smoother,
+                    **SA_build_args)
+
+            if graph_phase is not None:
+                try:
+                    self.sa = build_hierarchy(*graph_phase)
+                    self.stats.setup_source = 'reused aggregates'
+                except ValueError:
+                    # The aggregates did not fit after all,
+                    # e.g. if some coarse entries cancelled
+                    graph_phase = None
+            if self.sa is None:
+                self.sa = build_hierarchy(strength, aggregate)
+                self.stats.setup_source = 'built'
+                graph_phase = predefined_graph_phase(self.sa)
+
+            # (re-)insert as most recently used
+            _graph_phase_cache[graph_fingerprint] = graph_phase
+            while len(_graph_phase_cache) > hierarchy_cache_size:
+                _graph_phase_cache.popitem(last=False)
+
+            if cache_dir is not None:
+                _save_hierarchy(cache_dir, fingerprint, self.sa)
+
+        # (re-)insert as most recently used
+        _hierarchy_cache[fingerprint] = self.sa
+        while len(_hierarchy_cache) > hierarchy_cache_size:
+            _hierarchy_cache.popitem(last=False)
+
+        # }}}
+
+        self.stats.set_hierarchy(self.sa)
+        self.stats.setup_time = perf_counter() - setup_start
+
     def apply(self, pc, x, y):
+        start = perf_counter()
         residuals = []
         # y <- A^{-1} x
         y[:] = self.sa.solve(x.getArray(), x0=self.x0, residuals=residuals, **self.SA_solve_args)[:]
-        print("RESIDUALS=", residuals)
+
+        self.stats.apply_time += perf_counter() - start
+        self.stats.napplications += 1
+        self.stats.add_residuals(residuals)
+        if self.verbose:
+            print("RESIDUALS=", residuals)
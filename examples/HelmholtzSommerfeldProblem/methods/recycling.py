@@ -0,0 +1,175 @@
+import numpy as np
+import scipy.linalg as la
+
+from firedrake.petsc import PETSc
+
+
+def recycling_ksp(comm=None):
+    """
+        Return a new PETSc KSP to use for each of a sequence of related
+        solves (e.g. neighboring wave numbers, or new right-hand sides),
+        so that it carries its recycled subspace from one solve into the
+        next. Configure it with :func:`recycling_parameters`.
+    """
+    if comm is None:
+        comm = PETSc.COMM_WORLD
+    return PETSc.KSP().create(comm=comm)
+
+
+def recycling_parameters(solver_parameters, recycle):
+    """
+        Return a copy of *solver_parameters* for Krylov subspace
+        recycling with GCRO-DR (PETSc's *'ksp_type': 'hpddm'* with
+        *'ksp_hpddm_type': 'gcrodr'*, so PETSc must be built with
+        hpddm), keeping a deflation subspace of dimension *recycle*.
+        The subspace is only carried into the next solve if the same
+        KSP is used for it (see :func:`recycling_ksp`).
+
+        If the *'ksp_type'* of *solver_parameters* is flexible
+        (*'fgmres'* or *'gcr'*), so is the recycling variant.
+    """
+    solver_parameters = dict(solver_parameters)
+    ksp_type = solver_parameters.get('ksp_type', None)
+    if ksp_type == 'preonly':
+        raise ValueError("Cannot recycle a subspace with ksp_type 'preonly'")
+
+    solver_parameters['ksp_type'] = 'hpddm'
+    solver_parameters['ksp_hpddm_type'] = 'gcrodr'
+    solver_parameters['ksp_hpddm_recycle'] = int(recycle)
+    if ksp_type in ['fgmres', 'gcr']:
+        solver_parameters['ksp_hpddm_variant'] = 'flexible'
+    return solver_parameters
+
+
+def is_flexible(ksp, solver_parameters):
+    """
+        Return whether *ksp*, with its options set from *solver_parameters*,
+        tolerates a preconditioner or operator changing between iterations
+    """
+    if ksp.getType() in [PETSc.KSP.Type.FGMRES, PETSc.KSP.Type.GCR]:
+        return True
+    return ksp.getType() == 'hpddm' \
+        and solver_parameters.get('ksp_hpddm_variant', None) == 'flexible'
+
+
+class ProjectedWarmStart(object):
+    r"""
+        A warm start for a sequence of related systems
+        :math:`A_i x_i = b_i` (e.g. neighboring wave numbers, or new
+        right-hand sides) on the same function space, from the
+        (at most *max_size* most recent) previous solutions.
+
+        Before each solve, :meth:`initial_guess` projects onto their span:
+        with *U* a basis of it, the initial guess is :math:`x_0 = U y`,
+        where *y* minimizes :math:`\|b - A U y\|`. This is not Krylov
+        subspace recycling, since nothing is deflated in the iterations
+        (see :func:`recycling_parameters` for that).
+
+        This costs one application of *A* per stored solution on each
+        solve (for the nonlocal integral equation, one application of its
+        python matrix *B*, i.e. two FMMs), so it pays off when *A* is cheap
+        to apply compared to a Krylov iteration, or saves several iterations.
+
+        .. attribute:: max_size
+
+            The maximum number of vectors kept
+
+        .. attribute:: vectors
+
+            The PETSc Vecs spanning the subspace, oldest first
+    """
+    def __init__(self, max_size):
+        """
+            :arg max_size: The maximum number of vectors kept
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1, not %s" % max_size)
+        self.max_size = max_size
+        self.vectors = []
+
+    def initial_guess(self, A, b, x):
+        r"""
+            Set *x* to the minimal residual guess for *A x = b* in the
+            subspace (zero if the subspace is empty).
+
+            :arg A: The operator, a PETSc Mat
+            :arg b: The right-hand side, a PETSc Vec
+            :arg x: The PETSc Vec to write the initial guess into
+
+            Returns :math:`\|b - A x\| / \|b\|`
+
+            Only global reductions of PETSc Vecs are used,
+            so this runs in parallel.
+        """
+        x.set(0)
+        b_norm = b.norm()
+        if not self.vectors or b_norm == 0:
+            return 1.0
+
+        # {{{ A U = Q R by modified Gram-Schmidt, dropping dependent columns
+
+        basis = []
+        Q = []
+        R = np.zeros((len(self.vectors), len(self.vectors)), dtype=np.complex128)
+        for u in self.vectors:
+            q = A.createVecLeft()
+            A.mult(u, q)
+            column_norm = q.norm()
+
+            i = len(Q)
+            for j, q_j in enumerate(Q):
+                R[j, i] = q.dot(q_j)
+                q.axpy(-R[j, i], q_j)
+            R[i, i] = q.norm()
+            if R[i, i] <= 1e-12 * column_norm:
+                R[:, i] = 0
+                continue
+
+            q.scale(1 / R[i, i])
+            Q.append(q)
+            basis.append(u)
+
+        # }}}
+
+        if not basis:
+            return 1.0
+
+        # y = R^{-1} Q^H b, and the residual is b - Q Q^H b
+        coeffs = np.array([b.dot(q) for q in Q])
+        y = la.solve_triangular(R[:len(Q), :len(Q)], coeffs)
+        for coeff, u in zip(y, basis):
+            x.axpy(coeff, u)
+
+        residual = b.copy()
+        for coeff, q in zip(coeffs, Q):
+            residual.axpy(-coeff, q)
+        return residual.norm() / b_norm
+
+    def add(self, x):
+        """
+            Add (a copy of) the solution *x* to the subspace,
+            dropping the oldest vector if it is full
+        """
+        if x.norm() == 0:
+            return
+        self.vectors.append(x.copy())
+        if len(self.vectors) > self.max_size:
+            self.vectors.pop(0)
+
+
+def set_rhs_relative_tolerance(ksp, b):
+    r"""
+        Firedrake's linear solvers solve for the correction to the
+        initial guess, so the relative tolerance of *ksp* is relative
+        to the initial residual, and a good initial guess asks for more
+        accuracy than a solve from zero. Raise the absolute tolerance
+        of *ksp* to its relative tolerance times :math:`\|b\|`, so that
+        it stops where a solve of :math:`A x = b` from zero does
+        (exactly if *ksp* measures the unpreconditioned residual).
+
+        :arg ksp: A PETSc KSP, with its tolerances already set from
+            its options
+        :arg b: The right-hand side, a PETSc Vec
+    """
+    rtol, atol, _, _ = ksp.getTolerances()
+    ksp.setTolerances(atol=max(atol, rtol * b.norm()))
@@ -5,8 +5,9 @@ from firedrake import FunctionSpace, VectorFunctionSpace, Function, grad, \
 import fd2mm
 
 from .pml import pml
-from .nonlocal_integral_eq import nonlocal_integral_eq
+from .nonlocal_integral_eq import NonlocalIntegralEquation
 from .transmission import transmission
+from .recycling import ProjectedWarmStart, recycling_ksp, recycling_parameters
 
 
 trial_options = set(['mesh', 'degree', 'true_sol_expr'])
@@ -27,8 +28,15 @@ method_options = {'pml': ['pml_type',
                   'nonlocal': ['FMM Order',
                                'qbx_order',
                                'fine_order',
+                               'inexact_levels',
+                               'relaxation',
+                               'inner_fmm_order',
+                               'inner_qbx_order',
+                               'inner_mode',
+                               'recycle',
+                               'projected_warm_start',
                                ],
-                  'transmission': []}
+                  'transmission': ['recycle', 'projected_warm_start']}
 
 
 prepared_trials = {}
@@ -78,6 +86,18 @@ def run_method(trial, method, wave_number,
 
         kwargs should include the method options for :arg:`trial['method']`.
         for the given method.
+
+        kwargs may include 'initial_guess', a function in the function
+        space of the trial to start the solve from.
+
+        For the nonlocal and transmission methods, kwargs may include
+
+        * 'recycle': n, to solve with GCRO-DR, carrying a recycled subspace
+          of dimension n from solve to solve on the same mesh and degree
+          (see :func:`methods.recycling.recycling_parameters`)
+        * 'projected_warm_start': n, to start each solve from the projection
+          onto the (up to n) previous solutions on the same mesh and degree
+          (see :class:`methods.recycling.ProjectedWarmStart`)
     """
     # Get boundary ids
     scatterer_bdy_id = kwargs['scatterer_bdy_id']
@@ -101,6 +121,27 @@ def run_method(trial, method, wave_number,
         memoized_objects[memo_key] = {}
 
     comp_sol = None
+    initial_guess = kwargs.get('initial_guess', None)
+
+    # Reuse one ksp from solve to solve to recycle a subspace, if requested
+    ksp = None
+    recycle = kwargs.get('recycle', None)
+    if recycle:
+        solver_parameters = recycling_parameters(solver_parameters, recycle)
+        ksp_key = ('recycling_ksp', method, recycle)
+        if ksp_key not in memoized_objects[memo_key]:
+            memoized_objects[memo_key][ksp_key] = recycling_ksp()
+        ksp = memoized_objects[memo_key][ksp_key]
+
+    # Carry the previous solutions from solve to solve, if requested
+    warm_start = None
+    projected_warm_start = kwargs.get('projected_warm_start', None)
+    if projected_warm_start:
+        warm_start_key = ('projected_warm_start', method, projected_warm_start)
+        if warm_start_key not in memoized_objects[memo_key]:
+            memoized_objects[memo_key][warm_start_key] = \
+                ProjectedWarmStart(projected_warm_start)
+        warm_start = memoized_objects[memo_key][warm_start_key]
 
     # Handle any special kwargs and get computed solution
     if method == 'pml':
@@ -132,6 +173,7 @@ def run_method(trial, method, wave_number,
                              speed=speed,
                              pml_min=pml_min,
                              pml_max=pml_max,
+                             initial_guess=initial_guess,
                              )
         snes_or_ksp = snes
 
@@ -150,6 +192,29 @@ def run_method(trial, method, wave_number,
                       'fmm_order': fmm_order,
                       'fmm_backend': 'fmmlib',
                       }
+
+        # Cheaper (fmm_order, qbx_order[, accuracy]) levels for inexact
+        # Krylov, a qbx_order of *None* keeps *qbx_order*
+        relaxed_qbx_kwargs = []
+        for level in kwargs.get('inexact_levels', []):
+            level_fmm_order, level_qbx_order = level[:2]
+            level_kwargs = {'fmm_order': level_fmm_order}
+            if level_qbx_order is not None:
+                level_kwargs['qbx_order'] = level_qbx_order
+            if len(level) > 2:
+                level_kwargs['accuracy'] = level[2]
+            relaxed_qbx_kwargs.append(level_kwargs)
+        relaxation = kwargs.get('relaxation', None)
+
+        # Cheaper operator for the 'nonlocal' pc_type
+        inner_qbx_kwargs = None
+        inner_mode = kwargs.get('inner_mode', None)
+        for inner_key, qbx_key in [('inner_fmm_order', 'fmm_order'),
+                                   ('inner_qbx_order', 'qbx_order')]:
+            if inner_key in kwargs:
+                if inner_qbx_kwargs is None:
+                    inner_qbx_kwargs = {}
+                inner_qbx_kwargs[qbx_key] = kwargs[inner_key]
         # }}}
 
         # Make function converter if not already built
@@ -160,16 +225,32 @@ def run_method(trial, method, wave_number,
 
         fspace_analog = memoized_objects[memo_key]['fspace_analog']
 
-        ksp, comp_sol = nonlocal_integral_eq(
-            mesh, scatterer_bdy_id, outer_bdy_id,
-            wave_number,
-            options_prefix=options_prefix,
-            solver_parameters=solver_parameters,
-            fspace=fspace, vfspace=vfspace,
-            true_sol_grad=true_sol_grad,
-            queue=queue, fspace_analog=fspace_analog,
-            qbx_kwargs=qbx_kwargs,
-            )
+        # Build the (wave number independent) solver once for
+        # each set of bdys and qbx kwargs, then reuse it
+        # for every wave number
+        solver_key = ('nonlocal', scatterer_bdy_id, outer_bdy_id, queue,
+                      tuple(sorted(qbx_kwargs.items())),
+                      tuple(tuple(sorted(level_kwargs.items()))
+                            for level_kwargs in relaxed_qbx_kwargs),
+                      tuple(sorted((inner_qbx_kwargs or {}).items())), inner_mode)
+        if solver_key not in memoized_objects[memo_key]:
+            memoized_objects[memo_key][solver_key] = NonlocalIntegralEquation(
+                mesh, scatterer_bdy_id, outer_bdy_id,
+                fspace=fspace, vfspace=vfspace,
+                queue=queue, fspace_analog=fspace_analog,
+                qbx_kwargs=qbx_kwargs,
+                relaxed_qbx_kwargs=relaxed_qbx_kwargs,
+                inner_qbx_kwargs=inner_qbx_kwargs,
+                inner_mode=inner_mode,
+                )
+
+        solver = memoized_objects[memo_key][solver_key]
+        ksp, comp_sol = solver.solve(wave_number, true_sol_grad,
+                                     options_prefix=options_prefix,
+                                     solver_parameters=solver_parameters,
+                                     relaxation=relaxation,
+                                     ksp=ksp, warm_start=warm_start,
+                                     initial_guess=initial_guess)
 
         snes_or_ksp = ksp
 
@@ -181,6 +262,8 @@ def run_method(trial, method, wave_number,
                                       solver_parameters=solver_parameters,
                                       fspace=fspace,
                                       true_sol_grad=true_sol_grad,
+                                      ksp=ksp, warm_start=warm_start,
+                                      initial_guess=initial_guess,
                                       )
         snes_or_ksp = snes
     else:
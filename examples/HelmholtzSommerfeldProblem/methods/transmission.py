@@ -3,14 +3,32 @@ from firedrake import FunctionSpace, Function, TrialFunction, TestFunction, \
     FacetNormal, inner, dot, grad, dx, ds, Constant, \
     assemble
 from firedrake.exceptions import ConvergenceError
+from firedrake.petsc import OptionsManager
 from .preconditioners.two_D_helmholtz import AMGTransmissionPreconditioner
+from .recycling import set_rhs_relative_tolerance
 
 
 def transmission(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
                  options_prefix=None, solver_parameters=None,
                  fspace=None, true_sol_grad=None,
+                 ksp=None, warm_start=None, initial_guess=None,
                  ):
     r"""
+        Returns *(snes_or_ksp, solution)*
+
+        :arg initial_guess: If not *None*, a function in *fspace* to start
+            the solve from (ignored if *warm_start* is not *None*)
+        :arg warm_start: If not *None*, a
+            :class:`methods.recycling.ProjectedWarmStart` to
+            take the initial guess from, and to which the solution
+            is added. The relative residual of the initial guess
+            is attached to the ksp as its *'projected_residual'*
+            attribute.
+        :arg ksp: If not *None*, a PETSc KSP to solve with (and return)
+            instead of the one of a new :class:`LinearVariationalSolver`,
+            e.g. a :func:`methods.recycling.recycling_ksp` to carry its
+            recycled subspace from solve to solve
+
         preconditioner_gamma and preconditioner_lambda are used to precondition
         with the following equation:
 
@@ -27,6 +45,8 @@ def transmission(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
     L = inner(inner(true_sol_grad, n), v) * ds(scatterer_bdy_id)
 
     solution = Function(fspace)
+    if initial_guess is not None:
+        solution.assign(initial_guess)
 
     #       {{{ Used for preconditioning
     if 'gamma' in solver_parameters or 'beta' in solver_parameters:
@@ -53,27 +73,76 @@ def transmission(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
         pyamg_maxiter = solver_params.get('pyamg_maxiter', None)
         if pyamg_maxiter is not None:
             pyamg_maxiter = int(pyamg_maxiter)
+        pyamg_cache_dir = solver_params.pop('pyamg_cache_dir', None)
+        pyamg_verbose = bool(solver_params.pop('pyamg_verbose', False))
         del solver_params['pc_type']
 
-    # Create a solver and return the KSP object with the solution so that can get
-    # PETSc information
-    # Create problem
-    problem = vs.LinearVariationalProblem(a, L, solution, aP=aP)
+    if ksp is not None:
+        # Solve with *ksp* directly for the solution (not a correction)
+        A = assemble(a).M.handle
+        P = A if aP is None else assemble(aP).M.handle
+        ksp.setOperators(A, P)
+        # The monitors are set again from the options below
+        ksp.cancelMonitor()
+    else:
+        # Create a solver and return the KSP object with the solution so that
+        # can get PETSc information
+        # Create problem
+        problem = vs.LinearVariationalProblem(a, L, solution, aP=aP)
+
+        # Create solver and call solve
+        solver = vs.LinearVariationalSolver(problem,
+                                            solver_parameters=solver_params,
+                                            options_prefix=options_prefix)
+        if using_pyamg or warm_start is not None:
+            A = assemble(a).M.handle
 
-    # Create solver and call solve
-    solver = vs.LinearVariationalSolver(problem, solver_parameters=solver_params,
-                                        options_prefix=options_prefix)
     # prepare to set up pyamg preconditioner if using it
     if using_pyamg:
-        A = assemble(a).M.handle
-        pc = solver.snes.getKSP().pc
+        if ksp is not None:
+            ksp.setUp()
+            pc_ksp = ksp
+        else:
+            pc_ksp = solver.snes.getKSP()
+        pc = pc_ksp.pc
         pc.setType(pc.Type.PYTHON)
-        pc.setPythonContext(AMGTransmissionPreconditioner(wave_number,
-                                                          fspace,
-                                                          A,
-                                                          tol=pyamg_tol,
-                                                          maxiter=pyamg_maxiter,
-                                                          use_plane_waves=True))
+        amg_pc = AMGTransmissionPreconditioner(wave_number,
+                                               fspace,
+                                               A,
+                                               tol=pyamg_tol,
+                                               maxiter=pyamg_maxiter,
+                                               use_plane_waves=True,
+                                               cache_dir=pyamg_cache_dir,
+                                               verbose=pyamg_verbose)
+        pc.setPythonContext(amg_pc)
+        pc_ksp.setAttr('pyamg_stats', amg_pc.stats)
+
+    if ksp is not None:
+        options_manager = OptionsManager(solver_params, options_prefix)
+        options_manager.set_from_options(ksp)
+        ksp.setInitialGuessNonzero(warm_start is not None
+                                   or initial_guess is not None)
+        with assemble(L).dat.vec_ro as b:
+            with solution.dat.vec as x:
+                if warm_start is not None:
+                    ksp.setAttr('projected_residual',
+                                warm_start.initial_guess(A, b, x))
+                ksp.solve(b, x)
+                if warm_start is not None:
+                    warm_start.add(x)
+        return ksp, solution
+
+    # Start from the projection onto previous solutions, if any.
+    # The linear solve is for the correction to *solution*, so for
+    # a nonzero initial guess make its tolerance relative to the right-hand side
+    if warm_start is not None or initial_guess is not None:
+        ksp = solver.snes.getKSP()
+        with assemble(L).dat.vec_ro as b:
+            if warm_start is not None:
+                with solution.dat.vec as x:
+                    ksp.setAttr('projected_residual',
+                                warm_start.initial_guess(A, b, x))
+            set_rhs_relative_tolerance(ksp, b)
 
     # If using pyamg as preconditioner, use it!
     try:
@@ -81,4 +150,8 @@ def transmission(mesh, scatterer_bdy_id, outer_bdy_id, wave_number,
     except ConvergenceError:
         pass
 
+    if warm_start is not None:
+        with solution.dat.vec_ro as x:
+            warm_start.add(x)
+
     return solver.snes, solution
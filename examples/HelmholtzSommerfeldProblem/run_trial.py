@@ -13,11 +13,14 @@ from firedrake import sqrt, Constant, pi, exp, Mesh, SpatialCoordinate, \
 
 import utils.norm_functions as norms
 from methods import run_method
+from methods.nonlocal_integral_eq import fmm_accuracy
+from methods.preconditioners.two_D_helmholtz import stats_field_names
 
 from firedrake.petsc import OptionsManager, PETSc
 from firedrake.solving_utils import KSPReasons
 from utils.hankel_function import hankel_function
 from utils.to_2nd_order import to_2nd_order
+from utils.prolong import prolong
 
 import faulthandler
 faulthandler.enable()
@@ -35,8 +38,44 @@ method_list = ['nonlocal']
 #              via the command line or *method_to_kwargs*):
 # 'pyamg_maxiter' and 'pyamg_tol' to change the default pyamg maxiter or tol
 # for preconditioning
+# 'pyamg_cache_dir' to also pickle pyamg hierarchies to (and load them from)
+# this directory. They are always reused within a run.
+# 'pyamg_verbose' to print the pyamg residuals of every application
+# (the pyamg setup and application statistics are recorded either way)
 #
 # Use 'gamma' or 'beta' for an altering of the preconditioner (non-pyamg).
+#
+# For inexact Krylov with the nonlocal method, set 'relaxation' to one of
+# 'bouras-fraysse' or 'simoncini-szyld' and 'inexact_levels' to a list of
+# cheaper (fmm_order, qbx_order) pairs (qbx_order may be *None*) in the
+# nonlocal kwargs. The accuracy of each level is estimated from its fmm_order
+# only, so give levels lowering the qbx_order their accuracy as a third entry,
+# (fmm_order, qbx_order, accuracy). Use 'ksp_type': 'fgmres' (or 'gcr'; other ksp
+# types raise an error, since the operator changes between iterations)
+#
+# To precondition the nonlocal method with an inner solve on a cheaper
+# nonlocal operator, use 'pc_type': 'nonlocal' with 'ksp_type': 'fgmres'
+# (or 'gcr'; other ksp types raise an error)
+# and set any of 'inner_fmm_order', 'inner_qbx_order', 'inner_mode'
+# (e.g. 'dense', 'hmatrix' or 'numpy') in the nonlocal kwargs. The inner solve
+# is configured by 'nonlocal_inner_rtol', 'nonlocal_inner_maxiter'
+# and 'nonlocal_inner_pc_type' in the solver parameters
+#
+# To solve the nonlocal method directly (sparse LU plus a low-rank update for
+# the nonlocal coupling), use 'pc_type': 'woodbury' with 'ksp_type': 'preonly'
+# ('woodbury_tol', 'woodbury_mat_solver_type' and 'woodbury_coupling_mode'
+# configure it). Its relative residual against the nonlocal operator is
+# printed. This only runs in serial.
+#
+# To recycle a Krylov subspace of dimension n from solve to solve on the same
+# mesh in the nonlocal or transmission method, set 'recycle': n in their kwargs.
+# This solves with GCRO-DR (PETSc's hpddm KSP, so PETSc must be built with
+# hpddm), flexible if the ksp_type was fgmres or gcr. To instead start each
+# solve from the minimal residual projection onto (up to n) previous solutions,
+# set 'projected_warm_start': n. The projection costs one operator application
+# per stored solution on each solve (two FMMs for the nonlocal method).
+# If the same trial without either is in the cache (or was run earlier),
+# the iterations saved are recorded.
 method_to_kwargs = {
     'transmission': {
         'options_prefix': 'transmission',
@@ -71,6 +110,14 @@ method_to_kwargs = {
 # Use cache if have it?
 use_cache = False
 
+# Setup fields added since older cache files were written, and the
+# value they had in those trials
+setup_field_defaults = {'Relaxation': '',
+                        'Recycle': '',
+                        'Projected Warm Start': '',
+                        'Warm Start': str(False),
+                        }
+
 # Write over duplicate trials?
 write_over_duplicate_trials = True
 
@@ -87,6 +134,15 @@ visualize = False
 # use 2nd order mesh?
 use_2nd_order = False
 
+# Warm start each solve? If so, start from the solution for the same kappa
+# on the next-coarser mesh (prolonged onto this mesh) if there is one, else
+# from the solution for the previous kappa on this mesh. If the same trial
+# without warm start is in the cache (or was run earlier), the iterations
+# saved are recorded. Trials loaded from the cache are not rerun, so leave
+# no solution to warm start from: the next trial starts from the coarse mesh
+# solution or from zero, as recorded in its 'Initial Guess'.
+warm_start = False
+
 
 def get_fmm_order(kappa, h):
     """
@@ -114,14 +170,28 @@ try:
     cache = {}
 
     for i, entry in enumerate(cache_reader):
+        # Older cache files recorded the projected warm start as 'Recycle'
+        if 'Recycled Residual' in entry:
+            entry['Projected Warm Start'] = entry.pop('Recycle')
+            entry['Projected Residual'] = entry.pop('Recycled Residual')
+            entry['Projected Iterations Saved'] = entry.pop('Iterations Saved', '')
 
         output = {}
         for output_name in ['L2 Error', 'H1 Error', 'ndofs',
                             'Iteration Number', 'Residual Norm', 'Converged Reason',
                             'Min Extreme Singular Value',
-                            'Max Extreme Singular Value']:
-            output[output_name] = entry[output_name]
-            del entry[output_name]
+                            'Max Extreme Singular Value',
+                            'Work Saved Fraction', 'Inner Iteration Number',
+                            'Iterations Saved', 'Projected Residual',
+                            'Projected Iterations Saved',
+                            'Initial Guess', 'Warm Start Iterations Saved',
+                            *stats_field_names]:
+            # Older cache files may not have every output
+            output[output_name] = entry.pop(output_name, '')
+        # nor every setup field
+        for setup_field, default in setup_field_defaults.items():
+            if not entry.get(setup_field):
+                entry[setup_field] = default
         cache[frozenset(entry.items())] = output
 
     in_file.close()
@@ -134,6 +204,25 @@ uncached_results = {}
 if write_over_duplicate_trials:
     uncached_results = cache
 
+
+def get_iterations_saved(setup_info, baseline_field, baseline_value,
+                         iteration_number):
+    """
+        Return the number of iterations saved against the trial
+        with *setup_info* but *baseline_value* for *baseline_field*,
+        or *None* if that trial has not been run
+    """
+    baseline_info = dict(setup_info)
+    baseline_info[baseline_field] = baseline_value
+    baseline_key = frozenset(baseline_info.items())
+    baseline_results = uncached_results.get(baseline_key,
+                                            cache.get(baseline_key, {}))
+    baseline_its = baseline_results.get('Iteration Number', '')
+    if baseline_its == '':
+        return None
+    return int(baseline_its) - iteration_number
+
+
 # Hankel approximation cutoff
 if mesh_dim == 2:
     hankel_cutoff = 80
@@ -266,7 +355,18 @@ field_names = ('h', 'degree', 'kappa', 'method',
                'gamma', 'beta', 'ksp_type',
                'Residual Norm', 'Converged Reason', 'ksp_rtol', 'ksp_atol',
                'Min Extreme Singular Value', 'Max Extreme Singular Value',
-               'pyamg_maxiter', 'pyamg_tol')
+               'pyamg_maxiter', 'pyamg_tol', 'Relaxation', 'Work Saved Fraction',
+               'Inner Iteration Number', 'Recycle', 'Iterations Saved',
+               'Projected Warm Start', 'Projected Residual',
+               'Projected Iterations Saved', 'Warm Start', 'Initial Guess',
+               'Warm Start Iterations Saved') + tuple(stats_field_names)
+# For warm starts: solutions on the current mesh and the next-coarser one
+# by (method, degree, kappa), and on the current mesh for the previous kappa
+# by (method, degree)
+mesh_solutions = {}
+coarse_solutions = {}
+previous_kappa_solutions = {}
+
 mesh = None
 for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
     setup_info['h'] = str(mesh_h)
@@ -275,6 +375,10 @@ for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
         del mesh
         mesh = None
 
+    coarse_solutions = mesh_solutions
+    mesh_solutions = {}
+    previous_kappa_solutions = {}
+
     for degree in degree_list:
         setup_info['degree'] = str(degree)
 
@@ -304,12 +408,22 @@ for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
                     fmm_order = get_fmm_order(kappa, mesh_h)
                     setup_info['FMM Order'] = str(fmm_order)
                     method_to_kwargs[method]['FMM Order'] = fmm_order
+                    setup_info['Relaxation'] = \
+                        str(method_to_kwargs[method].get('relaxation', None) or '')
                 else:
                     setup_info['FMM Order'] = ''
+                    setup_info['Relaxation'] = ''
+                setup_info['Recycle'] = \
+                    str(method_to_kwargs[method].get('recycle', None) or '')
+                setup_info['Projected Warm Start'] = str(
+                    method_to_kwargs[method].get('projected_warm_start', None)
+                    or '')
+                setup_info['Warm Start'] = str(warm_start)
 
                 # Add gamma/beta & pyamg info to setup_info if there, else make sure
                 # it's recorded as absent in special_key
-                if solver_params['pc_type'] != 'pyamg':
+                if solver_params['pc_type'] != 'pyamg' and \
+                        solver_params.get('nonlocal_inner_pc_type') != 'pyamg':
                     solver_params.pop('pyamg_maxiter', None)
                     solver_params.pop('pyamg_tol', None)
                 for special_key in ['gamma', 'beta', 'pyamg_maxiter', 'pyamg_tol']:
@@ -333,6 +447,11 @@ for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
                 # Gets computed solution, prints and caches
                 key = frozenset(setup_info.items())
 
+                # A cached trial leaves no solution for the next kappa to
+                # warm start from, so drop the one for an earlier kappa
+                if warm_start and use_cache and key in cache:
+                    previous_kappa_solutions.pop((method, degree), None)
+
                 if not use_cache or key not in cache:
                     # {{{  Read in mesh if haven't already
                     if mesh is None:
@@ -351,10 +470,32 @@ for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
                     # }}}
 
                     kwargs = method_to_kwargs[method]
+
+                    # {{{ Get initial guess if warm starting
+
+                    initial_guess_source = ''
+                    if warm_start:
+                        if (method, degree, kappa) in coarse_solutions:
+                            fspace = run_method.prepare_trial(trial,
+                                                              "True Solution")[1]
+                            kwargs = dict(kwargs, initial_guess=prolong(
+                                coarse_solutions[(method, degree, kappa)], fspace))
+                            initial_guess_source = 'coarse mesh'
+                        elif (method, degree) in previous_kappa_solutions:
+                            kwargs = dict(kwargs, initial_guess=(
+                                previous_kappa_solutions[(method, degree)]))
+                            initial_guess_source = 'previous kappa'
+
+                    # }}}
+
                     true_sol, comp_sol, snes_or_ksp = run_method.run_method(
                         trial, method, kappa,
                         comp_sol_name=method + " Computed Solution", **kwargs)
 
+                    if warm_start:
+                        mesh_solutions[(method, degree, kappa)] = comp_sol
+                        previous_kappa_solutions[(method, degree)] = comp_sol
+
                     if isinstance(snes_or_ksp, PETSc.SNES):
                         ksp = snes_or_ksp.getKSP()
                     elif isinstance(snes_or_ksp, PETSc.KSP):
@@ -383,6 +524,61 @@ for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
                     uncached_results[key]['Converged Reason'] = \
                         KSPReasons[ksp.getConvergedReason()]
 
+                    # If used inexact Krylov, record the work saved
+                    work_report = ksp.getAttr('inexact_work_report')
+                    if work_report is not None:
+                        uncached_results[key]['Work Saved Fraction'] = \
+                            work_report['work_saved_fraction']
+                        print("Inexact Krylov applications per level:",
+                              work_report['napplications'])
+                        print("Inexact Krylov work saved: %s s (fraction %s)"
+                              % (work_report['work_saved'],
+                                 work_report['work_saved_fraction']))
+
+                    woodbury_residual = ksp.getAttr('woodbury_residual')
+                    if woodbury_residual is not None:
+                        print("Woodbury relative residual:", woodbury_residual)
+
+                    inner_its = ksp.getAttr('inner_iteration_number')
+                    if inner_its is not None:
+                        uncached_results[key]['Inner Iteration Number'] = inner_its
+
+                    # If recycled, compare to the same trial without recycling
+                    if setup_info['Recycle']:
+                        its_saved = get_iterations_saved(
+                            setup_info, 'Recycle', '', ksp.getIterationNumber())
+                        if its_saved is not None:
+                            uncached_results[key]['Iterations Saved'] = its_saved
+
+                    # If projected, compare to the same trial without projecting
+                    projected_residual = ksp.getAttr('projected_residual')
+                    if projected_residual is not None:
+                        uncached_results[key]['Projected Residual'] = \
+                            projected_residual
+
+                        its_saved = get_iterations_saved(
+                            setup_info, 'Projected Warm Start', '',
+                            ksp.getIterationNumber())
+                        if its_saved is not None:
+                            uncached_results[key]['Projected Iterations Saved'] = \
+                                its_saved
+
+                    # If warm started, compare to the same trial started cold
+                    if initial_guess_source:
+                        uncached_results[key]['Initial Guess'] = \
+                            initial_guess_source
+                        its_saved = get_iterations_saved(
+                            setup_info, 'Warm Start', str(False),
+                            ksp.getIterationNumber())
+                        if its_saved is not None:
+                            uncached_results[key]['Warm Start Iterations Saved'] = \
+                                its_saved
+
+                    # Record the pyamg statistics if used pyamg
+                    pyamg_stats = ksp.getAttr('pyamg_stats')
+                    if pyamg_stats is not None:
+                        uncached_results[key].update(pyamg_stats.as_dict())
+
                     # If using gmres, estimate extreme singular values
                     compute_sing_val_params = set([
                         'ksp_compute_singularvalues',
@@ -412,12 +608,9 @@ for mesh_name, mesh_h in zip(mesh_names, mesh_h_vals):
                 print("method:", method)
                 print('degree:', degree)
                 if setup_info['method'] == 'nonlocal':
-                    if mesh_dim == 2:
-                        c = 0.5
-                    else:
-                        c = 0.75
                     print('Epsilon= %.2f^(%d+1) = %e'
-                          % (c, fmm_order, c**(fmm_order+1)))
+                          % (0.5 if mesh_dim == 2 else 0.75, fmm_order,
+                             fmm_accuracy(mesh_dim, fmm_order)))
 
                 print("L2 Err: ", l2_err)
                 print("H1 Err: ", h1_err)
@@ -0,0 +1,27 @@
+from firedrake import Function, VectorFunctionSpace, SpatialCoordinate
+
+
+def prolong(function, fspace):
+    """
+        Return *function* interpolated onto *fspace*, whose mesh
+        may be a different (e.g. finer, not nested) mesh of the same domain,
+        by evaluating *function* at the nodes of *fspace*.
+        Nodes outside the mesh of *function* get the value 0.
+
+        :arg function: A scalar :class:`firedrake.Function`
+        :arg fspace: A scalar Lagrange :class:`firedrake.FunctionSpace`
+    """
+    result = Function(fspace)
+    if function.function_space() == fspace:
+        result.assign(function)
+        return result
+
+    mesh = fspace.mesh()
+    element = fspace.ufl_element()
+    node_coords = Function(VectorFunctionSpace(mesh, element.family(),
+                                               element.degree()))
+    node_coords.interpolate(SpatialCoordinate(mesh))
+
+    values = function.at(node_coords.dat.data_ro, dont_raise=True)
+    result.dat.data[:] = [0.0 if value is None else value for value in values]
+    return result
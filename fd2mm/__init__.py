@@ -7,11 +7,40 @@
     as providing an easy interface for setting up `pytential`_ operations from
     firedrake (Look at :func:`fd_bind <fd2mm.op.fd_bind>`,
     for more details see :mod:`fd2mm.op`).
+
+    The names below are only imported (along with the libraries they need,
+    e.g. :mod:`pytential` for :func:`fd_bind <fd2mm.op.fd_bind>`)
+    when first used.
 """
-from fd2mm.mesh import MeshAnalog
-from fd2mm.functionspace import FunctionSpaceAnalog
-from fd2mm.function import FunctionAnalog
-from fd2mm.op import fd_bind
+import sys
+
+# Maps each exported name to the submodule it lives in
+_lazy_attributes = {
+    "MeshAnalog": "fd2mm.mesh",
+    "FunctionSpaceAnalog": "fd2mm.functionspace",
+    "FunctionAnalog": "fd2mm.function",
+    "fd_bind": "fd2mm.op",
+    }
 
 
 __all__ = ["MeshAnalog", "FunctionSpaceAnalog", "FunctionAnalog", "fd_bind"]
+
+
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    from importlib import import_module
+    value = getattr(import_module(_lazy_attributes[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
+
+
+# Module level __getattr__ needs python 3.7
+if sys.version_info < (3, 7):
+    for _name in __all__:
+        __getattr__(_name)
@@ -0,0 +1,410 @@
+from os.path import isfile, join
+from collections import OrderedDict
+from threading import RLock
+import hashlib
+import numpy as np
+import numpy.linalg as la
+import scipy.sparse as sp
+import pyopencl.array  # noqa
+
+from firedrake import Function
+from pytential.target import PointsTarget
+
+from fd2mm.op import OpConnection, get_thread_queue
+from fd2mm.stats import timed
+
+__doc__ = """
+Operators applied as explicit (dense) matrices, as returned by
+:func:`fd2mm.op.fd_bind` with *mode='dense'*.
+
+.. autofunction:: check_separation
+
+.. autoclass:: DenseOpConnection
+    :members:
+"""
+
+
+def build_dense_matrix(queue, qbx, target, op, input_exprs, context):
+    """
+        :arg qbx: A :class:`pytential.qbx.QBXLayerPotentialSource`
+        :arg target: A :class:`pytential.target.PointsTarget`
+        :arg op: A :mod:`pytential` operator, or an object array of them
+        :arg input_exprs: A list of the variables *op* is linear in
+            (e.g. *[sym.var("u")]*, or the entries of a
+            *sym.make_sym_vector("sigma", dim)*)
+        :arg context: Any other arguments to *op* (e.g. a wave number)
+
+        Returns an array of shape *(nops * ntargets, ninputs * nsources)*
+        which maps the input densities (stacked) on *qbx.density_discr*
+        to the values of *op* (stacked) at *target*.
+
+        Layer potentials are evaluated by direct (point-to-point)
+        quadrature on *qbx.density_discr*, so the targets
+        must be well separated from the source.
+    """
+    from pytential.symbolic.execution import GeometryCollection, _prepare_expr
+    from pytential.symbolic.matrix import P2PMatrixBuilder
+
+    places = GeometryCollection((qbx, target))
+
+    if not isinstance(op, np.ndarray):
+        op = np.array([op], dtype=object)
+    exprs = _prepare_expr(places, op)
+
+    dep_source = places.get_geometry(places.auto_source)
+    dep_discr = places.get_discretization(places.auto_source)
+
+    ntargets = target.nnodes
+    nsources = dep_discr.nnodes
+    dtype = None
+
+    blocks = np.empty((len(exprs), len(input_exprs)), dtype=object)
+    for icol, input_expr in enumerate(input_exprs):
+        mbuilder = P2PMatrixBuilder(
+            queue,
+            dep_expr=input_expr,
+            other_dep_exprs=input_exprs[:icol] + input_exprs[icol+1:],
+            dep_source=dep_source,
+            dep_discr=dep_discr,
+            places=places,
+            context=context,
+            exclude_self=False)
+
+        for irow, expr in enumerate(exprs):
+            block = mbuilder(expr)
+            if isinstance(block, np.ndarray):
+                if dtype is None:
+                    dtype = block.dtype
+                else:
+                    dtype = np.result_type(dtype, block.dtype)
+            blocks[irow, icol] = block
+
+    # {{{ Put blocks together (blocks not depending on an input are scalars)
+
+    mat = np.zeros((len(exprs) * ntargets, len(input_exprs) * nsources),
+                   dtype=dtype or np.complex128)
+    for irow in range(len(exprs)):
+        for icol in range(len(input_exprs)):
+            mat[irow*ntargets:(irow+1)*ntargets,
+                icol*nsources:(icol+1)*nsources] = blocks[irow, icol]
+
+    # }}}
+
+    return mat
+
+
+def check_separation(queue, qbx, target, min_separation=2.0):
+    """
+        Raise a *ValueError* unless every point of *target* is at least
+        *min_separation* times the largest element diameter of
+        *qbx.density_discr* away from all of its nodes, i.e. unless
+        direct quadrature (see :func:`build_dense_matrix`) is accurate
+        at *target*
+    """
+    from scipy.spatial import cKDTree
+
+    discr = qbx.density_discr
+    source_points = discr.nodes().get(queue=queue)
+
+    # bounding box diagonal of the largest element
+    max_diameter = 0
+    for group in discr.groups:
+        element_points = group.view(source_points)
+        extent = np.max(element_points, axis=-1) - np.min(element_points, axis=-1)
+        max_diameter = max(max_diameter, np.max(la.norm(extent, axis=0)))
+
+    distances, _ = cKDTree(source_points.T).query(target.nodes().T)
+    if np.min(distances) < min_separation * max_diameter:
+        raise ValueError("Targets are within %.3g of the source, but direct"
+                         " quadrature needs them at least %s element diameters"
+                         " (%.3g) away. Use *mode='fmm'* instead"
+                         % (np.min(distances), min_separation,
+                            min_separation * max_diameter))
+
+
+class DenseOpConnection(OpConnection):
+    """
+        An :class:`fd2mm.op.OpConnection` which is assembled as an explicit
+        matrix the first time it is applied (for each distinct set
+        of non-density arguments, e.g. wave numbers), and afterwards applied
+        by a single matrix-vector product. Only the *max_matrices* most
+        recently used matrices are kept in memory, use *cache_dir* to
+        reuse older ones (e.g. when sweeping over wave numbers).
+
+        The source conversion (firedrake->meshmode, see
+        :meth:`fd2mm.op.SourceConnection.get_conversion_matrix`) is
+        composed into the matrix when it is assembled, so an application
+        is just a product with the :mod:`firedrake` data on the host.
+        Densities must therefore be :mod:`firedrake` :class:`Function`
+        objects or arrays shaped like their data, not converted fields.
+
+        Since matrix entries are computed with direct quadrature
+        (see :func:`build_dense_matrix`), the target must be a
+        set of points (a bdy or the unique nodes of a function space)
+        well separated from the source (see :func:`check_separation`,
+        which is checked on construction).
+    """
+    # Suffix of files in the cache directory
+    _cache_suffix = '.npy'
+
+    def __init__(self, function_space_analog, source_connection, target_connection,
+                 op, cache_dir=None, min_separation=2.0, max_matrices=1,
+                 **kwargs):
+        """
+            :arg cache_dir: If not *None*, a directory in which assembled
+                matrices are saved to and loaded from
+            :arg min_separation: As in :func:`check_separation`
+            :arg max_matrices: The maximum number of matrices
+                kept in memory
+
+            For other args see :class:`fd2mm.op.OpConnection`
+
+            Raises *ValueError* if the target is not well separated
+            from the source
+        """
+        if not isinstance(target_connection.get_target(), PointsTarget):
+            raise ValueError("Dense mode requires a target which is a set of"
+                             " points (i.e. a bdy or unique nodes)")
+
+        super(DenseOpConnection, self).__init__(function_space_analog,
+                                                source_connection,
+                                                target_connection,
+                                                op, **kwargs)
+        check_separation(get_thread_queue(self._qbx.cl_context), self._qbx,
+                         target_connection.get_target(),
+                         min_separation=min_separation)
+
+        if max_matrices < 1:
+            raise ValueError("max_matrices must be at least 1, not %s"
+                             % max_matrices)
+        self._cache_dir = cache_dir
+        self._max_matrices = max_matrices
+        # maps :meth:`_cache_key` to assembled matrices,
+        # least recently used first
+        self._matrices = OrderedDict()
+        # Held while assembling, so each matrix is assembled once
+        self._matrices_lock = RLock()
+
+        # Identifies the geometry, see :meth:`_cache_key`
+        mesh = function_space_analog.analog().mesh()
+        geometry_key = hashlib.sha1()
+        geometry_key.update(
+            np.ascontiguousarray(mesh.coordinates.dat.data_ro).tobytes())
+        geometry_key.update(
+            np.ascontiguousarray(target_connection.get_target().nodes()).tobytes())
+        self._geometry_key = geometry_key.hexdigest()
+
+    def _cache_key(self, densities, context):
+        """
+            Return a hex digest identifying the matrix for the
+            given densities (a list of (name, shape) pairs) and
+            context
+        """
+        key = hashlib.sha1()
+        key.update(repr((self._geometry_key,
+                         str(self._op),
+                         densities,
+                         sorted((k, repr(v)) for k, v in context.items()),
+                         sorted((k, repr(v)) for k, v in self._qbx_kwargs.items()),
+                         self._source_connection._bdy_id,
+                         self._qbx.density_discr.nnodes,
+                         )).encode())
+        return key.hexdigest()
+
+    def get_matrix(self, queue, densities, context):
+        """
+            :arg densities: A list of pairs *(name, shape)* where *shape*
+                is the shape of the :mod:`firedrake` data of the density
+                named *name*
+            :arg context: The non-density arguments to the operator
+
+            Returns the matrix mapping the (flattened, stacked in the
+            order of *densities*) :mod:`firedrake` data of the densities
+            to the values of the operator, assembling (or loading)
+            it if necessary
+        """
+        key = self._cache_key(densities, context)
+        with self._matrices_lock:
+            mat = self._matrices.pop(key, None)
+            if mat is None:
+                # Make room first, so at most *max_matrices* are ever held
+                while len(self._matrices) >= self._max_matrices:
+                    self._matrices.popitem(last=False)
+                mat = self._load_or_assemble_matrix(queue, key, densities,
+                                                    context)
+            # (re-)insert as most recently used
+            self._matrices[key] = mat
+            return mat
+
+    def _load_or_assemble_matrix(self, queue, key, densities, context):
+
+        file_name = None
+        if self._cache_dir is not None:
+            file_name = join(self._cache_dir, key + self._cache_suffix)
+
+        if file_name is not None and isfile(file_name):
+            mat = self._load_matrix(file_name)
+        else:
+            from pytential import sym
+            input_exprs = []
+            for name, shape in densities:
+                if len(shape) > 1:
+                    input_exprs += list(sym.make_sym_vector(name, shape[1]))
+                else:
+                    input_exprs.append(sym.var(name))
+
+            mat = self._assemble_matrix(queue, input_exprs, context)
+            mat = self._compose_conversion(
+                mat, self._make_conversion_matrix(queue, densities))
+            if file_name is not None:
+                self._save_matrix(mat, file_name)
+
+        return mat
+
+    def _make_conversion_matrix(self, queue, densities):
+        """
+            Return a :class:`scipy.sparse.csr_matrix` mapping the stacked
+            :mod:`firedrake` data of *densities* (as in :meth:`get_matrix`)
+            to the stacked input fields of :func:`build_dense_matrix`
+        """
+        blocks = []
+        for _, shape in densities:
+            conversion = self._source_connection.get_conversion_matrix(queue,
+                                                                       shape[0])
+            if len(shape) > 1:
+                # component i of (nnodes, dim) data is every dim-th entry
+                conversion = sp.vstack(
+                    [sp.kron(conversion, sp.csr_matrix(np.eye(1, shape[1], i)))
+                     for i in range(shape[1])])
+            blocks.append(conversion)
+        return sp.block_diag(blocks, format='csr')
+
+    # {{{ Matrix handling, overridden by subclasses with other representations
+
+    def _compose_conversion(self, mat, conversion):
+        return np.ascontiguousarray(conversion.T.dot(mat.T).T)
+
+    def _matrix_dtype(self, mat):
+        return mat.dtype
+
+    def _assemble_matrix(self, queue, input_exprs, context):
+        return build_dense_matrix(queue, self._qbx,
+                                  self._target_connection.get_target(),
+                                  self._op, input_exprs, context)
+
+    def _load_matrix(self, file_name):
+        return np.load(file_name)
+
+    def _save_matrix(self, mat, file_name):
+        np.save(file_name, mat)
+
+    def _apply_matrix(self, mat, x, out):
+        np.matmul(mat, x, out=out)
+
+    # }}}
+
+    def _split_kwargs(self, kwargs):
+        """
+            Return *(densities, context)*, where densities
+            maps names to :mod:`firedrake` data
+        """
+        densities = {}
+        context = {}
+        for key, val in kwargs.items():
+            if isinstance(val, Function):
+                densities[key] = val.dat.data_ro
+            elif isinstance(val, np.ndarray):
+                densities[key] = val
+            elif isinstance(val, pyopencl.array.Array):
+                raise TypeError("Dense operators take firedrake data, not"
+                                " converted fields (received one for '%s')"
+                                % key)
+            else:
+                context[key] = val
+
+        return densities, context
+
+    def convert_density(self, queue, data):
+        """
+            As in :meth:`fd2mm.op.OpConnection.convert_density`, but
+            returns *data* (the conversion is part of the matrix)
+        """
+        return data
+
+    def _get_matrix_for(self, queue, densities, context):
+        names = sorted(densities)
+        return names, self.get_matrix(queue,
+                                      [(name, densities[name].shape)
+                                       for name in names],
+                                      context)
+
+    def _result_shape(self):
+        shape = (self._target_connection.get_target().nnodes,)
+        if isinstance(self._op, np.ndarray):
+            shape = (len(self._op),) + shape
+        return shape
+
+    def evaluate(self, queue, **kwargs):
+        """
+            As in :meth:`fd2mm.op.OpConnection.evaluate`.
+            Densities must be :mod:`firedrake` :class:`Function` objects
+            or arrays shaped like their data,
+            all other arguments are treated as part of the context
+        """
+        if self.stats is not None:
+            self.stats.ncalls += 1
+
+        densities, context = self._split_kwargs(kwargs)
+        names, mat = self._get_matrix_for(queue, densities, context)
+
+        # Stack the densities
+        if len(names) == 1:
+            x = densities[names[0]].reshape(-1)
+        else:
+            x = np.concatenate([densities[name].reshape(-1) for name in names])
+
+        shape = self._result_shape()
+        dtype = np.result_type(self._matrix_dtype(mat), x.dtype)
+        if self._result_buffer is None or self._result_buffer.shape != shape \
+                or self._result_buffer.dtype != dtype:
+            self._result_buffer = np.empty(shape, dtype=dtype)
+
+        with timed(self.stats, 'evaluation'):
+            self._apply_matrix(mat, x, self._result_buffer.reshape(-1))
+        return self._result_buffer
+
+    def evaluate_many(self, queue, **kwargs):
+        """
+            As in :meth:`fd2mm.op.OpConnection.evaluate_many`, but
+            all right-hand sides are applied in a single matrix-matrix
+            product. Per right-hand side arguments must be densities.
+        """
+        from fd2mm.op import _split_per_rhs_kwargs
+        per_rhs, shared = _split_per_rhs_kwargs(kwargs)
+        nrhs = len(next(iter(per_rhs.values())))
+        if self.stats is not None:
+            self.stats.ncalls += nrhs
+
+        shared_densities, context = self._split_kwargs(shared)
+        rhs_densities = [self._split_kwargs({key: values[irhs]
+                                             for key, values in per_rhs.items()})
+                         for irhs in range(nrhs)]
+        for densities, rhs_context in rhs_densities:
+            if rhs_context:
+                raise TypeError("Per right-hand side arguments must be"
+                                " densities, not %s" % list(rhs_context))
+            densities.update(shared_densities)
+
+        names, mat = self._get_matrix_for(queue, rhs_densities[0][0], context)
+
+        # Stack the densities, one column per right-hand side
+        x = np.stack([np.concatenate([densities[name].reshape(-1)
+                                      for name in names])
+                      for densities, _ in rhs_densities], axis=1)
+
+        shape = self._result_shape()
+        out = np.empty((int(np.prod(shape)), nrhs),
+                       dtype=np.result_type(self._matrix_dtype(mat), x.dtype))
+        with timed(self.stats, 'evaluation'):
+            self._apply_matrix(mat, x, out)
+        return out.T.reshape((nrhs,) + shape)
@@ -0,0 +1,526 @@
+from warnings import warn
+import numpy as np
+import numpy.linalg as la
+import scipy.sparse as sp
+
+from firedrake import Function
+from pymbolic.mapper.evaluator import EvaluationMapper
+from pytential.target import PointsTarget
+
+from fd2mm.op import OpConnection
+from fd2mm.stats import timed
+
+__doc__ = """
+Operators evaluated by direct summation with :mod:`numpy`, as returned by
+:func:`fd2mm.op.fd_bind` with *mode='numpy'*. Nothing is compiled
+(densities are converted from :mod:`firedrake` data on the host, see
+:meth:`fd2mm.op.SourceConnection.get_conversion_matrix`), so the first
+evaluation is fast, but accuracy is low: this is meant for
+preconditioners and small debugging meshes.
+
+.. autoclass:: DirectOpConnection
+    :members:
+
+.. autoclass:: DirectBlockEvaluator
+    :members:
+"""
+
+
+# Euler-Mascheroni constant
+_EULER_GAMMA = 0.5772156649015329
+
+
+def _host_nodes(discr):
+    """
+        Return the nodes of the :mod:`meshmode` discretization *discr*
+        as an array of shape *(ambient_dim, nnodes)*, computed on the host
+        from the mesh nodes, along with a list of arrays of shape
+        *(ambient_dim, nelements, nunit_nodes)* holding the same nodes
+        for each group
+    """
+    from modepy import resampling_matrix, simplex_best_available_basis
+
+    nodes = np.empty((discr.ambient_dim, discr.nnodes))
+    group_nodes = []
+    for grp in discr.groups:
+        meshgrp = grp.mesh_el_group
+        resampling_mat = resampling_matrix(
+            simplex_best_available_basis(meshgrp.dim, meshgrp.order),
+            new_nodes=grp.unit_nodes,
+            old_nodes=meshgrp.unit_nodes)
+        grp_nodes = np.einsum("ij,dej->dei", resampling_mat, meshgrp.nodes)
+
+        group_nodes.append(grp_nodes)
+        nodes[:, grp.node_nr_base:grp.node_nr_base + grp.nnodes] = \
+            grp_nodes.reshape((discr.ambient_dim, -1))
+
+    return nodes, group_nodes
+
+
+def _host_geometry(discr):
+    """
+        Return *(nodes, weights, normals)* of the :mod:`meshmode`
+        discretization *discr* of a curve in 2D or a surface in 3D,
+        of shapes *(ambient_dim, nnodes)*, *(nnodes,)*,
+        *(ambient_dim, nnodes)*. *weights* are the quadrature
+        weights times the area element.
+    """
+    nodes, group_nodes = _host_nodes(discr)
+    weights = np.empty(discr.nnodes)
+    normals = np.empty((discr.ambient_dim, discr.nnodes))
+
+    for grp, grp_nodes in zip(discr.groups, group_nodes):
+        # derivatives of the nodes with respect to each reference coordinate
+        jacobian = [np.einsum("ij,dej->dei", diff_mat, grp_nodes)
+                    for diff_mat in grp.diff_matrices()]
+
+        if grp.dim == 1 and discr.ambient_dim == 2:
+            tangent = jacobian[0]
+            normal = np.array([tangent[1], -tangent[0]])
+        elif grp.dim == 2 and discr.ambient_dim == 3:
+            normal = np.cross(jacobian[0], jacobian[1], axis=0)
+        else:
+            raise NotImplementedError("Only curves in 2D and surfaces in 3D"
+                                      " are supported")
+
+        area_element = la.norm(normal, axis=0)
+        node_slice = slice(grp.node_nr_base, grp.node_nr_base + grp.nnodes)
+        weights[node_slice] = (area_element * grp.weights).reshape(-1)
+        normals[:, node_slice] = (normal / area_element).reshape(
+            (discr.ambient_dim, -1))
+
+    return nodes, weights, normals
+
+
+def _split_kernel(kernel):
+    """
+        Return *(base kernel, target derivative axis or None,
+        has source derivative)* for a :mod:`sumpy` kernel
+    """
+    from sumpy.kernel import (LaplaceKernel, HelmholtzKernel,
+                              AxisTargetDerivative, DirectionalSourceDerivative)
+
+    target_axis = None
+    source_derivative = False
+    while True:
+        if isinstance(kernel, AxisTargetDerivative) and target_axis is None:
+            target_axis = kernel.axis
+        elif isinstance(kernel, DirectionalSourceDerivative) \
+                and not source_derivative:
+            source_derivative = True
+        else:
+            break
+        kernel = kernel.inner_kernel
+
+    if not isinstance(kernel, (LaplaceKernel, HelmholtzKernel)):
+        raise NotImplementedError("Kernel %s is not supported in numpy mode"
+                                  % kernel)
+
+    return kernel, target_axis, source_derivative
+
+
+def _greens_function(kernel, k, r):
+    """
+        Return the Green's function of the Laplace (*k* is *None*) or
+        Helmholtz equation in *kernel.dim* dimensions, and its
+        derivative with respect to *r*, evaluated at *r*
+    """
+    if kernel.dim == 2:
+        if k is None:
+            return -np.log(r) / (2 * np.pi), -1 / (2 * np.pi * r)
+        from scipy.special import hankel1
+        return 0.25j * hankel1(0, k * r), -0.25j * k * hankel1(1, k * r)
+
+    if kernel.dim == 3:
+        if k is None:
+            return 1 / (4 * np.pi * r), -1 / (4 * np.pi * r**2)
+        expikr = np.exp(1j * k * r)
+        return expikr / (4 * np.pi * r), \
+            expikr * (1j * k * r - 1) / (4 * np.pi * r**2)
+
+    raise NotImplementedError("Only 2D and 3D kernels are supported")
+
+
+def _greens_function_second_derivative(kernel, k, r):
+    """
+        Return the second derivative with respect to *r* of
+        the Green's function of :func:`_greens_function`
+    """
+    if kernel.dim == 2:
+        if k is None:
+            return 1 / (2 * np.pi * r**2)
+        from scipy.special import hankel1
+        # (H_1)'(z) = H_0(z) - H_1(z) / z
+        return -0.25j * k**2 * (hankel1(0, k * r) - hankel1(1, k * r) / (k * r))
+
+    if kernel.dim == 3:
+        if k is None:
+            return 1 / (2 * np.pi * r**3)
+        return np.exp(1j * k * r) * (2 - 2j * k * r - (k * r)**2) \
+            / (4 * np.pi * r**3)
+
+    raise NotImplementedError("Only 2D and 3D kernels are supported")
+
+
+def _self_integral(kernel, k, weights):
+    """
+        Return the integral of the Green's function over the
+        patch (a segment of length *weights* in 2D, a disk of area *weights*
+        in 3D) centered at each source node, used in place of the
+        (infinite) self-interaction
+    """
+    if kernel.dim == 2:
+        result = -weights * (np.log(weights / 2) - 1) / (2 * np.pi)
+        if k is not None:
+            result = result + weights * (
+                0.25j - (np.log(k / 2) + _EULER_GAMMA) / (2 * np.pi))
+        return result
+
+    radius = np.sqrt(weights / np.pi)
+    result = radius / 2
+    if k is not None:
+        result = result + 1j * k * weights / (4 * np.pi)
+    return result
+
+
+def _kernel_matrix(kernel, k, target_nodes, source_nodes, source_normals,
+                   coincidence_tol):
+    """
+        Return *(value, on_source)*, where *value[i, j]* is *kernel*
+        (see :func:`_split_kernel` for those supported) between target *i*
+        and source *j* (whose normal is *source_normals[:, j]*), and
+        *on_source* is a mask of the pairs closer than *coincidence_tol*,
+        where *value* is zero
+    """
+    base_kernel, target_axis, source_derivative = _split_kernel(kernel)
+    if getattr(base_kernel, 'helmholtz_k_name', None) is None:
+        k = None
+
+    # (ambient_dim, ntargets, nsources)
+    diff = target_nodes[:, :, np.newaxis] - source_nodes[:, np.newaxis, :]
+    r = la.norm(diff, axis=0)
+    on_source = r < coincidence_tol
+    r[on_source] = 1
+
+    value, derivative = _greens_function(base_kernel, k, r)
+    if source_derivative:
+        # The direction is taken to be the normal (as in sym.D)
+        diff_dot_normal = np.einsum("dts,ds->ts", diff, source_normals)
+
+    if target_axis is not None and source_derivative:
+        # d/dx_a of -G'(r) (x - y).n / r
+        second_derivative = _greens_function_second_derivative(base_kernel, k, r)
+        value = -((second_derivative - derivative / r)
+                  * diff[target_axis] * diff_dot_normal / r**2
+                  + derivative / r * source_normals[target_axis][np.newaxis, :])
+    elif target_axis is not None:
+        value = derivative * diff[target_axis] / r
+    elif source_derivative:
+        value = -derivative * diff_dot_normal / r
+    value[on_source] = 0
+
+    return value, on_source
+
+
+class _DirectEvaluationMapper(EvaluationMapper):
+    """
+        Evaluates a :mod:`pytential` expression, computing each
+        layer potential with :meth:`DirectOpConnection.layer_potential`
+    """
+    def __init__(self, op_connection, context):
+        super(_DirectEvaluationMapper, self).__init__(context)
+        self.op_connection = op_connection
+
+    def map_int_g(self, expr):
+        density = self.rec(expr.density)
+        base_kernel, _, _ = _split_kernel(expr.kernel)
+
+        k = None
+        k_name = getattr(base_kernel, 'helmholtz_k_name', None)
+        if k_name is not None:
+            k = self.rec(expr.kernel_arguments[k_name])
+
+        return self.op_connection.layer_potential(expr.kernel, density, k)
+
+    def map_common_subexpression(self, expr):
+        return self.rec(expr.child)
+
+    def map_numpy_array(self, expr):
+        result = np.empty(expr.shape, dtype=object)
+        for i in np.ndindex(expr.shape):
+            result[i] = self.rec(expr[i])
+        return result
+
+
+class DirectOpConnection(OpConnection):
+    """
+        An :class:`fd2mm.op.OpConnection` evaluated by direct summation
+        with :mod:`numpy` (no :mod:`pytential` evaluation, so nothing is
+        compiled or refined).
+
+        Densities given as :mod:`firedrake` :class:`Function` objects
+        are converted on the host by a sparse product with the
+        source connection's conversion matrix, so no field is created
+        on the device.
+
+        Supports operators built from single/double layer potentials
+        and their target derivatives (e.g. *sym.S*, *sym.D*,
+        and *sym.grad* of *sym.S* or *sym.D*) of Laplace and Helmholtz
+        kernels in 2D and 3D, combined linearly.
+
+        Layer potentials are computed with the (smooth) quadrature of the
+        source discretization. Where a target coincides with a source node
+        the singular single layer is replaced by its integral over a
+        small patch around the node, and the other kernels are dropped
+        (their principal value). Accuracy therefore degrades for targets
+        close to the source.
+    """
+    def __init__(self, function_space_analog, source_connection, target_connection,
+                 op, chunk_size=1024, **kwargs):
+        """
+            :arg chunk_size: At most *chunk_size* targets and *chunk_size*
+                sources interact at once (bounds memory use)
+
+            Other args are as in :class:`fd2mm.op.OpConnection`. The
+            qbx keyword arguments are ignored.
+        """
+        self._chunk_size = chunk_size
+        # maps the number of firedrake nodes to the conversion matrix,
+        # see :meth:`convert_density`
+        self._conversion_matrices = {}
+        super(DirectOpConnection, self).__init__(function_space_analog,
+                                                 source_connection,
+                                                 target_connection,
+                                                 op, **kwargs)
+
+    def _bind(self):
+        if self._source_connection._refine:
+            warn("Sources are not refined in numpy mode")
+
+        self._source_nodes, self._source_weights, self._source_normals = \
+            _host_geometry(self._source_connection._discr)
+
+        target = self._target_connection.get_target()
+        if isinstance(target, PointsTarget):
+            self._target_nodes = np.asarray(target.nodes())
+        else:
+            self._target_nodes, _ = _host_nodes(target)
+
+        # Length scale below which targets are considered to be on a source
+        extent = np.max(self._source_nodes, axis=1) \
+            - np.min(self._source_nodes, axis=1)
+        self._coincidence_tol = 1e-12 * max(la.norm(extent), 1)
+
+        return None, None
+
+    def layer_potential(self, kernel, density, k=None):
+        """
+            :arg kernel: A :mod:`sumpy` kernel (see the class docstring
+                for those supported)
+            :arg density: A host array of values at the source nodes
+            :arg k: The Helmholtz parameter (ignored for Laplace kernels)
+
+            Returns the layer potential at the target nodes
+        """
+        base_kernel, target_axis, source_derivative = _split_kernel(kernel)
+        if getattr(base_kernel, 'helmholtz_k_name', None) is None:
+            k = None
+
+        weighted_density = self._source_weights * density
+        ntargets = self._target_nodes.shape[1]
+        nsources = self._source_nodes.shape[1]
+        result = np.zeros(ntargets, dtype=np.complex128 if k is not None
+                          else weighted_density.dtype)
+
+        for tgt_start in range(0, ntargets, self._chunk_size):
+            tgt = slice(tgt_start, tgt_start + self._chunk_size)
+            for src_start in range(0, nsources, self._chunk_size):
+                src = slice(src_start, src_start + self._chunk_size)
+
+                value, on_source = _kernel_matrix(
+                    kernel, k, self._target_nodes[:, tgt],
+                    self._source_nodes[:, src], self._source_normals[:, src],
+                    self._coincidence_tol)
+                result[tgt] += value.dot(weighted_density[src])
+
+                # {{{ Singular correction for the single layer
+
+                if target_axis is None and not source_derivative \
+                        and on_source.any():
+                    itgt, isrc = np.nonzero(on_source)
+                    isrc = isrc + src_start
+                    np.add.at(result, itgt + tgt_start,
+                              _self_integral(base_kernel, k,
+                                             self._source_weights[isrc])
+                              * density[isrc])
+
+                # }}}
+
+        return result
+
+    def convert_density(self, queue, data):
+        """
+            As in :meth:`fd2mm.op.OpConnection.convert_density`, but
+            converted on the host: returns a :mod:`numpy` field of shape
+            *(nnodes,)*, or *(dim, nnodes)* for vector data
+        """
+        nfd_nodes = data.shape[0]
+        conversion = self._conversion_matrices.get(nfd_nodes)
+        if conversion is None:
+            conversion = self._source_connection.get_conversion_matrix(
+                queue, nfd_nodes)
+            self._conversion_matrices[nfd_nodes] = conversion
+
+        with timed(self.stats, 'host_conversion'):
+            return conversion.dot(data).T
+
+    def evaluate(self, queue, **kwargs):
+        """
+            As in :meth:`fd2mm.op.OpConnection.evaluate`.
+            :class:`Function` densities are converted on the host (see
+            :meth:`convert_density`), other arrays are taken to be
+            converted fields, and device arrays
+            (:class:`pyopencl.array.Array`) are brought to the host.
+            *queue* may be *None*.
+        """
+        if self.stats is not None:
+            self.stats.ncalls += 1
+
+        context = {}
+        for key, val in kwargs.items():
+            if isinstance(val, Function):
+                val = self.convert_density(queue, val.dat.data_ro)
+            elif hasattr(val, 'get'):
+                with timed(self.stats, 'readback'):
+                    val = val.get(queue=queue)
+            context[key] = val
+
+        with timed(self.stats, 'evaluation'):
+            mapper = _DirectEvaluationMapper(self, context)
+            if isinstance(self._op, np.ndarray):
+                result = np.array([mapper(op) for op in self._op])
+            else:
+                result = mapper(self._op)
+
+        return result
+
+
+def _aggregate_length(input_exprs, name):
+    """
+        Return the number of components of the vector variable *name*
+        among *input_exprs*
+    """
+    return 1 + max(expr.index for expr in input_exprs
+                   if getattr(expr, 'aggregate', None) is not None
+                   and expr.aggregate.name == name)
+
+
+class DirectBlockEvaluator:
+    """
+        Evaluates entries of the matrix of an operator (laid out as
+        in :func:`fd2mm.dense.build_dense_matrix`) directly from the kernels,
+        one block of targets and sources at a time, e.g. to sample the
+        rows and columns of a block as in :func:`fd2mm.hmatrix.build_hmatrix`.
+
+        The same operators are supported as by :class:`DirectOpConnection`.
+        Targets must not coincide with sources.
+    """
+    def __init__(self, source_discr, target_nodes, op, input_exprs, context):
+        """
+            :arg source_discr: The :mod:`meshmode` discretization of the
+                source (e.g. *qbx.density_discr*)
+            :arg target_nodes: An array of shape *(ambient_dim, ntargets)*
+            :arg op: A :mod:`pytential` operator, or an object array of them
+            :arg input_exprs: As in :func:`fd2mm.dense.build_dense_matrix`,
+                variables or components of vector variables
+            :arg context: Any other arguments to *op* (e.g. a wave number)
+        """
+        self._source_nodes, self._source_weights, self._source_normals = \
+            _host_geometry(source_discr)
+        self._target_nodes = np.asarray(target_nodes)
+        self._ops = list(op) if isinstance(op, np.ndarray) else [op]
+        self._input_exprs = input_exprs
+        self._context = context
+
+        extent = np.max(self._source_nodes, axis=1) \
+            - np.min(self._source_nodes, axis=1)
+        self._coincidence_tol = 1e-12 * max(la.norm(extent), 1)
+
+        # Current block, see :meth:`__call__`
+        self._target_indices = None
+        self._source_indices = None
+
+    @property
+    def shape(self):
+        """
+            The shape *(nops * ntargets, ninputs * nsources)* of the
+            whole matrix
+        """
+        return (len(self._ops) * self._target_nodes.shape[1],
+                len(self._input_exprs) * self._source_nodes.shape[1])
+
+    def layer_potential(self, kernel, density, k=None):
+        """
+            As in :meth:`DirectOpConnection.layer_potential`, but for
+            the current block, with *density* a (sparse) matrix whose
+            columns are densities on the current sources
+        """
+        ntargets = len(self._target_indices)
+        if density.nnz == 0:
+            return np.zeros((ntargets, density.shape[1]))
+
+        src = self._source_indices
+        value, _ = _kernel_matrix(kernel, k,
+                                  self._target_nodes[:, self._target_indices],
+                                  self._source_nodes[:, src],
+                                  self._source_normals[:, src],
+                                  self._coincidence_tol)
+        value *= self._source_weights[src]
+        return np.asarray(density.T.dot(value.T)).T
+
+    def _input_context(self, iinput, nsources):
+        """
+            Return the context mapping input *iinput* to the identity
+            and every other input to zero (on *nsources* sources)
+        """
+        context = dict(self._context)
+        for jinput, expr in enumerate(self._input_exprs):
+            if jinput == iinput:
+                val = sp.identity(nsources, format='csr')
+            else:
+                val = sp.csr_matrix((nsources, nsources))
+
+            aggregate = getattr(expr, 'aggregate', None)
+            if aggregate is None:
+                context[expr.name] = val
+            else:
+                components = context.setdefault(
+                    aggregate.name, np.empty(_aggregate_length(
+                        self._input_exprs, aggregate.name), dtype=object))
+                components[expr.index] = val
+        return context
+
+    def __call__(self, target_indices, source_indices):
+        """
+            Return the block of the matrix with rows *(op, target)*
+            and columns *(input, source)* for *target* in *target_indices*
+            and *source* in *source_indices*, of shape
+            *(nops * len(target_indices), ninputs * len(source_indices))*
+        """
+        self._target_indices = target_indices
+        self._source_indices = source_indices
+        ntargets = len(target_indices)
+        nsources = len(source_indices)
+
+        columns = []
+        for iinput in range(len(self._input_exprs)):
+            mapper = _DirectEvaluationMapper(
+                self, self._input_context(iinput, nsources))
+            columns.append([np.broadcast_to(mapper(op), (ntargets, nsources))
+                            for op in self._ops])
+
+        # (ninputs, nops, ntargets, nsources) -> stacked rows and columns
+        block = np.array(columns).transpose((1, 2, 0, 3))
+        return block.reshape((len(self._ops) * ntargets,
+                              len(self._input_exprs) * nsources))
+
@@ -1,5 +1,3 @@
-import numpy as np
-
 from firedrake import Function
 
 from fd2mm.analog import Analog
@@ -64,13 +62,6 @@ class FunctionAnalog(Analog):
         if len(self.analog().dat.data.shape) == 1 and len(field.shape) > 1:
             field = field.reshape(field.shape[1])
 
-        # resample from nodes
-        group = self.function_space_a().discretization().groups[0]
-        resampled = np.copy(field)
-        resampled_view = group.view(resampled)
-        resampling_mat = self.function_space_a().resampling_mat(False)
-        np.matmul(resampled_view, resampling_mat.T, out=resampled_view)
-
-        # reorder data
-        self.analog().dat.data[:] = self.function_space_a().reorder_nodes(
-            resampled, firedrake_to_meshmode=False)[:]
+        # convert to firedrake data
+        self.analog().dat.data[:] = \
+            self.function_space_a().convert_field(field)[:]
@@ -23,13 +23,16 @@ def cached(f, mesh_analog, key, *args, **kwargs):
     :args args: Additional arguments to ``f``.
     :kwargs kwargs:  Additional keyword arguments to ``f``."""
     assert hasattr(mesh_analog, "_shared_data_cache")
-    cache = mesh_analog._shared_data_cache[f.__name__]
-    try:
-        return cache[key]
-    except KeyError:
-        result = f(mesh_analog, key, *args, **kwargs)
-        cache[key] = result
-        return result
+    # Hold the mesh analog's lock so that each entry is computed once,
+    # even if requested from several threads
+    with mesh_analog._lock:
+        cache = mesh_analog._shared_data_cache[f.__name__]
+        try:
+            return cache[key]
+        except KeyError:
+            result = f(mesh_analog, key, *args, **kwargs)
+            cache[key] = result
+            return result
 
 
 def reorder_nodes(orient, nodes, flip_matrix, unflip=False):
@@ -119,10 +119,13 @@ class WithGeometryAnalog(Analog):
     def resampling_mat(self, firedrake_to_meshmode):
         if self._resampling_mat_fd2mm is None:
             element_grp = self.discretization().groups[0]
-            self._resampling_mat_fd2mm = \
+            resampling_mat_fd2mm = \
                 self.finat_element_a.make_resampling_matrix(element_grp)
 
-            self._resampling_mat_mm2fd = np.linalg.inv(self._resampling_mat_fd2mm)
+            # Set the inverse first, so that a concurrent caller never
+            # sees only one of the pair
+            self._resampling_mat_mm2fd = np.linalg.inv(resampling_mat_fd2mm)
+            self._resampling_mat_fd2mm = resampling_mat_fd2mm
 
         # return the correct resampling matrix
         if firedrake_to_meshmode:
@@ -162,6 +165,13 @@ class WithGeometryAnalog(Analog):
         # }}}
 
     def convert_function(self, function):
+        """
+            :arg function: A :class:`FunctionAnalog`, a :mod:`firedrake`
+                :class:`Function`, or an array shaped like the
+                data of such a function (i.e. like *function.dat.data*)
+
+            Returns the function as a field on :meth:`discretization`
+        """
         from fd2mm.function import FunctionAnalog
         if isinstance(function, FunctionAnalog):
             function = function.analog()
@@ -169,7 +179,10 @@ class WithGeometryAnalog(Analog):
         # FIXME: Check that function can be converted!
         #assert function.function_space() == self.analog()
 
-        nodes = function.dat.data
+        if isinstance(function, np.ndarray):
+            nodes = function
+        else:
+            nodes = function.dat.data
 
         # handle vector function spaces differently, hence the shape checks
 
@@ -194,3 +207,22 @@ class WithGeometryAnalog(Analog):
         # }}}
 
         return nodes
+
+    def convert_field(self, field):
+        """
+            :arg field: A field on :meth:`discretization`, of shape
+                *(nnodes,)* or *(dim, nnodes)*
+
+            Returns an array shaped like the data of a :mod:`firedrake`
+            function (i.e. *(nfd_nodes,)* or *(nfd_nodes, dim)*) holding
+            :arg:`field` converted to firedrake
+        """
+        # resample from nodes
+        group = self.discretization().groups[0]
+        resampled = np.copy(field)
+        resampled_view = group.view(resampled)
+        resampling_mat = self.resampling_mat(False)
+        np.matmul(resampled_view, resampling_mat.T, out=resampled_view)
+
+        # reorder data
+        return self.reorder_nodes(resampled, firedrake_to_meshmode=False)
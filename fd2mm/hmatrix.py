@@ -0,0 +1,429 @@
+import pickle
+import numpy as np
+import numpy.linalg as la
+
+from fd2mm.dense import DenseOpConnection
+
+__doc__ = """
+Operators applied as hierarchically compressed matrices, as returned by
+:func:`fd2mm.op.fd_bind` with *mode='hmatrix'*.
+
+.. autoclass:: ClusterTree
+    :members:
+
+.. autoclass:: HMatrix
+    :members:
+
+.. autofunction:: aca
+
+.. autofunction:: build_hmatrix
+
+.. autoclass:: HMatrixOpConnection
+    :members:
+"""
+
+
+class ClusterTree:
+    """
+        A binary tree of clusters of points, made by recursively bisecting
+        the bounding box of the points along its longest side.
+
+        .. attribute:: indices
+
+            The indices (into the points) of this cluster
+
+        .. attribute:: children
+
+            Either an empty list (for a leaf) or the two child
+            clusters
+    """
+    def __init__(self, points, indices=None, leaf_size=64):
+        """
+            :arg points: An array of shape *(dim, npoints)*
+            :arg indices: The indices of points in this cluster,
+                *None* for all of them
+            :arg leaf_size: Clusters with at most this many points
+                are not split
+        """
+        if indices is None:
+            indices = np.arange(points.shape[1])
+
+        self.indices = indices
+        self.bbox_min = np.min(points[:, indices], axis=1)
+        self.bbox_max = np.max(points[:, indices], axis=1)
+        self.children = []
+
+        if len(indices) > leaf_size:
+            axis = np.argmax(self.bbox_max - self.bbox_min)
+            coords = points[axis, indices]
+            order = np.argsort(coords, kind='mergesort')
+            half = len(indices) // 2
+            self.children = [ClusterTree(points, indices[order[:half]], leaf_size),
+                             ClusterTree(points, indices[order[half:]], leaf_size)]
+
+    def diameter(self):
+        return la.norm(self.bbox_max - self.bbox_min)
+
+    def distance(self, other):
+        """
+            Return the distance between the bounding boxes of *self*
+            and *other*
+        """
+        gaps = np.maximum(0, np.maximum(self.bbox_min - other.bbox_max,
+                                        other.bbox_min - self.bbox_max))
+        return la.norm(gaps)
+
+    def is_admissible(self, other, eta):
+        """
+            Return *True* iff the interaction between *self* and *other*
+            is expected to be low rank, i.e.
+            *max(diam(self), diam(other)) <= eta * dist(self, other)*
+        """
+        return max(self.diameter(), other.diameter()) \
+            <= eta * self.distance(other)
+
+    def leaves(self):
+        if not self.children:
+            return [self]
+        return [leaf for child in self.children for leaf in child.leaves()]
+
+
+def _recompress(u, v, tol):
+    """
+        Return factors *(u', v')* of smallest rank with
+        *u' @ v'* within relative accuracy *tol* of *u @ v*, found from the
+        SVD of the small *(rank, rank)* core of the QR factorizations
+    """
+    q_u, r_u = la.qr(u)
+    q_v, r_v = la.qr(v.T)
+    w, sigma, zh = la.svd(r_u.dot(r_v.T))
+    if sigma[0] == 0:
+        return u[:, :0], v[:0]
+    rank = np.count_nonzero(sigma > tol * sigma[0])
+    return q_u.dot(w[:, :rank] * sigma[:rank]), zh[:rank].dot(q_v.T)
+
+
+def aca(get_row, get_column, shape, tol, max_rank=None):
+    """
+        Compress a matrix with adaptive cross approximation (with partial
+        pivoting), which only evaluates the rows and columns it uses.
+
+        :arg get_row: A function taking a row index to that row
+        :arg get_column: A function taking a column index to that column
+        :arg shape: The shape of the matrix
+        :arg tol: The relative accuracy (in the Frobenius norm) to stop at
+        :arg max_rank: Give up once the rank would exceed *max_rank*,
+            default is the rank above which the factors are larger than
+            the matrix
+
+        Returns factors *(u, v)* (the matrix is about *u @ v*), or *None*
+        if no approximation of rank at most *max_rank* was found
+    """
+    nrows, ncolumns = shape
+    if max_rank is None:
+        max_rank = nrows * ncolumns // (nrows + ncolumns)
+
+    us = []
+    vs = []
+    used_rows = np.zeros(nrows, dtype=bool)
+    norm_squared = 0
+    irow = 0
+    while len(us) < max_rank:
+        used_rows[irow] = True
+        row = get_row(irow) - sum(u[irow] * v for u, v in zip(us, vs))
+        jcolumn = np.argmax(np.abs(row))
+
+        if row[jcolumn] != 0:
+            v = row / row[jcolumn]
+            u = get_column(jcolumn) - sum(v_k[jcolumn] * u_k
+                                          for u_k, v_k in zip(us, vs))
+
+            # ||sum u_k v_k||^2, updated with the cross terms of the new term
+            u_norm, v_norm = la.norm(u), la.norm(v)
+            norm_squared += (u_norm * v_norm)**2 + 2 * sum(
+                np.real(np.vdot(u_k, u) * np.vdot(v_k, v))
+                for u_k, v_k in zip(us, vs))
+            us.append(u)
+            vs.append(v)
+
+            if u_norm * v_norm <= tol * np.sqrt(abs(norm_squared)):
+                return _recompress(np.array(us).T, np.array(vs), tol)
+
+            # next pivot row is the largest entry of the new column
+            candidates = np.where(used_rows, -1, np.abs(u))
+        else:
+            # the row is already reproduced, try another
+            candidates = np.where(used_rows, -1, 0)
+
+        if np.all(used_rows):
+            return _recompress(np.array(us).T, np.array(vs), tol) if us \
+                else (np.zeros((nrows, 0)), np.zeros((0, ncolumns)))
+        irow = np.argmax(candidates)
+
+    return None
+
+
+def _source_partition(target_cluster, source_cluster, eta):
+    """
+        Return a list of pairs *(source cluster, admissible)*
+        of the coarsest source clusters which are either admissible
+        with respect to *target_cluster* or leaves
+    """
+    if source_cluster.is_admissible(target_cluster, eta):
+        return [(source_cluster, True)]
+    if not source_cluster.children:
+        return [(source_cluster, False)]
+    return [pair for child in source_cluster.children
+            for pair in _source_partition(target_cluster, child, eta)]
+
+
+class HMatrix:
+    """
+        A compressed representation of a matrix mapping *ninputs* stacked
+        densities on *nsources* points to *nops* stacked outputs on
+        *ntargets* points.
+
+        The targets are split into the leaves of a target :class:`ClusterTree`.
+        For each target leaf the sources are split into the coarsest clusters
+        of a source :class:`ClusterTree` which are admissible
+        (see :meth:`ClusterTree.is_admissible`), whose blocks
+        are stored in low rank form, or leaves, whose blocks
+        are stored densely.
+
+        .. attribute:: blocks
+
+            A list of tuples *(target_indices, source_indices, factors)*,
+            where *factors* is either *(U, V)* (the block is *U @ V*) or
+            *(D,)* (the block is *D*)
+    """
+    def __init__(self, shape, nops, ninputs, dtype):
+        """
+            :arg shape: *(nops * ntargets, ninputs * nsources)*
+        """
+        self.shape = shape
+        self.nops = nops
+        self.ninputs = ninputs
+        self.dtype = dtype
+        self.blocks = []
+
+    @property
+    def near_field_nbytes(self):
+        """
+            The number of bytes used to store the near field
+            (the dense blocks)
+        """
+        return sum(factors[0].nbytes for _, _, factors in self.blocks
+                   if len(factors) == 1)
+
+    @property
+    def far_field_nbytes(self):
+        """
+            The number of bytes used to store the far field
+            (the low rank blocks)
+        """
+        return sum(factor.nbytes for _, _, factors in self.blocks
+                   for factor in factors if len(factors) == 2)
+
+    @property
+    def nbytes(self):
+        """
+            The number of bytes used to store the matrix
+        """
+        return self.near_field_nbytes + self.far_field_nbytes
+
+    def compression_ratio(self):
+        """
+            Return (bytes of dense matrix) / (bytes of this matrix)
+        """
+        dense_nbytes = self.shape[0] * self.shape[1] * np.dtype(self.dtype).itemsize
+        return dense_nbytes / max(self.nbytes, 1)
+
+    def add_block(self, target_indices, source_indices, block, tol):
+        """
+            Store *block* (a *(nops * ntgt, ninputs * nsrc)* array), compressed to
+            relative accuracy *tol* (with :func:`aca`) if it saves memory
+        """
+        if tol is not None:
+            factors = aca(lambda i: block[i], lambda j: block[:, j],
+                          block.shape, tol)
+            if factors is not None:
+                self.add_factors(target_indices, source_indices, factors)
+                return
+
+        self.blocks.append((target_indices, source_indices, (block,)))
+
+    def add_factors(self, target_indices, source_indices, factors):
+        """
+            Store the block (with rows and columns as in :meth:`add_block`)
+            which is *u @ v*, where *factors* is *(u, v)*
+        """
+        self.blocks.append((target_indices, source_indices, factors))
+
+    def matvec(self, x, out=None):
+        """
+            Return the product with *x*, an array of size *self.shape[1]*
+        """
+        if out is None:
+            out = np.empty(self.shape[0], dtype=np.result_type(self.dtype, x.dtype))
+
+        self.matmat(x.reshape((-1, 1)), out=out.reshape((-1, 1)))
+        return out
+
+    def matmat(self, x, out=None):
+        """
+            Return the product with *x*, an array of shape
+            *(self.shape[1], nvectors)*
+        """
+        nvectors = x.shape[1]
+        if out is None:
+            out = np.empty((self.shape[0], nvectors),
+                           dtype=np.result_type(self.dtype, x.dtype))
+        out.fill(0)
+
+        x = x.reshape((self.ninputs, -1, nvectors))
+        y = out.reshape((self.nops, -1, nvectors))
+        for target_indices, source_indices, factors in self.blocks:
+            xs = x[:, source_indices].reshape((-1, nvectors))
+            for factor in reversed(factors):
+                xs = factor.dot(xs)
+            y[:, target_indices] += xs.reshape((self.nops, -1, nvectors))
+
+        return out
+
+
+def build_hmatrix(queue, qbx, target, op, input_exprs, context,
+                  tol=1e-8, leaf_size=64, eta=1.0):
+    """
+        Build an :class:`HMatrix` representation of the matrix described
+        in :func:`fd2mm.dense.build_dense_matrix`. Entries are computed
+        directly from the kernels (see :class:`fd2mm.direct.DirectBlockEvaluator`,
+        so the same operators are supported as in *mode='numpy'*).
+        Dense blocks are evaluated whole, and admissible blocks
+        are compressed by :func:`aca`, which only evaluates the rows
+        and columns it samples.
+
+        :arg tol: Relative accuracy of each compressed block
+        :arg leaf_size: see :class:`ClusterTree`
+        :arg eta: see :meth:`ClusterTree.is_admissible`
+    """
+    from fd2mm.direct import DirectBlockEvaluator
+
+    nops = len(op) if isinstance(op, np.ndarray) else 1
+    ninputs = len(input_exprs)
+
+    target_points = np.asarray(target.nodes())
+    source_points = qbx.density_discr.nodes().get(queue=queue)
+    ntargets = target_points.shape[1]
+    nsources = source_points.shape[1]
+
+    evaluator = DirectBlockEvaluator(qbx.density_discr, target_points, op,
+                                     input_exprs, context)
+    target_tree = ClusterTree(target_points, leaf_size=leaf_size)
+    source_tree = ClusterTree(source_points, leaf_size=leaf_size)
+
+    hmat = HMatrix((nops * ntargets, ninputs * nsources), nops, ninputs,
+                   np.float64)
+    for target_leaf in target_tree.leaves():
+        tgt = target_leaf.indices
+        for source_cluster, admissible in _source_partition(target_leaf,
+                                                            source_tree, eta):
+            src = source_cluster.indices
+
+            factors = None
+            if admissible:
+                # row (op, target) and column (input, source) of the block
+                def get_row(i):
+                    iop, itgt = divmod(i, len(tgt))
+                    return evaluator(tgt[itgt:itgt+1], src)[iop]
+
+                def get_column(j):
+                    iinput, isrc = divmod(j, len(src))
+                    return evaluator(tgt, src[isrc:isrc+1])[:, iinput]
+
+                factors = aca(get_row, get_column,
+                              (nops * len(tgt), ninputs * len(src)), tol)
+
+            if factors is None:
+                block = evaluator(tgt, src)
+                hmat.add_block(tgt, src, block, None)
+            else:
+                block = factors[0]
+                hmat.add_factors(tgt, src, factors)
+            hmat.dtype = np.result_type(hmat.dtype, block.dtype)
+
+    return hmat
+
+
+class HMatrixOpConnection(DenseOpConnection):
+    """
+        Exactly like :class:`fd2mm.dense.DenseOpConnection`, but
+        the matrix is stored as an :class:`HMatrix` (see :func:`build_hmatrix`
+        for the operators supported).
+        The same restrictions on the target apply.
+
+        The (sparse) source conversion matrix is kept alongside the
+        :class:`HMatrix` rather than composed into it, and applied
+        to the :mod:`firedrake` data first.
+    """
+    _cache_suffix = '.hmat.pickle'
+
+    def __init__(self, function_space_analog, source_connection, target_connection,
+                 op, cache_dir=None, tol=1e-8, leaf_size=64, eta=1.0, **kwargs):
+        """
+            :arg tol: Relative accuracy of each compressed block
+            :arg leaf_size: see :class:`ClusterTree`
+            :arg eta: see :meth:`ClusterTree.is_admissible`
+
+            For other args see :class:`fd2mm.dense.DenseOpConnection`
+        """
+        self._hmatrix_kwargs = {'tol': tol, 'leaf_size': leaf_size, 'eta': eta}
+        super(HMatrixOpConnection, self).__init__(function_space_analog,
+                                                  source_connection,
+                                                  target_connection,
+                                                  op, cache_dir=cache_dir,
+                                                  **kwargs)
+
+    def _cache_key(self, densities, context):
+        key = super(HMatrixOpConnection, self)._cache_key(densities, context)
+        return key + '-' + '-'.join('%s%s' % (k, v) for k, v in
+                                    sorted(self._hmatrix_kwargs.items()))
+
+    def _assemble_matrix(self, queue, input_exprs, context):
+        return build_hmatrix(queue, self._qbx,
+                             self._target_connection.get_target(),
+                             self._op, input_exprs, context,
+                             **self._hmatrix_kwargs)
+
+    def _load_matrix(self, file_name):
+        with open(file_name, 'rb') as in_file:
+            return pickle.load(in_file)
+
+    def _save_matrix(self, mat, file_name):
+        with open(file_name, 'wb') as out_file:
+            pickle.dump(mat, out_file)
+
+    def _compose_conversion(self, mat, conversion):
+        return (mat, conversion)
+
+    def _matrix_dtype(self, mat):
+        return mat[0].dtype
+
+    def _apply_matrix(self, mat, x, out):
+        hmat, conversion = mat
+        x = conversion.dot(x)
+        if x.ndim == 1:
+            hmat.matvec(x, out=out)
+        else:
+            hmat.matmat(x, out=out)
+
+    def memory_report(self):
+        """
+            Return a list of dicts, one for each matrix held in memory,
+            with keys *'nbytes'*, *'near_field_nbytes'*, *'far_field_nbytes'*,
+            and *'compression_ratio'*
+        """
+        return [{'nbytes': hmat.nbytes,
+                 'near_field_nbytes': hmat.near_field_nbytes,
+                 'far_field_nbytes': hmat.far_field_nbytes,
+                 'compression_ratio': hmat.compression_ratio()}
+                for hmat, _ in self._matrices.values()]
@@ -0,0 +1,211 @@
+import numpy as np
+from scipy.sparse.linalg import LinearOperator
+
+from firedrake.petsc import PETSc
+from firedrake.utils import ScalarType
+
+__doc__ = """
+Linear algebra wrappers around a bound operator
+(an :class:`fd2mm.op.OpConnection`, as returned by
+:func:`fd2mm.op.fd_bind`), so that it can be handed directly
+to :mod:`PETSc` or :mod:`scipy` solvers.
+
+Vectors are in the layout of the :mod:`firedrake` data (i.e.
+the layout of *f.dat.data.flatten()* for a function *f*), and are
+converted straight to/from device arrays without creating
+any intermediate :mod:`firedrake` :class:`Function`.
+
+.. autoclass:: OpConnectionMatrixContext
+    :members:
+
+.. autofunction:: op_connection_to_petsc_mat
+
+.. autoclass:: OpConnectionLinearOperator
+    :members:
+"""
+
+
+def _check_not_truncated(result_dtype, out_dtype):
+    """
+        Raise a *TypeError* if writing values of *result_dtype*
+        into an array of *out_dtype* would drop their imaginary part
+    """
+    if np.issubdtype(result_dtype, np.complexfloating) \
+            and not np.issubdtype(out_dtype, np.complexfloating):
+        raise TypeError("Operator result is complex (%s), but the output"
+                        " is real (%s). Use a complex build of PETSc/firedrake"
+                        % (result_dtype, out_dtype))
+
+
+class OpConnectionMatrixContext:
+    """
+        A :mod:`petsc4py` python matrix context representing the
+        linear map *density -> op(density)* of a bound operator,
+        all other arguments of the operator held fixed
+    """
+    def __init__(self, queue, op_connection, density_name, **op_kwargs):
+        """
+            :arg queue: A :mod:`pyopencl` queue to evaluate on
+            :arg op_connection: An :class:`fd2mm.op.OpConnection`
+            :arg density_name: The name of the variable in the operator
+                which the input vector is (e.g. *"u"* for
+                *sym.var("u")*)
+            :arg op_kwargs: Any other arguments to the operator
+                (e.g. a wave number). These must not be
+                :mod:`firedrake` functions.
+        """
+        self.queue = queue
+        self.op_connection = op_connection
+        self.density_name = density_name
+        self.op_kwargs = op_kwargs
+
+        source_fspace = op_connection.get_source_connection().get_function_space()
+        target_fspace = op_connection.get_target_connection().get_function_space()
+
+        # Shapes of the firedrake data of the source/target functions
+        self._source_shape = (source_fspace.node_set.size,) + source_fspace.shape
+        self._target_shape = (target_fspace.node_set.size,) + target_fspace.shape
+
+        self.source_function_space = source_fspace
+        self.target_function_space = target_fspace
+
+        # Reused by :meth:`matmat`
+        self._matmat_buffer = None
+        self._target_buffer = None
+
+    @property
+    def shape(self):
+        """
+            (number of target dofs, number of source dofs)
+        """
+        return (int(np.prod(self._target_shape)), int(np.prod(self._source_shape)))
+
+    def apply(self, x, y):
+        """
+            :arg x: An array of size *self.shape[1]*, in
+                :mod:`firedrake` data layout
+            :arg y: An array of size *self.shape[0]*, in
+                :mod:`firedrake` data layout. This is written into
+                (as a view if possible)
+
+            y <- op(x)
+
+            Raises *TypeError* if the result is complex but *y* is real
+        """
+        target_connection = self.op_connection.get_target_connection()
+
+        density = self.op_connection.convert_density(
+            self.queue, x.reshape(self._source_shape))
+        kwargs = dict(self.op_kwargs)
+        kwargs[self.density_name] = density
+
+        result = self.op_connection.evaluate(self.queue, **kwargs)
+        _check_not_truncated(result.dtype, y.dtype)
+
+        y_view = y.reshape(self._target_shape)
+        # Not every node need be a target (e.g. a bdy target)
+        y_view.fill(0)
+        target_connection(self.queue, result, y_view)
+
+    def matmat(self, X, Y=None):
+        """
+            :arg X: An array of shape *(self.shape[1], nvectors)*
+            :arg Y: If not *None*, an array of shape
+                *(self.shape[0], nvectors)* to write the result into
+
+            Returns *Y*, with *Y[:, i] = op(X[:, i])*. If *Y* is *None*,
+            the returned array is reused (and overwritten) by the
+            next call with the same number of vectors.
+
+            Note that the operator is still evaluated once per column
+            (see :meth:`fd2mm.op.OpConnection.evaluate_many`), only the
+            geometry is shared, so this costs *nvectors* applications.
+
+            Raises *TypeError* if the result is complex but *Y* is real
+        """
+        if Y is None:
+            if self._matmat_buffer is None \
+                    or self._matmat_buffer.shape[1] != X.shape[1]:
+                self._matmat_buffer = np.empty((self.shape[0], X.shape[1]),
+                                               dtype=ScalarType)
+            Y = self._matmat_buffer
+
+        target_connection = self.op_connection.get_target_connection()
+
+        densities = [self.op_connection.convert_density(
+                        self.queue,
+                        np.ascontiguousarray(X[:, i]).reshape(self._source_shape))
+                     for i in range(X.shape[1])]
+        kwargs = dict(self.op_kwargs)
+        kwargs[self.density_name] = densities
+
+        results = self.op_connection.evaluate_many(self.queue, **kwargs)
+        _check_not_truncated(results.dtype, Y.dtype)
+
+        if self._target_buffer is None or self._target_buffer.dtype != Y.dtype:
+            self._target_buffer = np.empty(self._target_shape, dtype=Y.dtype)
+        y = self._target_buffer
+        for i, result in enumerate(results):
+            # Not every node need be a target (e.g. a bdy target)
+            y.fill(0)
+            target_connection(self.queue, result, y)
+            Y[:, i] = y.reshape(-1)
+
+        return Y
+
+    def mult(self, mat, x, y):
+        """
+            :mod:`petsc4py` python matrix multiplication, *y <- op(x)*
+        """
+        self.apply(x.array_r, y.array)
+
+
+def op_connection_to_petsc_mat(queue, op_connection, density_name, **op_kwargs):
+    """
+        Return a :mod:`PETSc` :class:`Mat` of type *PYTHON* whose
+        context is an :class:`OpConnectionMatrixContext`
+        (see its constructor for a description of the arguments)
+
+        The sizes of the :class:`Mat` match those of a :mod:`firedrake`
+        matrix from the source function space to the target
+        function space, so it can be used alongside those
+        (e.g. as a block in a fieldsplit)
+    """
+    ctx = OpConnectionMatrixContext(queue, op_connection, density_name,
+                                    **op_kwargs)
+
+    row_sizes = ctx.target_function_space.dof_dset.layout_vec.getSizes()
+    col_sizes = ctx.source_function_space.dof_dset.layout_vec.getSizes()
+
+    mat = PETSc.Mat().create()
+    mat.setSizes((row_sizes, col_sizes))
+    mat.setType(mat.Type.PYTHON)
+    mat.setPythonContext(ctx)
+    mat.setUp()
+
+    return mat
+
+
+class OpConnectionLinearOperator(LinearOperator):
+    """
+        A :class:`scipy.sparse.linalg.LinearOperator` wrapping an
+        :class:`OpConnectionMatrixContext` (see its constructor
+        for a description of the arguments)
+    """
+    def __init__(self, queue, op_connection, density_name, **op_kwargs):
+        self.ctx = OpConnectionMatrixContext(queue, op_connection, density_name,
+                                             **op_kwargs)
+        super(OpConnectionLinearOperator, self).__init__(ScalarType,
+                                                         self.ctx.shape)
+        # Reused as output of :meth:`_matvec`
+        self._y = np.empty(self.shape[0], dtype=ScalarType)
+
+    def _matvec(self, x):
+        _check_not_truncated(x.dtype, ScalarType)
+        self.ctx.apply(np.ascontiguousarray(x, dtype=ScalarType).ravel(),
+                       self._y)
+        return self._y.copy()
+
+    def _matmat(self, X):
+        _check_not_truncated(X.dtype, ScalarType)
+        return self.ctx.matmat(X).copy()
@@ -0,0 +1,99 @@
+from threading import Lock
+from weakref import WeakValueDictionary
+from pyopencl.tools import DeferredAllocator, MemoryPool
+
+__doc__ = """
+Device memory used by :mod:`fd2mm` is allocated from one
+:class:`pyopencl.tools.MemoryPool` per context, so that repeated
+operator applications (e.g. in a Krylov solve) reuse buffers
+instead of creating and releasing them every time.
+
+.. autoclass:: CountingMemoryPool
+    :members:
+
+.. autofunction:: get_memory_pool
+"""
+
+
+class CountingMemoryPool:
+    """
+        A callable allocator (usable as the *allocator* argument
+        of :mod:`pyopencl.array` functions) wrapping a
+        :class:`pyopencl.tools.MemoryPool` and counting how many
+        allocations were served from blocks already held by the pool
+    """
+    def __init__(self, cl_ctx):
+        self.pool = MemoryPool(DeferredAllocator(cl_ctx))
+        self.nallocations = 0
+        self.nhits = 0
+        self._lock = Lock()
+
+    def __call__(self, size):
+        with self._lock:
+            held_blocks = self.pool.held_blocks
+            buf = self.pool.allocate(size)
+
+            self.nallocations += 1
+            # A held block was handed out instead of a new one allocated
+            if self.pool.held_blocks < held_blocks:
+                self.nhits += 1
+
+        return buf
+
+    def hit_rate(self):
+        """
+            Return the fraction of allocations served from held blocks
+            (0 if nothing has been allocated yet)
+        """
+        if self.nallocations == 0:
+            return 0.0
+        return self.nhits / self.nallocations
+
+    def stats(self):
+        """
+            Return a dict with keys *'held_blocks'*, *'active_blocks'*,
+            *'held_bytes'*, *'active_bytes'*, *'nallocations'*, *'nhits'*,
+            and *'hit_rate'*. The byte counts are *None* if the installed
+            :mod:`pyopencl` does not report them.
+        """
+        managed_bytes = getattr(self.pool, 'managed_bytes', None)
+        active_bytes = getattr(self.pool, 'active_bytes', None)
+        held_bytes = None
+        if managed_bytes is not None and active_bytes is not None:
+            held_bytes = managed_bytes - active_bytes
+
+        return {'held_blocks': self.pool.held_blocks,
+                'active_blocks': self.pool.active_blocks,
+                'held_bytes': held_bytes,
+                'active_bytes': active_bytes,
+                'nallocations': self.nallocations,
+                'nhits': self.nhits,
+                'hit_rate': self.hit_rate()}
+
+    def free_held(self):
+        """
+            Release all blocks held (but not in use) by the pool
+        """
+        with self._lock:
+            self.pool.free_held()
+
+
+# maps contexts to their :class:`CountingMemoryPool`. A pool refers to its
+# context, so weak keys would never expire: instead, a pool (and with
+# it the context) is dropped once nothing else holds it
+_memory_pools = WeakValueDictionary()
+_memory_pools_lock = Lock()
+
+
+def get_memory_pool(cl_ctx):
+    """
+        Return the :class:`CountingMemoryPool` of *cl_ctx*,
+        creating it if necessary. The pool is shared for as long
+        as someone (e.g. a bound operator) holds on to it.
+    """
+    with _memory_pools_lock:
+        pool = _memory_pools.get(cl_ctx)
+        if pool is None:
+            pool = CountingMemoryPool(cl_ctx)
+            _memory_pools[cl_ctx] = pool
+        return pool
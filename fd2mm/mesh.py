@@ -1,5 +1,6 @@
 from warnings import warn  # noqa
 from collections import defaultdict
+from threading import RLock
 import numpy as np
 
 from fd2mm.analog import Analog
@@ -54,6 +55,10 @@ class MeshTopologyAnalog(Analog):
             raise ValueError("Cell dimension is %s. Cell dimension must be one of"
                              "range %s" % (self.cell_dimension(), supported_dims))
 
+        # Guards lazily computed attributes, so that they are computed
+        # once even if accessed from several threads
+        self._lock = RLock()
+
         self._nodal_adjacency = None
         self.icell_to_fd = cells_to_use  # Map cell index -> fd cell index
         self.fd_to_icell = None          # Map fd cell index -> cell index
@@ -112,65 +117,66 @@ class MeshTopologyAnalog(Analog):
             Returns a :class:`meshmode.mesh.NodalAdjacency` object
             representing the nodal adjacency of this mesh
         """
-        if self._nodal_adjacency is None:
-            plex = self.analog()._plex
-
-            cStart, cEnd = plex.getHeightStratum(0)
-            vStart, vEnd = plex.getDepthStratum(0)
-
-            to_fd_id = np.vectorize(self.analog()._cell_numbering.getOffset)(
-                np.arange(cStart, cEnd, dtype=np.int32))
-
-            element_to_neighbors = {}
-            verts_checked = set()  # dmplex ids of vertex checked
-
-            # If using all cells, loop over them all
-            if self.icell_to_fd is None:
-                range_ = range(cStart, cEnd)
-            # Otherwise, just the ones you're using
-            else:
-                isin = np.isin(to_fd_id, self.icell_to_fd)
-                range_ = np.arange(cStart, cEnd, dtype=np.int32)[isin]
-
-            # For each cell
-            for cell_id in range_:
-                # For each vertex touching the cell (that haven't already seen)
-                for vert_id in plex.getTransitiveClosure(cell_id)[0]:
-                    if vStart <= vert_id < vEnd and vert_id not in verts_checked:
-                        verts_checked.add(vert_id)
-                        cells = []
-                        # Record all cells touching that vertex
-                        support = plex.getTransitiveClosure(vert_id,
-                                                            useCone=False)[0]
-                        for other_cell_id in support:
-                            if cStart <= other_cell_id < cEnd:
-                                cells.append(to_fd_id[other_cell_id - cStart])
-
-                        # If only using some cells, clean out extraneous ones
-                        # and relabel them to new id
-                        cells = set(cells)
-                        if self.fd_to_icell is not None:
-                            cells = set([self.fd_to_icell[fd_ndx]
-                                         for fd_ndx in cells
-                                         if fd_ndx in self.fd_to_icell])
-
-                        # mark cells as neighbors
-                        for cell_one in cells:
-                            element_to_neighbors.setdefault(cell_one, set())
-                            element_to_neighbors[cell_one] |= cells
-
-            # Create neighbors_starts and neighbors
-            neighbors = []
-            neighbors_starts = np.zeros(self.nelements() + 1, dtype=np.int32)
-            for iel in range(len(element_to_neighbors)):
-                elt_neighbors = element_to_neighbors[iel]
-                neighbors += list(elt_neighbors)
-                neighbors_starts[iel+1] = len(neighbors)
-
-            neighbors = np.array(neighbors, dtype=np.int32)
-
-            self._nodal_adjacency = NodalAdjacency(neighbors_starts=neighbors_starts,
-                                                   neighbors=neighbors)
+        with self._lock:
+            if self._nodal_adjacency is None:
+                plex = self.analog()._plex
+
+                cStart, cEnd = plex.getHeightStratum(0)
+                vStart, vEnd = plex.getDepthStratum(0)
+
+                to_fd_id = np.vectorize(self.analog()._cell_numbering.getOffset)(
+                    np.arange(cStart, cEnd, dtype=np.int32))
+
+                element_to_neighbors = {}
+                verts_checked = set()  # dmplex ids of vertex checked
+
+                # If using all cells, loop over them all
+                if self.icell_to_fd is None:
+                    range_ = range(cStart, cEnd)
+                # Otherwise, just the ones you're using
+                else:
+                    isin = np.isin(to_fd_id, self.icell_to_fd)
+                    range_ = np.arange(cStart, cEnd, dtype=np.int32)[isin]
+
+                # For each cell
+                for cell_id in range_:
+                    # For each vertex touching the cell (that haven't already seen)
+                    for vert_id in plex.getTransitiveClosure(cell_id)[0]:
+                        if vStart <= vert_id < vEnd and vert_id not in verts_checked:
+                            verts_checked.add(vert_id)
+                            cells = []
+                            # Record all cells touching that vertex
+                            support = plex.getTransitiveClosure(vert_id,
+                                                                useCone=False)[0]
+                            for other_cell_id in support:
+                                if cStart <= other_cell_id < cEnd:
+                                    cells.append(to_fd_id[other_cell_id - cStart])
+
+                            # If only using some cells, clean out extraneous ones
+                            # and relabel them to new id
+                            cells = set(cells)
+                            if self.fd_to_icell is not None:
+                                cells = set([self.fd_to_icell[fd_ndx]
+                                             for fd_ndx in cells
+                                             if fd_ndx in self.fd_to_icell])
+
+                            # mark cells as neighbors
+                            for cell_one in cells:
+                                element_to_neighbors.setdefault(cell_one, set())
+                                element_to_neighbors[cell_one] |= cells
+
+                # Create neighbors_starts and neighbors
+                neighbors = []
+                neighbors_starts = np.zeros(self.nelements() + 1, dtype=np.int32)
+                for iel in range(len(element_to_neighbors)):
+                    elt_neighbors = element_to_neighbors[iel]
+                    neighbors += list(elt_neighbors)
+                    neighbors_starts[iel+1] = len(neighbors)
+
+                neighbors = np.array(neighbors, dtype=np.int32)
+
+                self._nodal_adjacency = NodalAdjacency(
+                    neighbors_starts=neighbors_starts, neighbors=neighbors)
         return self._nodal_adjacency
 
 
@@ -238,6 +244,9 @@ class MeshGeometryAnalog(Analog):
 
         # For sharing data like in firedrake
         self._shared_data_cache = defaultdict(dict)
+        # Guards :attr:`_shared_data_cache`, :meth:`init`, and lazily
+        # computed attributes
+        self._lock = RLock()
 
         # Store input information
         self._coordinates_a = coordinates_analog
@@ -278,8 +287,9 @@ class MeshGeometryAnalog(Analog):
         return not hasattr(self, '_callback')
 
     def init(self, cl_ctx):
-        if not self.initialized():
-            self._callback(cl_ctx)
+        with self._lock:
+            if not self.initialized():
+                self._callback(cl_ctx)
 
     def __getattr__(self, attr):
         """
@@ -302,43 +312,45 @@ class MeshGeometryAnalog(Analog):
                                  " (i.e. have you called :meth:`init`")
 
     def _compute_vertex_indices_and_vertices(self):
-        if self._vertex_indices is None:
-            finat_element_a = self.coordinates_a.function_space_a().finat_element_a
-
-            # Convert cell node list of mesh to vertex list
-            unit_vertex_indices = finat_element_a.unit_vertex_indices()
-            cfspace = self.analog().coordinates.function_space()
-            if self.icell_to_fd is not None:
-                cell_node_list = cfspace.cell_node_list[self.icell_to_fd]
-            else:
-                cell_node_list = cfspace.cell_node_list
-
-            vertex_indices = cell_node_list[:, unit_vertex_indices]
-
-            # Get maps newnumbering->old and old->new (new numbering comes
-            #                                          from removing the non-vertex
-            #                                          nodes)
-            vert_ndx_to_fd_ndx = np.unique(vertex_indices.flatten())
-            fd_ndx_to_vert_ndx = dict(zip(vert_ndx_to_fd_ndx,
-                                          np.arange(vert_ndx_to_fd_ndx.shape[0],
-                                                    dtype=np.int32)
-                                          ))
-            # Get vertices array
-            vertices = np.real(
-                self.analog().coordinates.dat.data[vert_ndx_to_fd_ndx])
-
-            #:mod:`meshmode` wants shape to be [ambient_dim][nvertices]
-            if len(vertices.shape) == 1:
-                # 1 dim case, (note we're about to transpose)
-                vertices = vertices.reshape(vertices.shape[0], 1)
-            vertices = vertices.T.copy()
-
-            # Use new numbering on vertex indices
-            vertex_indices = np.vectorize(fd_ndx_to_vert_ndx.get)(vertex_indices)
-
-            # store vertex indices and vertices
-            self._vertex_indices = vertex_indices
-            self._vertices = vertices
+        with self._lock:
+            if self._vertex_indices is None:
+                coords_fspace_a = self.coordinates_a.function_space_a()
+                finat_element_a = coords_fspace_a.finat_element_a
+
+                # Convert cell node list of mesh to vertex list
+                unit_vertex_indices = finat_element_a.unit_vertex_indices()
+                cfspace = self.analog().coordinates.function_space()
+                if self.icell_to_fd is not None:
+                    cell_node_list = cfspace.cell_node_list[self.icell_to_fd]
+                else:
+                    cell_node_list = cfspace.cell_node_list
+
+                vertex_indices = cell_node_list[:, unit_vertex_indices]
+
+                # Get maps newnumbering->old and old->new (new numbering
+                #                                          comes from removing
+                #                                          the non-vertex nodes)
+                vert_ndx_to_fd_ndx = np.unique(vertex_indices.flatten())
+                fd_ndx_to_vert_ndx = dict(zip(vert_ndx_to_fd_ndx,
+                                              np.arange(vert_ndx_to_fd_ndx.shape[0],
+                                                        dtype=np.int32)
+                                              ))
+                # Get vertices array
+                vertices = np.real(
+                    self.analog().coordinates.dat.data[vert_ndx_to_fd_ndx])
+
+                #:mod:`meshmode` wants shape to be [ambient_dim][nvertices]
+                if len(vertices.shape) == 1:
+                    # 1 dim case, (note we're about to transpose)
+                    vertices = vertices.reshape(vertices.shape[0], 1)
+                vertices = vertices.T.copy()
+
+                # Use new numbering on vertex indices
+                vertex_indices = np.vectorize(fd_ndx_to_vert_ndx.get)(vertex_indices)
+
+                # store vertex indices and vertices
+                self._vertex_indices = vertex_indices
+                self._vertices = vertices
 
     def vertex_indices(self):
         self._compute_vertex_indices_and_vertices()
@@ -349,43 +361,46 @@ class MeshGeometryAnalog(Analog):
         return self._vertices
 
     def nodes(self):
-        if self._nodes is None:
-            coords = self.analog().coordinates.dat.data
-            cfspace = self.analog().coordinates.function_space()
+        with self._lock:
+            if self._nodes is None:
+                coords = self.analog().coordinates.dat.data
+                cfspace = self.analog().coordinates.function_space()
 
-            if self.icell_to_fd is not None:
-                cell_node_list = cfspace.cell_node_list[self.icell_to_fd]
-            else:
-                cell_node_list = cfspace.cell_node_list
-            self._nodes = np.real(coords[cell_node_list])
+                if self.icell_to_fd is not None:
+                    cell_node_list = cfspace.cell_node_list[self.icell_to_fd]
+                else:
+                    cell_node_list = cfspace.cell_node_list
+                self._nodes = np.real(coords[cell_node_list])
 
-            # reshape for 1D so that [nelements][nunit_nodes][dim]
-            if len(self._nodes.shape) != 3:
-                self._nodes = np.reshape(self._nodes, self._nodes.shape + (1,))
+                # reshape for 1D so that [nelements][nunit_nodes][dim]
+                if len(self._nodes.shape) != 3:
+                    self._nodes = np.reshape(self._nodes, self._nodes.shape + (1,))
 
-            # Change shape to [dim][nelements][nunit_nodes]
-            self._nodes = np.transpose(self._nodes, (2, 0, 1))
+                # Change shape to [dim][nelements][nunit_nodes]
+                self._nodes = np.transpose(self._nodes, (2, 0, 1))
 
         return self._nodes
 
     def group(self):
-        if self._group is None:
-            from meshmode.mesh import SimplexElementGroup
-            from meshmode.mesh.processing import flip_simplex_element_group
-
-            finat_element_a = self.coordinates_a.function_space_a().finat_element_a
-
-            # IMPORTANT that set :attr:`_group` because
-            # :meth:`orientations` may call :meth:`group`
-            self._group = SimplexElementGroup(
-                finat_element_a.analog().degree,
-                self.vertex_indices(),
-                self.nodes(),
-                dim=self.cell_dimension(),
-                unit_nodes=finat_element_a.unit_nodes())
-
-            self._group = flip_simplex_element_group(self.vertices(), self._group,
-                                                     self.orientations() < 0)
+        with self._lock:
+            if self._group is None:
+                from meshmode.mesh import SimplexElementGroup
+                from meshmode.mesh.processing import flip_simplex_element_group
+
+                coords_fspace_a = self.coordinates_a.function_space_a()
+                finat_element_a = coords_fspace_a.finat_element_a
+
+                # IMPORTANT that set :attr:`_group` because
+                # :meth:`orientations` may call :meth:`group`
+                self._group = SimplexElementGroup(
+                    finat_element_a.analog().degree,
+                    self.vertex_indices(),
+                    self.nodes(),
+                    dim=self.cell_dimension(),
+                    unit_nodes=finat_element_a.unit_nodes())
+
+                self._group = flip_simplex_element_group(
+                    self.vertices(), self._group, self.orientations() < 0)
 
         return self._group
 
@@ -408,49 +423,50 @@ class MeshGeometryAnalog(Analog):
                 if :arg:`mesh` is a 1-surface embedded in 2-space
                 and :arg:`normals` is *None*.
         """
-        if self._orient is None:
-            # compute orientations
-            tdim = self.analog().topological_dimension()
-            gdim = self.analog().geometric_dimension()
-
-            orient = None
-            if gdim == tdim:
-                # We use :mod:`meshmode` to check our orientations
-                from meshmode.mesh.processing import \
-                    find_volume_mesh_element_group_orientation
-
-                orient = \
-                    find_volume_mesh_element_group_orientation(self.vertices(),
-                                                               self.group())
-
-            if tdim == 1 and gdim == 2:
-                # In this case we have a 1-surface embedded in 2-space
-                orient = np.ones(self.nelements())
-                if self._normals:
-                    for i, (normal, vertices) in enumerate(zip(
-                            np.array(self._normals), self.vertices())):
-                        if np.cross(normal, vertices) < 0:
-                            orient[i] = -1.0
-                elif self._no_normals_warn:
-                    warn("Assuming all elements are positively-oriented.")
-
-            elif tdim == 2 and gdim == 3:
-                # In this case we have a 2-surface embedded in 3-space
-                orient = self.analog().cell_orientations().dat.data
-                r"""
-                    Convert (0 \implies negative, 1 \implies positive) to
-                    (-1 \implies negative, 1 \implies positive)
+        with self._lock:
+            if self._orient is None:
+                # compute orientations
+                tdim = self.analog().topological_dimension()
+                gdim = self.analog().geometric_dimension()
+
+                orient = None
+                if gdim == tdim:
+                    # We use :mod:`meshmode` to check our orientations
+                    from meshmode.mesh.processing import \
+                        find_volume_mesh_element_group_orientation
+
+                    orient = \
+                        find_volume_mesh_element_group_orientation(self.vertices(),
+                                                                   self.group())
+
+                if tdim == 1 and gdim == 2:
+                    # In this case we have a 1-surface embedded in 2-space
+                    orient = np.ones(self.nelements())
+                    if self._normals:
+                        for i, (normal, vertices) in enumerate(zip(
+                                np.array(self._normals), self.vertices())):
+                            if np.cross(normal, vertices) < 0:
+                                orient[i] = -1.0
+                    elif self._no_normals_warn:
+                        warn("Assuming all elements are positively-oriented.")
+
+                elif tdim == 2 and gdim == 3:
+                    # In this case we have a 2-surface embedded in 3-space
+                    orient = self.analog().cell_orientations().dat.data
+                    r"""
+                        Convert (0 \implies negative, 1 \implies positive) to
+                        (-1 \implies negative, 1 \implies positive)
+                    """
+                    orient *= 2
+                    orient -= np.ones(orient.shape, dtype=orient.dtype)
+
+                self._orient = orient
+                #Make sure the mesh fell into one of the cases
                 """
-                orient *= 2
-                orient -= np.ones(orient.shape, dtype=orient.dtype)
-
-            self._orient = orient
-            #Make sure the mesh fell into one of the cases
-            """
-              NOTE : This should be guaranteed by previous checks,
-                     but is here anyway in case of future development.
-            """
-            assert self._orient is not None
+                  NOTE : This should be guaranteed by previous checks,
+                         but is here anyway in case of future development.
+                """
+                assert self._orient is not None
 
         return self._orient
 
@@ -507,14 +523,17 @@ class MeshGeometryAnalog(Analog):
         """
         # {{{ Compute facial adjacency groups if not already done
 
-        if self._facial_adjacency_groups is None:
-            from meshmode.mesh import _compute_facial_adjacency_from_vertices
+        with self._lock:
+            if self._facial_adjacency_groups is None:
+                from meshmode.mesh import _compute_facial_adjacency_from_vertices
 
-            self._facial_adjacency_groups = _compute_facial_adjacency_from_vertices(
-                [self.group()],
-                self.bdy_tags(),
-                np.int32, np.int8,
-                face_vertex_indices_to_tags=self.face_vertex_indices_to_tags())
+                fvi_to_tags = self.face_vertex_indices_to_tags()
+                self._facial_adjacency_groups = \
+                    _compute_facial_adjacency_from_vertices(
+                        [self.group()],
+                        self.bdy_tags(),
+                        np.int32, np.int8,
+                        face_vertex_indices_to_tags=fvi_to_tags)
 
         # }}}
 
@@ -524,16 +543,17 @@ class MeshGeometryAnalog(Analog):
         """
         PRECONDITION: Have called :meth:`init`
         """
-        if self._meshmode_mesh is None:
-            assert self.initialized(), \
-                "Must call :meth:`init` before :meth:`meshmode_mesh`"
-
-            from meshmode.mesh import Mesh
-            self._meshmode_mesh = \
-                Mesh(self.vertices(), [self.group()],
-                     boundary_tags=self.bdy_tags(),
-                     nodal_adjacency=self.nodal_adjacency(),
-                     facial_adjacency_groups=self.facial_adjacency_groups())
+        with self._lock:
+            if self._meshmode_mesh is None:
+                assert self.initialized(), \
+                    "Must call :meth:`init` before :meth:`meshmode_mesh`"
+
+                from meshmode.mesh import Mesh
+                self._meshmode_mesh = \
+                    Mesh(self.vertices(), [self.group()],
+                         boundary_tags=self.bdy_tags(),
+                         nodal_adjacency=self.nodal_adjacency(),
+                         facial_adjacency_groups=self.facial_adjacency_groups())
 
         return self._meshmode_mesh
 
@@ -1,10 +1,11 @@
 """Used to raise *UserWarning*s"""
 from warnings import warn
+from weakref import WeakKeyDictionary
+from threading import Lock, RLock, local
 import pyopencl as cl
 import numpy as np
 
-from firedrake import SpatialCoordinate, Function, \
-    VectorFunctionSpace
+from firedrake import Function
 from firedrake.functionspaceimpl import WithGeometry
 from finat.fiat_elements import Lagrange
 
@@ -18,6 +19,9 @@ from pytential.qbx import QBXLayerPotentialSource
 from pytential.target import PointsTarget
 
 from fd2mm import FunctionAnalog
+from fd2mm.finat_element import FinatElementAnalog
+from fd2mm.mempool import get_memory_pool
+from fd2mm.stats import OpConnectionStats, timed
 
 
 """
@@ -26,11 +30,261 @@ pytential/meshmode only has to write down an operator and bind
 """
 
 
+# Maps function space -> {(bdy ids, method): (target indices, target)},
+# see :meth:`TargetConnection.set_bdy_as_target`. The values must not
+# refer to the function space (or its mesh), else it is never freed
+_bdy_target_cache = WeakKeyDictionary()
+_bdy_target_cache_lock = RLock()
+
+
+# Maps dat -> {source key: (dat version, converted field)},
+# see :meth:`SourceConnection.get_cached_field`
+_field_cache = WeakKeyDictionary()
+_field_cache_lock = Lock()
+
+
+# Holds one :mod:`pyopencl` queue per context for each thread,
+# see :func:`get_thread_queue`
+_thread_queues = local()
+
+
+def get_thread_queue(cl_ctx):
+    """
+        Return a :class:`pyopencl.CommandQueue` on *cl_ctx* belonging
+        to the calling thread (created on first use). Operators applied
+        concurrently from several threads should each be given
+        their thread's queue.
+    """
+    queues = getattr(_thread_queues, 'queues', None)
+    if queues is None:
+        queues = _thread_queues.queues = {}
+    if cl_ctx not in queues:
+        queues[cl_ctx] = cl.CommandQueue(cl_ctx)
+    return queues[cl_ctx]
+
+
+# Whether we have warned that the field cache is off, see :func:`_dat_version`
+_warned_no_dat_version = False
+
+
+def _dat_version(dat):
+    """
+        Return the state counter of *dat* (incremented by :mod:`PyOP2`
+        whenever the dat is written to), or *None* if this version
+        of :mod:`PyOP2` does not keep one. Without it a stale field
+        cannot be told from a current one, so the field cache is
+        bypassed (and a warning is issued once).
+    """
+    version = getattr(dat, 'dat_version', None)
+    if version is None:
+        global _warned_no_dat_version
+        if not _warned_no_dat_version:
+            _warned_no_dat_version = True
+            warn("This version of PyOP2 does not keep dat versions,"
+                 " so converted fields are not cached")
+    return version
+
+
+def _compute_node_coordinates(function_space, nodes=None, cells=None):
+    """
+        Compute the coordinates of the nodes of :arg:`function_space`
+        directly from the mesh coordinates (i.e. without interpolating
+        into a :class:`VectorFunctionSpace`)
+
+        :arg function_space: A :mod:`firedrake` function space
+        :arg nodes: Either *None* to get the coordinates of every node,
+                    or an array of node indices whose coordinates
+                    we want
+        :arg cells: Either *None*, or an array of cell indices.
+                    If not *None*, all of :arg:`nodes` must lie on
+                    these cells (only these cells are searched)
+
+        Returns a pair *(node_indices, coords)*, where *node_indices*
+        is a sorted array of the node indices and *coords* is
+        of shape *(ambient_dim, len(node_indices))* with *coords[:, i]*
+        the coordinates of node *node_indices[i]*
+    """
+    mesh = function_space.mesh()
+    coords_fspace = mesh.coordinates.function_space()
+
+    element_a = FinatElementAnalog(function_space.finat_element)
+    coords_element_a = FinatElementAnalog(coords_fspace.finat_element)
+
+    # Maps coordinate values at the coordinate element's unit nodes
+    # to coordinate values at :arg:`function_space`'s unit nodes
+    from modepy import resampling_matrix, simplex_best_available_basis
+    resampling_mat = resampling_matrix(
+        simplex_best_available_basis(coords_element_a.dim(),
+                                     coords_element_a.analog().degree),
+        new_nodes=element_a.unit_nodes(),
+        old_nodes=coords_element_a.unit_nodes())
+
+    # {{{ Find one (cell, local node number) pair for each node
+
+    cell_node_list = function_space.cell_node_list
+    if cells is None:
+        cells = np.arange(cell_node_list.shape[0])
+    cell_node_list = cell_node_list[cells]
+
+    if nodes is None:
+        icells, local_nodes = np.indices(cell_node_list.shape)
+        icells, local_nodes = icells.flatten(), local_nodes.flatten()
+    else:
+        icells, local_nodes = np.nonzero(np.isin(cell_node_list, nodes))
+
+    node_indices, first = np.unique(cell_node_list[icells, local_nodes],
+                                    return_index=True)
+    cells = cells[icells[first]]
+    local_nodes = local_nodes[first]
+
+    # }}}
+
+    cell_coords = np.real(mesh.coordinates.dat.data_ro[
+        coords_fspace.cell_node_list[cells]])
+    # reshape for 1D so that [nnodes][ncoord_unit_nodes][dim]
+    if len(cell_coords.shape) != 3:
+        cell_coords = cell_coords.reshape(cell_coords.shape + (1,))
+
+    coords = np.einsum("nk,nkd->dn", resampling_mat[local_nodes], cell_coords)
+
+    return node_indices, coords.copy()
+
+
+def _host_array(queue, ary):
+    """
+        Return the (index) array *ary* of a :mod:`meshmode` connection
+        on the host. Device arrays are copied with *queue*, or, if
+        *queue* is *None*, with a queue of the calling thread.
+    """
+    if not isinstance(ary, cl.array.Array):
+        return np.asarray(ary)
+    if queue is None:
+        queue = get_thread_queue(ary.context)
+    return ary.get(queue=queue)
+
+
+def _make_connection_matrix(queue, connection):
+    """
+        Return a :class:`scipy.sparse.csr_matrix` of shape
+        *(nto_nodes, nfrom_nodes)* representing *connection*, a
+        :mod:`meshmode` connection which interpolates each node of
+        *connection.to_discr* from the nodes of one element of
+        *connection.from_discr* (e.g. a face restriction or
+        a refinement connection), or a chain of them.
+
+        The matrix is built on the host from the interpolation batches
+        of *connection*, so nothing is compiled. *queue* is only used
+        to copy the element indices of the batches (see :func:`_host_array`).
+    """
+    import scipy.sparse as sp
+    from modepy import resampling_matrix
+
+    # {{{ A chain of connections is the product of their matrices
+
+    if hasattr(connection, 'connections'):
+        mat = sp.identity(connection.from_discr.nnodes, format='csr')
+        for link in connection.connections:
+            mat = _make_connection_matrix(queue, link).dot(mat)
+        return mat.tocsr()
+
+    # }}}
+
+    from_discr = connection.from_discr
+    to_discr = connection.to_discr
+
+    rows = []
+    columns = []
+    weights = []
+    for to_group, connection_group in zip(to_discr.groups, connection.groups):
+        for batch in connection_group.batches:
+            from_group = from_discr.groups[batch.from_group_index]
+            from_elements = _host_array(queue, batch.from_element_indices)
+            to_elements = _host_array(queue, batch.to_element_indices)
+
+            # Node i of a to element is sum_j resampling_mat[i, j] times
+            # node j of its from element
+            resampling_mat = resampling_matrix(from_group.basis(),
+                                               new_nodes=batch.result_unit_nodes,
+                                               old_nodes=from_group.unit_nodes)
+
+            shape = (len(to_elements),) + resampling_mat.shape
+            to_nodes = to_group.node_nr_base \
+                + to_elements[:, np.newaxis] * to_group.nunit_nodes \
+                + np.arange(to_group.nunit_nodes)
+            from_nodes = from_group.node_nr_base \
+                + from_elements[:, np.newaxis] * from_group.nunit_nodes \
+                + np.arange(from_group.nunit_nodes)
+
+            rows.append(np.broadcast_to(to_nodes[:, :, np.newaxis],
+                                        shape).reshape(-1))
+            columns.append(np.broadcast_to(from_nodes[:, np.newaxis, :],
+                                           shape).reshape(-1))
+            weights.append(np.broadcast_to(resampling_mat, shape).reshape(-1))
+
+    if not weights:
+        return sp.csr_matrix((to_discr.nnodes, from_discr.nnodes))
+
+    return sp.csr_matrix((np.concatenate(weights),
+                          (np.concatenate(rows), np.concatenate(columns))),
+                         shape=(to_discr.nnodes, from_discr.nnodes))
+
+
+def _make_conversion_matrix(fspace_analog, nfd_nodes):
+    """
+        Return a :class:`scipy.sparse.csr_matrix` of shape
+        *(nmm_nodes, nfd_nodes)* mapping the (scalar) data of
+        a :mod:`firedrake` function on *fspace_analog* to its field on
+        *fspace_analog.discretization()*, i.e. the matrix of
+        :meth:`fd2mm.FunctionSpaceAnalog.convert_function`
+    """
+    import scipy.sparse as sp
+
+    group = fspace_analog.discretization().groups[0]
+    nelements = group.nelements
+    nunit_nodes = group.nunit_nodes
+
+    # meshmode node j of element e is sum_k resampling_mat[j, k] times
+    # the k-th (reordered) firedrake node of e
+    resampling_mat = fspace_analog.resampling_mat(True)
+    fd_indices = fspace_analog.reorder_nodes(np.arange(nfd_nodes), True)
+    fd_indices = fd_indices.reshape((nelements, 1, nunit_nodes))
+
+    shape = (nelements, nunit_nodes, nunit_nodes)
+    weights = np.broadcast_to(resampling_mat, shape)
+    columns = np.broadcast_to(fd_indices, shape)
+    rows = np.repeat(np.arange(nelements * nunit_nodes), nunit_nodes)
+
+    return sp.csr_matrix((weights.reshape(-1), (rows, columns.reshape(-1))),
+                         shape=(nelements * nunit_nodes, nfd_nodes))
+
+
+def _make_bdy_trace_matrix(queue, fspace_analog, bdy_connection, nfd_nodes):
+    """
+        Return a :class:`scipy.sparse.csr_matrix` of shape
+        *(nbdy_nodes, nfd_nodes)* mapping the (scalar) data of
+        a :mod:`firedrake` function on *fspace_analog*
+        to its values on *bdy_connection.to_discr*.
+
+        This is the composition of :meth:`convert_function` with
+        *bdy_connection*
+    """
+    return _make_connection_matrix(queue, bdy_connection).dot(
+        _make_conversion_matrix(fspace_analog, nfd_nodes)).tocsr()
+
+
 class SourceConnection:
     """
         firedrake->meshmode
     """
-    def __init__(self, cl_ctx, fspace_analog, bdy_id=None, with_refinement=False):
+    def __init__(self, cl_ctx, fspace_analog, bdy_id=None, with_refinement=False,
+                 function_space=None):
+        """
+            :arg function_space: The function space functions converted
+                by this object live on. If *None*, uses
+                *fspace_analog.analog()*
+        """
+        if function_space is None:
+            function_space = fspace_analog.analog()
 
         discr = fspace_analog.discretization()
         factory = fspace_analog.factory()
@@ -40,9 +294,103 @@ class SourceConnection:
             bdy_connection = make_face_restriction(discr, factory, bdy_id)
             discr = bdy_connection.to_discr
 
+        self._function_space = function_space
+        self._function_space_a = fspace_analog
+        self._bdy_id = bdy_id
         self._discr = discr
-        self._connection = bdy_connection
+        self._bdy_connection = bdy_connection
+        # Maps firedrake data straight to the bdy, built on first call.
+        # See :func:`_make_bdy_trace_matrix`
+        self._bdy_trace_mat = None
+        # The refinement connection, if refining (see :meth:`get_qbx`)
+        self._connection = None
         self._refine = with_refinement
+        self._allocator = get_memory_pool(cl_ctx)
+        # An :class:`fd2mm.stats.OpConnectionStats`, or *None* if not timing
+        self._stats = None
+
+        # Guards :meth:`get_qbx` and the lazily built :attr:`_bdy_trace_mat`
+        self._lock = RLock()
+
+        # Source connections converting to the same discretization
+        # share converted fields (before refinement, which is
+        # applied by each refining source connection, see :meth:`__call__`)
+        self._cache_key = (fspace_analog, bdy_id, cl_ctx)
+
+    def _get_cached(self, dat, key):
+        """
+            Return the field cached for *dat* under *key* if it is
+            up to date, else *None*
+        """
+        version = _dat_version(dat)
+        if version is None:
+            return None
+
+        with _field_cache_lock:
+            cached = _field_cache.get(dat, {}).get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        return None
+
+    def _set_cached(self, dat, key, field):
+        """
+            Cache *field* for the current version of *dat* under *key*
+        """
+        version = _dat_version(dat)
+        if version is not None:
+            # Other threads may use the field from their own queue
+            field.finish()
+            with _field_cache_lock:
+                _field_cache.setdefault(dat, {})[key] = (version, field)
+
+    def get_cached_field(self, function):
+        """
+            Return the converted field of the :mod:`firedrake`
+            :class:`Function` *function* from a previous call, or *None*
+            if *function* has not been converted by this source
+            connection since its data last changed.
+
+            Unrefined fields are shared by all source connections to the
+            same discretization, and refined fields are cached by each
+            refining source connection.
+        """
+        key = self if self._connection is not None else self._cache_key
+        return self._get_cached(function.dat, key)
+
+    def get_function_space(self):
+        """
+            Return this object's function space
+        """
+        return self._function_space
+
+    def get_memory_pool(self):
+        """
+            Return the :class:`fd2mm.mempool.CountingMemoryPool`
+            converted fields are allocated from
+        """
+        return self._allocator
+
+    def get_conversion_matrix(self, queue, nfd_nodes):
+        """
+            Return a :class:`scipy.sparse.csr_matrix` of shape
+            *(nnodes, nfd_nodes)* mapping the (scalar) data of a function
+            on :meth:`get_function_space` to its converted field, i.e.
+            the matrix of :meth:`__call__` (including the refinement
+            connection, if :meth:`get_qbx` has refined)
+        """
+        if self._bdy_connection is not None:
+            with self._lock:
+                if self._bdy_trace_mat is None:
+                    self._bdy_trace_mat = _make_bdy_trace_matrix(
+                        queue, self._function_space_a, self._bdy_connection,
+                        nfd_nodes)
+            mat = self._bdy_trace_mat
+        else:
+            mat = _make_conversion_matrix(self._function_space_a, nfd_nodes)
+
+        if self._connection is not None:
+            mat = _make_connection_matrix(queue, self._connection).dot(mat)
+        return mat.tocsr()
 
     def get_qbx(self, **kwargs):
         """
@@ -51,19 +399,12 @@ class SourceConnection:
         """
         qbx = QBXLayerPotentialSource(self._discr, **kwargs)
 
-        # {{{ If refining, refine and store connection (possibly composed with bdy
-        #     connection
-        if self._refine:
-            self._refine = False
-            from meshmode.discretization.connection import \
-                ChainedDiscretizationConnection
-
-            qbx, refinement_connection = qbx.with_refinement()
-            if self._connection:
-                connections = [self._connection, refinement_connection]
-                self._connection = ChainedDiscretizationConnection(connections)
-            else:
-                self._connection = refinement_connection
+        # {{{ If refining, refine and store connection (applied after
+        #     the restriction to the bdy)
+        with self._lock:
+            if self._refine:
+                qbx, self._connection = qbx.with_refinement()
+                self._refine = False
         # }}}
 
         return qbx
@@ -71,20 +412,80 @@ class SourceConnection:
     def __call__(self, queue, function_analog, bdy_id=None):
         """
             Convert this function to a discretization on the given device
+
+            :arg function_analog: Either a :class:`FunctionAnalog`, or
+                an array shaped like the data of a function on
+                :meth:`get_function_space`
+
+            Fields converted from a :class:`FunctionAnalog` are cached
+            until the function's data changes (see :meth:`get_cached_field`),
+            so the returned field must not be modified.
         """
-        field = function_analog.as_field()
-        field = cl.array.to_device(queue, field)
+        # Only fields of versioned dats are cached (see :func:`_dat_version`)
+        dat = None
+        field = None
+        if isinstance(function_analog, FunctionAnalog) \
+                and _dat_version(function_analog.analog().dat) is not None:
+            dat = function_analog.analog().dat
+            field = self.get_cached_field(function_analog.analog())
+            if field is not None:
+                return field
+            field = self._get_cached(dat, self._cache_key)
+
+        stats = self._stats
+        if field is None:
+            with timed(stats, 'host_conversion'):
+                if self._bdy_connection is not None:
+                    field = self._convert_bdy_trace(queue, function_analog)
+                elif isinstance(function_analog, FunctionAnalog):
+                    field = function_analog.as_field()
+                else:
+                    field = self._function_space_a.convert_function(
+                        function_analog)
+            with timed(stats, 'to_device', queue):
+                field = cl.array.to_device(queue, field, allocator=self._allocator)
+            if dat is not None:
+                self._set_cached(dat, self._cache_key, field)
 
         if self._connection is not None:
-            if len(field.shape) == 1:
-                field = self._connection(queue, field)
-            else:
-                field = np.array([self._connection(queue, fi).get(queue=queue)
-                                  for fi in field])
-                field = cl.array.to_device(queue, field)
+            with timed(stats, 'connection', queue):
+                if len(field.shape) == 1:
+                    field = self._connection(queue, field)
+                else:
+                    field = np.array([self._connection(queue, fi).get(queue=queue)
+                                      for fi in field])
+                    field = cl.array.to_device(queue, field,
+                                               allocator=self._allocator)
+            if dat is not None:
+                self._set_cached(dat, self, field)
 
         return field
 
+    def _convert_bdy_trace(self, queue, function_analog):
+        """
+            Return the values of *function_analog* (as in :meth:`__call__`)
+            on the bdy discretization, of shape *(nbdy_nodes,)* or
+            *(dim, nbdy_nodes)*. Only the firedrake dofs of elements
+            touching the bdy are read.
+        """
+        if isinstance(function_analog, FunctionAnalog):
+            data = function_analog.analog().dat.data_ro
+        else:
+            data = function_analog
+
+        if self._bdy_trace_mat is None:
+            with self._lock:
+                if self._bdy_trace_mat is None:
+                    self._bdy_trace_mat = _make_bdy_trace_matrix(
+                        queue, self._function_space_a, self._bdy_connection,
+                        data.shape[0])
+
+        field = self._bdy_trace_mat.dot(data)
+        # (nnodes, dim) firedrake layout -> (dim, nnodes) meshmode layout
+        if len(field.shape) > 1:
+            field = np.ascontiguousarray(field.T)
+        return field
+
 
 class TargetConnection:
     """
@@ -123,14 +524,29 @@ class TargetConnection:
                          in :class:`DirichletBC', either 'geometric'
                          or 'topological'
         """
-        mesh = self._function_space.mesh()
-
         # if just passed an int, convert to an iterable of ints
         # so that just one case to deal with
         if isinstance(bdy_id, int):
             bdy_id = [bdy_id]
         target_markers = set(bdy_id)
 
+        # If already computed this target, just reuse it
+        key = (frozenset(target_markers), method)
+        with _bdy_target_cache_lock:
+            fspace_cache = _bdy_target_cache.setdefault(self._function_space, {})
+            if key in fspace_cache:
+                self._target_indices, self._target = fspace_cache[key]
+                return
+            self._compute_bdy_target(target_markers, method)
+            fspace_cache[key] = (self._target_indices, self._target)
+
+    def _compute_bdy_target(self, target_markers, method):
+        """
+            Set the target to the nodes on the bdys *target_markers*,
+            see :meth:`set_bdy_as_target`
+        """
+        mesh = self._function_space.mesh()
+
         # Check that bdy ids are valid
         if not target_markers <= set(mesh.exterior_facets.unique_markers):
             warn("The following bdy ids are not exterior facet ids: %s" %
@@ -139,35 +555,50 @@ class TargetConnection:
         if not target_markers & set(mesh.exterior_facets.unique_markers):
             raise ValueError("No bdy ids are exterior facet ids")
 
-        self._target_indices = set()
-        for marker in target_markers:
-            self._target_indices |= set(
-                self._function_space.boundary_nodes(marker, method))
-        self._target_indices = np.array(list(self._target_indices), dtype=np.int32)
-
-        # Get coordinates of nodes
-        coords = SpatialCoordinate(mesh)
-        function_space_dim = VectorFunctionSpace(
-            mesh,
-            self._function_space.ufl_element().family(),
-            degree=self._function_space.ufl_element().degree())
-
-        coords = Function(function_space_dim).interpolate(coords)
-        coords = np.real(coords.dat.data)
-
-        target_pts = coords[self._target_indices]
-        # change from [nnodes][ambient_dim] to [ambient_dim][nnodes]
-        target_pts = np.transpose(target_pts).copy()
+        target_indices = np.unique(np.concatenate(
+            [self._function_space.boundary_nodes(marker, method)
+             for marker in target_markers]))
+
+        # Only cells with a facet on the bdy can hold bdy nodes
+        exterior_facets = mesh.exterior_facets
+        on_bdy = np.isin(exterior_facets.markers, list(target_markers))
+        bdy_cells = np.unique(exterior_facets.facet_cell[on_bdy])
+
+        # Get coordinates of nodes (shape is [ambient_dim][nnodes])
+        target_indices, target_pts = _compute_node_coordinates(
+            self._function_space, nodes=target_indices, cells=bdy_cells)
+        self._target_indices = target_indices.astype(np.int32)
         self._target = PointsTarget(target_pts)
 
-    def set_function_space_as_target(self, cl_ctx):
+    def set_function_space_as_target(self, cl_ctx, unique_nodes=False):
         """
             PRECONDITION: Have set a function space analog for the function space
-                          used, else raises ValueError
+                          used, else raises ValueError (unless
+                          :arg:`unique_nodes` is *True*)
 
             Sets whole function space as target in converted meshmode
             form
+
+            :arg unique_nodes: If *True*, instead of using the (DG)
+                meshmode discretization as a target, each firedrake node
+                is used as a target exactly once, and the results are
+                written directly into the data of the result function.
+                For CG spaces this avoids evaluating once per incident
+                element at nodes shared between elements.
+                Targets near the source are associated to QBX centers
+                by :mod:`pytential` as usual (so ops
+                should be bound with *qbx_forced_limit=None*).
         """
+        if unique_nodes:
+            self._target_indices, target_pts = \
+                _compute_node_coordinates(self._function_space)
+            # every node is a target, so write directly into the data
+            if self._target_indices.shape[0] == \
+                    self._function_space.node_set.size:
+                self._target_indices = slice(None)
+            self._target = PointsTarget(target_pts)
+            return
+
         if self._function_space_a is None:
             raise ValueError("No converter set")
 
@@ -180,9 +611,13 @@ class TargetConnection:
 
     def __call__(self, queue, result, result_function_a):
         """
-            :arg result_function_a: Either a FunctionAnalog or a Function.
+            :arg result_function_a: Either a FunctionAnalog, a Function,
+                                    or an array shaped like the data of
+                                    a function on :meth:`get_function_space`
+                                    (which is written into).
                                     If a Function, the target MUST be
-                                    set to a boundary
+                                    a :class:`PointsTarget` (i.e. set to a
+                                    boundary or to unique nodes)
 
             Converts the result of a pytential operator bound to this
             target (or really any correctly-sized array)
@@ -197,11 +632,19 @@ class TargetConnection:
         if isinstance(self._target, PointsTarget):
             if isinstance(result_function_a, FunctionAnalog):
                 result_function_a = result_function_a.analog()
-            if len(result.shape) > 1:
-                for i in range(result.shape[0]):
-                    result_function_a.dat.data[self._target_indices, i] = result[i]
+            if isinstance(result_function_a, np.ndarray):
+                data = result_function_a
             else:
-                result_function_a.dat.data[self._target_indices] = result
+                data = result_function_a.dat.data
+            # (dim, ntargets) results go to a (nnodes, dim) dat
+            if len(result.shape) > 1:
+                result = result.T
+            data[self._target_indices] = result
+        elif isinstance(result_function_a, np.ndarray):
+            # Handle 1-D case
+            if len(result_function_a.shape) == 1 and len(result.shape) > 1:
+                result = result.reshape(result.shape[1])
+            result_function_a[:] = self._function_space_a.convert_field(result)
         else:
             result_function_a.set_from_field(result)
 
@@ -223,10 +666,168 @@ class OpConnection:
         self._source_connection = source_connection
         self._target_connection = target_connection
 
-        qbx = self._source_connection.get_qbx(**kwargs)
+        self._op = op
+        self._qbx_kwargs = kwargs
+        self._qbx, self._bound_op = self._bind()
+
+        # Per-thread state (e.g. :attr:`_result_buffer`)
+        self._thread_local = local()
+        # Held for evaluations until the first one has finished, so that
+        # :mod:`pytential` builds (and caches) its data for this operator
+        # only once
+        self._first_evaluation_lock = Lock()
+        self._evaluated = False
+        # See :meth:`enable_stats`
+        self.stats = None
+
+    @property
+    def _result_buffer(self):
+        """
+            The host buffer results are read back into
+            (see :meth:`_get_result`). Each thread has its own.
+        """
+        return getattr(self._thread_local, 'result_buffer', None)
+
+    @_result_buffer.setter
+    def _result_buffer(self, buf):
+        self._thread_local.result_buffer = buf
+
+    def _bind(self):
+        """
+            Return a pair *(qbx, bound operator)*. Subclasses which do not
+            evaluate with :mod:`pytential` may return *None* for either.
+        """
+        qbx = self._source_connection.get_qbx(**self._qbx_kwargs)
         target = self._target_connection.get_target()
+        return qbx, bind((qbx, target), self._op)
+
+    def get_source_connection(self):
+        """
+            Return the :class:`SourceConnection` of this operator
+        """
+        return self._source_connection
+
+    def get_target_connection(self):
+        """
+            Return the :class:`TargetConnection` of this operator
+        """
+        return self._target_connection
+
+    def get_memory_pool(self):
+        """
+            Return the :class:`fd2mm.mempool.CountingMemoryPool` device
+            arrays of this operator are allocated from, e.g. to
+            check its :meth:`~fd2mm.mempool.CountingMemoryPool.stats`
+        """
+        return self._source_connection.get_memory_pool()
+
+    def convert_density(self, queue, data):
+        """
+            Return the argument to pass to :meth:`evaluate` for a density
+            whose :mod:`firedrake` data is *data* (an array shaped like
+            the data of a function on the source function space).
+            By default, this is the field converted by the source connection.
+        """
+        return self._source_connection(queue, data)
+
+    def enable_stats(self, use_cl_profiling=False):
+        """
+            Start accumulating the time spent in each phase of
+            evaluation in :attr:`stats`, an
+            :class:`fd2mm.stats.OpConnectionStats`
+            (which is returned). Note that timing waits for
+            device work to finish at the end of each phase.
+
+            :arg use_cl_profiling: See :class:`fd2mm.stats.OpConnectionStats`
+        """
+        self.stats = OpConnectionStats(use_cl_profiling=use_cl_profiling)
+        self._source_connection._stats = self.stats
+        return self.stats
+
+    def disable_stats(self):
+        """
+            Stop timing, and set :attr:`stats` to *None*
+        """
+        self.stats = None
+        self._source_connection._stats = None
+
+    def _get_result(self, queue, result):
+        """
+            Take the result of :attr:`_bound_op` off of the device.
+
+            :arg result: Either a :class:`pyopencl.array.Array` or
+                an object array of them (e.g. from a gradient)
+
+            Returns a host array of shape *(ntargets,)* or *(dim, ntargets)*.
+            All components are read into a reused buffer with
+            non-blocking copies, and we only wait once all copies
+            are enqueued. Note the returned array is overwritten by
+            the next call.
+        """
+        # handle multi-dimensional vs 1-dimensional results differently
+        if isinstance(result, np.ndarray):
+            arrays = list(result)
+            shape = (len(arrays),) + arrays[0].shape
+        else:
+            arrays = [result]
+            shape = result.shape
+        dtype = arrays[0].dtype
+
+        if self._result_buffer is None or self._result_buffer.shape != shape \
+                or self._result_buffer.dtype != dtype:
+            self._result_buffer = np.empty(shape, dtype=dtype)
 
-        self._bound_op = bind((qbx, target), op)
+        host_views = self._result_buffer.reshape((len(arrays), -1))
+        with timed(self.stats, 'readback'):
+            events = [cl.enqueue_copy(queue, host_view, arr.base_data,
+                                      device_offset=arr.offset, is_blocking=False)
+                      for host_view, arr in zip(host_views, arrays)]
+            cl.wait_for_events(events)
+        if self.stats is not None:
+            self.stats.add_events('readback', events)
+
+        return self._result_buffer
+
+    def evaluate(self, queue, **kwargs):
+        """
+            Evaluates the operator and takes the result off of the device.
+
+            :arg queue: As in :meth:`__call__`
+            :arg **kwargs: As in :meth:`__call__`. Arguments which are
+                not :mod:`firedrake` :class:`Functions` are passed
+                to op as they are (e.g. already converted fields)
+
+            Returns a host array of shape *(ntargets,)* or
+            *(dim, ntargets)* which is overwritten on the next evaluation
+            (see :meth:`_get_result`)
+        """
+        if self.stats is not None:
+            self.stats.ncalls += 1
+
+        new_kwargs = {}
+        for key in kwargs:
+            if isinstance(kwargs[key], Function):
+                field = self._source_connection.get_cached_field(kwargs[key])
+                if field is not None:
+                    new_kwargs[key] = field
+                    continue
+                # Convert function to array with pytential ordering
+                with timed(self.stats, 'analog'):
+                    fntn_analog = FunctionAnalog(kwargs[key],
+                                                 self._function_space_analog)
+                new_kwargs[key] = self._source_connection(queue, fntn_analog)
+            else:
+                new_kwargs[key] = kwargs[key]
+
+        # Perform operation and take result off queue
+        with timed(self.stats, 'evaluation', queue):
+            if self._evaluated:
+                result = self._bound_op(queue, **new_kwargs)
+            else:
+                with self._first_evaluation_lock:
+                    result = self._bound_op(queue, **new_kwargs)
+                    self._evaluated = True
+        return self._get_result(queue, result)
 
     def __call__(self, queue, result_function, **kwargs):
         """
@@ -240,29 +841,88 @@ class OpConnection:
             :arg **kwargs: Arguments to pass to op. All :mod:`firedrake`
                 :class:`Functions` are converted to pytential
         """
-        new_kwargs = {}
-        for key in kwargs:
-            if isinstance(kwargs[key], Function):
-                # Convert function to array with pytential ordering
-                fntn_analog = FunctionAnalog(kwargs[key],
-                                             self._function_space_analog)
-                new_kwargs[key] = self._source_connection(queue, fntn_analog)
-            else:
-                new_kwargs[key] = kwargs[key]
+        result = self.evaluate(queue, **kwargs)
 
-        # Perform operation and take result off queue
-        result = self._bound_op(queue, **new_kwargs)
+        with timed(self.stats, 'scatter'):
+            result_function_a = FunctionAnalog(result_function,
+                                               self._function_space_analog)
+            self._target_connection(queue, result, result_function_a)
 
-        # handle multi-dimensional vs 1-dimensional results differently
-        # to take array off of device
-        if isinstance(result, np.ndarray):
-            result = np.array([arr.get(queue=queue) for arr in result])
+    def evaluate_many(self, queue, **kwargs):
+        """
+            Evaluates the operator for several sets of densities at once.
+
+            :arg queue: As in :meth:`__call__`
+            :arg **kwargs: As in :meth:`evaluate`, except that any
+                argument which is a list (or tuple) holds one value
+                per right-hand side (all such lists must have the
+                same length). Other arguments are shared by every
+                right-hand side.
+
+            Returns a host array of shape *(nrhs, ntargets)* or
+            *(nrhs, dim, ntargets)*.
+
+            The geometry (tree, traversal, target association) is computed
+            on the first evaluation and shared by every evaluation after.
+        """
+        per_rhs, shared = _split_per_rhs_kwargs(kwargs)
+        nrhs = len(next(iter(per_rhs.values())))
+
+        results = None
+        for irhs in range(nrhs):
+            rhs_kwargs = dict(shared)
+            for key, values in per_rhs.items():
+                rhs_kwargs[key] = values[irhs]
+
+            result = self.evaluate(queue, **rhs_kwargs)
+            if results is None:
+                results = np.empty((nrhs,) + result.shape, dtype=result.dtype)
+            results[irhs] = result
+
+        return results
+
+    def apply_many(self, queue, result_functions, **kwargs):
+        """
+            Like :meth:`__call__`, but for several right-hand sides
+            (see :meth:`evaluate_many`)
+
+            :arg result_functions: A list of functions, one
+                for each right-hand side, as for
+                :meth:`TargetConnection.__call__`
+        """
+        results = self.evaluate_many(queue, **kwargs)
+        if len(results) != len(result_functions):
+            raise ValueError("Received %s right-hand sides, but %s result"
+                             " functions" % (len(results), len(result_functions)))
+
+        with timed(self.stats, 'scatter'):
+            for result, result_function in zip(results, result_functions):
+                result_function_a = FunctionAnalog(result_function,
+                                                   self._function_space_analog)
+                self._target_connection(queue, result, result_function_a)
+
+
+def _split_per_rhs_kwargs(kwargs):
+    """
+        Split *kwargs* into a dict of per right-hand side arguments
+        (lists or tuples) and a dict of shared arguments,
+        see :meth:`OpConnection.evaluate_many`
+    """
+    per_rhs = {}
+    shared = {}
+    for key, val in kwargs.items():
+        if isinstance(val, (list, tuple)):
+            per_rhs[key] = val
         else:
-            result = result.get(queue=queue)
+            shared[key] = val
+
+    if not per_rhs:
+        raise ValueError("No per right-hand side (list) arguments received")
+    if len(set(len(val) for val in per_rhs.values())) != 1:
+        raise ValueError("Per right-hand side arguments must all have"
+                         " the same length")
 
-        result_function_a = FunctionAnalog(result_function,
-                                           self._function_space_analog)
-        self._target_connection(queue, result, result_function_a)
+    return per_rhs, shared
 
 
 def fd_bind(cl_ctx, fspace_analog, op, source=None, target=None,
@@ -285,11 +945,56 @@ def fd_bind(cl_ctx, fspace_analog, op, source=None, target=None,
 
         :arg qbx_kwargs: ``**qbx_kwargs`` is passed to the constructor
                          for a :class:`pytential.qbx.QBXLayerPotentialSource`
+
+        Other (optional) keyword arguments:
+
+        * *with_refinement*: If *True*, refine the source
+          (see :meth:`pytential.qbx.QBXLayerPotentialSource.with_refinement`).
+          Default *False*
+        * *unique_target_nodes*: If *True* and the target is a whole
+          function space, evaluate only once at each firedrake node
+          (see :meth:`TargetConnection.set_function_space_as_target`).
+          Default *False*
+        * *mode*: How the operator is applied, one of
+
+            * *'fmm'*: (Default) evaluate with :mod:`pytential` each time.
+              This includes the QBX near field, which :mod:`pytential`
+              recomputes on every application (its QBX FMM does not
+              expose the near field separately). For well separated
+              targets, *'dense'* and *'hmatrix'* precompute every
+              interaction instead
+            * *'dense'*: assemble the operator as an explicit matrix
+              once, then apply it by matrix multiplication
+              (see :class:`fd2mm.dense.DenseOpConnection`)
+            * *'hmatrix'*: like *'dense'*, but the matrix is
+              stored hierarchically compressed
+              (see :class:`fd2mm.hmatrix.HMatrixOpConnection`)
+            * *'numpy'*: low accuracy direct summation with :mod:`numpy`,
+              with nothing to compile
+              (see :class:`fd2mm.direct.DirectOpConnection`)
+
+        * *cache_dir*: Only used if *mode* is *'dense'* or *'hmatrix'*,
+          a directory in which to cache assembled matrices on disk.
+          Default *None* (do not cache on disk)
+        * *max_matrices*: Only used if *mode* is *'dense'* or *'hmatrix'*,
+          the maximum number of assembled matrices (one for each distinct
+          set of non-density arguments) kept in memory. Default *1*
+        * *hmatrix_kwargs*: Only used if *mode* is *'hmatrix'*, a dict
+          with any of the keys *'tol'*, *'leaf_size'*, *'eta'*
+          (see :class:`fd2mm.hmatrix.HMatrixOpConnection`)
+        * *chunk_size*: Only used if *mode* is *'numpy'*
+          (see :class:`fd2mm.direct.DirectOpConnection`)
     """
     if qbx_kwargs is None:
         raise ValueError(":arg:`qbx_kwargs` is *None*, but needs to be supplied")
 
     with_refinement = kwargs.get('with_refinement', False)
+    unique_target_nodes = kwargs.get('unique_target_nodes', False)
+    mode = kwargs.get('mode', 'fmm')
+
+    modes = ['fmm', 'dense', 'hmatrix', 'numpy']
+    if mode not in modes:
+        raise ValueError("mode of %s is not one of %s" % (mode, modes))
 
     # Source and target will now be (fspace, bdy_id or *None*)
     if isinstance(source, WithGeometry):
@@ -299,14 +1004,40 @@ def fd_bind(cl_ctx, fspace_analog, op, source=None, target=None,
 
     source_connection = SourceConnection(cl_ctx, fspace_analog,
                                          bdy_id=source[1],
-                                         with_refinement=with_refinement)
+                                         with_refinement=with_refinement,
+                                         function_space=source[0])
 
     target_connection = TargetConnection(target[0])
     if target[1] is None:
         target_connection.set_function_space_analog(fspace_analog)
-        target_connection.set_function_space_as_target(cl_ctx)
+        target_connection.set_function_space_as_target(
+            cl_ctx, unique_nodes=unique_target_nodes)
     else:
         target_connection.set_bdy_as_target(target[1], 'geometric')
 
+    if mode == 'dense':
+        from fd2mm.dense import DenseOpConnection
+        return DenseOpConnection(fspace_analog, source_connection,
+                                 target_connection, op,
+                                 cache_dir=kwargs.get('cache_dir', None),
+                                 max_matrices=kwargs.get('max_matrices', 1),
+                                 **qbx_kwargs)
+    if mode == 'hmatrix':
+        from fd2mm.hmatrix import HMatrixOpConnection
+        hmatrix_kwargs = dict(kwargs.get('hmatrix_kwargs', {}))
+        hmatrix_kwargs.update(qbx_kwargs)
+        return HMatrixOpConnection(fspace_analog, source_connection,
+                                   target_connection, op,
+                                   cache_dir=kwargs.get('cache_dir', None),
+                                   max_matrices=kwargs.get('max_matrices', 1),
+                                   **hmatrix_kwargs)
+
+    if mode == 'numpy':
+        from fd2mm.direct import DirectOpConnection
+        return DirectOpConnection(fspace_analog, source_connection,
+                                  target_connection, op,
+                                  chunk_size=kwargs.get('chunk_size', 1024),
+                                  **qbx_kwargs)
+
     return OpConnection(fspace_analog, source_connection, target_connection,
                         op, **qbx_kwargs)
@@ -0,0 +1,169 @@
+from time import perf_counter
+from threading import Lock
+
+import pyopencl as cl
+
+__doc__ = """
+Opt-in timing of the phases of an operator application, see
+:meth:`fd2mm.op.OpConnection.enable_stats`.
+
+.. autoclass:: OpConnectionStats
+    :members:
+"""
+
+
+class _NoTiming:
+    """
+        Context manager standing in for :meth:`OpConnectionStats.time`
+        when stats are disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_timing = _NoTiming()
+
+
+def timed(stats, phase, queue=None):
+    """
+        Return a context manager timing *phase* with *stats*,
+        or doing nothing if *stats* is *None*
+    """
+    if stats is None:
+        return _no_timing
+    return stats.time(phase, queue=queue)
+
+
+class _PhaseTimer:
+    def __init__(self, stats, phase, queue):
+        self.stats = stats
+        self.phase = phase
+        self.queue = queue
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Device work is asynchronous, so wait on it to attribute
+        # it to this phase
+        if self.queue is not None:
+            self.queue.finish()
+        self.stats.add(self.phase, perf_counter() - self.start)
+        return False
+
+
+class OpConnectionStats:
+    """
+        Accumulates wall-clock time (in seconds) and call counts
+        of each phase of applying an :class:`fd2mm.op.OpConnection`
+        over all calls made while it is enabled.
+
+        The phases are
+
+        * *'analog'*: Wrapping :mod:`firedrake` functions as
+          :class:`fd2mm.function.FunctionAnalog`
+        * *'host_conversion'*: Reordering/resampling firedrake data
+          into meshmode order on the host
+        * *'to_device'*: host->device transfer
+        * *'connection'*: Application of the bdy restriction
+          and/or refinement connection
+        * *'evaluation'*: The :mod:`pytential` (or matrix) evaluation
+        * *'readback'*: device->host transfer of the result
+        * *'scatter'*: Writing the result into the firedrake function
+
+        If *use_cl_profiling* is *True*, the device time of profiled
+        events (currently, the readback copies) is recorded separately
+        with a *'device_'* prefix. This requires a queue created with
+        *cl.command_queue_properties.PROFILING_ENABLE*.
+
+        .. attribute:: times
+
+            A dict mapping phases to their total time
+
+        .. attribute:: counts
+
+            A dict mapping phases to the number of times they were timed
+    """
+    phases = ['analog', 'host_conversion', 'to_device', 'connection',
+              'evaluation', 'readback', 'scatter']
+
+    def __init__(self, use_cl_profiling=False):
+        self.use_cl_profiling = use_cl_profiling
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """
+            Zero all times and counts
+        """
+        self.ncalls = 0
+        self.times = {}
+        self.counts = {}
+
+    def add(self, phase, seconds):
+        """
+            Add *seconds* to the total time of *phase*
+        """
+        with self._lock:
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def add_events(self, phase, events):
+        """
+            If profiling, add the device time of the
+            :class:`pyopencl.Event` s *events* to *'device_' + phase*
+        """
+        if not self.use_cl_profiling:
+            return
+        nanoseconds = 0
+        for event in events:
+            try:
+                nanoseconds += event.profile.end - event.profile.start
+            except cl.RuntimeError:
+                # Queue was not created with profiling enabled
+                return
+        self.add('device_' + phase, nanoseconds * 1e-9)
+
+    def time(self, phase, queue=None):
+        """
+            Return a context manager which adds the time spent
+            inside it to *phase*. If *queue* is not *None*,
+            it is finished before the clock is stopped.
+        """
+        return _PhaseTimer(self, phase, queue)
+
+    def as_dict(self, prefix='op_'):
+        """
+            Return a flat dict with keys *prefix + 'ncalls'* and
+            *prefix + phase + '_time'* for each timed phase, e.g.
+            to add to a row of results
+        """
+        result = {prefix + 'ncalls': self.ncalls}
+        for phase, seconds in self.times.items():
+            result[prefix + phase + '_time'] = seconds
+        return result
+
+    def summary(self):
+        """
+            Return a table of the time spent in each phase as a string
+        """
+        total = sum(seconds for phase, seconds in self.times.items()
+                    if not phase.startswith('device_'))
+        lines = ["%d calls, %.4gs total" % (self.ncalls, total)]
+        ordered = [phase for phase in self.phases if phase in self.times]
+        ordered += sorted(phase for phase in self.times if phase not in ordered)
+        for phase in ordered:
+            seconds = self.times[phase]
+            percent = ''
+            if not phase.startswith('device_') and total > 0:
+                percent = "%5.1f%%" % (100 * seconds / total)
+            lines.append("  %-18s %10.4gs %6s (%d)"
+                         % (phase, seconds, percent, self.counts[phase]))
+        return '\n'.join(lines)
+
+    def print_summary(self):
+        print(self.summary())
@@ -127,3 +127,37 @@ def test_identity_conversion(vector_function_space_analog):
                          - identity_fntn_analog.analog().dat.data))
     assert diff < TOL, "mm->fd identity converesion failed: " \
         "%f >= %f" % (diff, TOL)
+
+
+def test_node_coordinates(function_space_analog):
+    from fd2mm.op import _compute_node_coordinates
+
+    fspace = function_space_analog.analog()
+    mesh = fspace.mesh()
+    vfspace = VectorFunctionSpace(mesh, fspace.ufl_element().family(),
+                                  fspace.ufl_element().degree())
+    coords = Function(vfspace).interpolate(SpatialCoordinate(mesh))
+    coords = np.real(coords.dat.data).reshape((-1, mesh.geometric_dimension()))
+
+    # All nodes
+    node_indices, node_coords = _compute_node_coordinates(fspace)
+    assert node_indices.shape[0] == coords.shape[0]
+    diff = np.max(np.abs(node_coords - coords[node_indices].T))
+    assert diff < TOL, "node coordinates incorrect: %f >= %f" % (diff, TOL)
+
+    # Just some nodes
+    some_nodes = np.arange(0, coords.shape[0], 3)
+    node_indices, node_coords = _compute_node_coordinates(fspace, some_nodes)
+    assert np.all(node_indices == some_nodes)
+    diff = np.max(np.abs(node_coords - coords[some_nodes].T))
+    assert diff < TOL, "node coordinates incorrect: %f >= %f" % (diff, TOL)
+
+
+def test_lazy_import():
+    # Importing fd2mm alone should not import any of the heavy libraries
+    import subprocess
+    import sys
+    code = ("import sys\n"
+            "import fd2mm\n"
+            "assert not {'pytential', 'meshmode', 'firedrake'} & set(sys.modules)\n")
+    subprocess.check_call([sys.executable, "-c", code])
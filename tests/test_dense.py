@@ -0,0 +1,76 @@
+import os
+
+import pyopencl as cl
+import numpy as np
+import numpy.linalg as la
+import pytest
+
+cl_ctx = cl.create_some_context()
+queue = cl.CommandQueue(cl_ctx)
+
+import firedrake as fd
+from sumpy.kernel import LaplaceKernel, HelmholtzKernel
+from pytential import sym
+
+import fd2mm
+
+# Source on the left side of the square, target on the right
+mesh = fd.UnitSquareMesh(16, 16)
+V = fd.FunctionSpace(mesh, 'CG', 2)
+fspace_analog = fd2mm.FunctionSpaceAnalog(cl_ctx, fd2mm.MeshAnalog(mesh), V)
+qbx_kwargs = {'fine_order': 4, 'fmm_order': 10, 'qbx_order': 2}
+
+
+def get_density(n):
+    x, y = fd.SpatialCoordinate(mesh)
+    return fd.Function(V).interpolate(fd.sin(n * y) + x)
+
+
+def test_disk_cache(tmpdir):
+    cache_dir = str(tmpdir)
+    op = sym.S(HelmholtzKernel(2), sym.var("u"), k=sym.var("k"),
+               qbx_forced_limit=None)
+    u = get_density(3)
+
+    pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, 1),
+                           target=(V, 2), qbx_kwargs=qbx_kwargs, mode='dense',
+                           cache_dir=cache_dir)
+    results = {}
+    for k in [1.0, 2.0]:
+        results[k] = pyt_op.evaluate(queue, u=u, k=k).copy()
+    # Only the most recent matrix is kept in memory
+    assert len(pyt_op._matrices) == 1
+    assert len(os.listdir(cache_dir)) == 2
+
+    # A new binding loads the matrices instead of assembling them
+    pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, 1),
+                           target=(V, 2), qbx_kwargs=qbx_kwargs, mode='dense',
+                           cache_dir=cache_dir)
+
+    def fail_to_assemble(*args, **kwargs):
+        raise AssertionError("matrix should be loaded from the cache")
+
+    pyt_op._assemble_matrix = fail_to_assemble
+    for k in [1.0, 2.0]:
+        assert np.array_equal(pyt_op.evaluate(queue, u=u, k=k), results[k])
+
+
+def test_evaluate_many():
+    op = sym.D(LaplaceKernel(2), sym.var("u"), qbx_forced_limit=None)
+    pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, 1),
+                           target=(V, 2), qbx_kwargs=qbx_kwargs, mode='dense')
+
+    densities = [get_density(n) for n in range(1, 4)]
+    results = pyt_op.evaluate_many(queue, u=densities)
+    assert len(results) == len(densities)
+    for result, u in zip(results, densities):
+        expected = pyt_op.evaluate(queue, u=u)
+        assert la.norm(result - expected) < 1e-12 * la.norm(expected)
+
+
+def test_check_separation():
+    # The bottom side touches the left side at a corner
+    op = sym.S(LaplaceKernel(2), sym.var("u"), qbx_forced_limit=None)
+    with pytest.raises(ValueError):
+        fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, 1),
+                      target=(V, 3), qbx_kwargs=qbx_kwargs, mode='dense')
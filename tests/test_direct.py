@@ -0,0 +1,83 @@
+import numpy as np
+import numpy.linalg as la
+import pytest
+
+from sumpy.kernel import (LaplaceKernel, HelmholtzKernel,
+                          AxisTargetDerivative, DirectionalSourceDerivative)
+
+from fd2mm.direct import _kernel_matrix
+
+
+@pytest.mark.parametrize('ambient_dim', [2, 3])
+@pytest.mark.parametrize('k', [None, 1.7])
+def test_mixed_derivative(ambient_dim, k):
+    # grad of a double layer kernel against finite differences
+    # of the double layer kernel in the target
+    np.random.seed(17)
+    if k is None:
+        base_kernel = LaplaceKernel(ambient_dim)
+    else:
+        base_kernel = HelmholtzKernel(ambient_dim)
+
+    targets = np.random.rand(ambient_dim, 5) + 2
+    sources = np.random.rand(ambient_dim, 7)
+    normals = np.random.rand(ambient_dim, 7) - 0.5
+    normals /= la.norm(normals, axis=0)
+
+    double_layer = DirectionalSourceDerivative(base_kernel)
+    h = 1e-5
+    for axis in range(ambient_dim):
+        value, _ = _kernel_matrix(AxisTargetDerivative(axis, double_layer), k,
+                                  targets, sources, normals, 1e-12)
+
+        shift = h * np.eye(ambient_dim)[:, axis:axis+1]
+        plus, _ = _kernel_matrix(double_layer, k, targets + shift, sources,
+                                 normals, 1e-12)
+        minus, _ = _kernel_matrix(double_layer, k, targets - shift, sources,
+                                  normals, 1e-12)
+        fd_value = (plus - minus) / (2 * h)
+
+        assert la.norm(value - fd_value) < 1e-6 * la.norm(value)
+
+
+def test_numpy_mode_on_host(monkeypatch):
+    # Function densities are converted on the host, without creating
+    # (or converting) a field on the device
+    import pyopencl as cl
+    import pyopencl.array  # noqa
+    import firedrake as fd
+    from pytential import sym
+    import fd2mm
+
+    cl_ctx = cl.create_some_context()
+
+    # Source on the left side of the square, target on the right
+    mesh = fd.UnitSquareMesh(16, 16)
+    V = fd.FunctionSpace(mesh, 'CG', 2)
+    fspace_analog = fd2mm.FunctionSpaceAnalog(
+        cl_ctx, fd2mm.MeshAnalog(mesh), V)
+
+    x, y = fd.SpatialCoordinate(mesh)
+    u = fd.Function(V).interpolate(fd.sin(3 * y) + x)
+
+    op = sym.D(LaplaceKernel(2), sym.var("u"), qbx_forced_limit=None)
+    qbx_kwargs = {'fine_order': 4, 'fmm_order': 10, 'qbx_order': 2}
+    results = {}
+    for mode in ['numpy', 'dense']:
+        pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, 1),
+                               target=(V, 2), qbx_kwargs=qbx_kwargs, mode=mode)
+        if mode == 'numpy':
+            def fail(*args, **kwargs):
+                raise AssertionError("numpy mode touched the device")
+
+            with monkeypatch.context() as patch:
+                patch.setattr(cl.array, 'to_device', fail)
+                patch.setattr(fd2mm.op.SourceConnection, '__call__', fail)
+                results[mode] = pyt_op.evaluate(None, u=u)
+        else:
+            queue = cl.CommandQueue(cl_ctx)
+            results[mode] = pyt_op.evaluate(queue, u=u)
+
+    # both are direct quadrature on the same nodes
+    assert la.norm(results['numpy'] - results['dense']) \
+        < 1e-8 * la.norm(results['dense'])
@@ -107,3 +107,75 @@ def test_greens_formula(degree, family, ambient_dim):
 
     # TODO: Make this more strict
     assert rel_l2_err < 0.09
+
+
+@pytest.mark.parametrize('ambient_dim', [2, 3])
+def test_unique_target_nodes(ambient_dim):
+    # Evaluating once per CG node should agree with evaluating
+    # on the (DG) meshmode discretization and converting back
+    degree = 2
+    qbx_kwargs = {'fine_order': 4 * degree,
+                  'fmm_order': 5,
+                  'qbx_order': degree}
+
+    mesh = mesh2d if ambient_dim == 2 else mesh3d
+    V = fd.FunctionSpace(mesh, 'CG', degree)
+    mesh_analog = fd2mm.MeshAnalog(mesh)
+    fspace_analog = fd2mm.FunctionSpaceAnalog(cl_ctx, mesh_analog, V)
+
+    xx = fd.SpatialCoordinate(mesh)
+    u = fd.Function(V).interpolate(sum(xi**2 for xi in xx))
+
+    op = sym.S(LaplaceKernel(ambient_dim), sym.var("u"), qbx_forced_limit=None)
+
+    from meshmode.mesh import BTAG_ALL
+    results = []
+    for unique_target_nodes in [False, True]:
+        pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, BTAG_ALL),
+                               target=V, qbx_kwargs=qbx_kwargs,
+                               unique_target_nodes=unique_target_nodes)
+        result = fd.Function(V)
+        pyt_op(queue, u=u, result_function=result)
+        results.append(result)
+
+    per_cell, unique = results
+    norm = fd.sqrt(fd.assemble(fd.inner(per_cell, per_cell) * fd.dx))
+    err = fd.sqrt(fd.assemble(fd.inner(per_cell - unique, per_cell - unique)
+                              * fd.dx))
+    # only the FMM trees differ
+    assert err / norm < 1e-3
+
+
+def test_field_cache():
+    # Modifying a function between evaluations must not reuse
+    # its stale converted field
+    degree = 2
+    qbx_kwargs = {'fine_order': 4 * degree,
+                  'fmm_order': 5,
+                  'qbx_order': degree}
+
+    V = fd.FunctionSpace(mesh2d, 'CG', degree)
+    mesh_analog = fd2mm.MeshAnalog(mesh2d)
+    fspace_analog = fd2mm.FunctionSpaceAnalog(cl_ctx, mesh_analog, V)
+
+    xx = fd.SpatialCoordinate(mesh2d)
+    u = fd.Function(V).interpolate(sum(xi**2 for xi in xx))
+
+    op = sym.S(LaplaceKernel(2), sym.var("u"), qbx_forced_limit=None)
+
+    from meshmode.mesh import BTAG_ALL
+    pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, BTAG_ALL),
+                           target=V, qbx_kwargs=qbx_kwargs)
+    first = fd.Function(V)
+    pyt_op(queue, u=u, result_function=first)
+    if hasattr(u.dat, 'dat_version'):
+        assert pyt_op.get_source_connection().get_cached_field(u) is not None
+
+    u.dat.data[:] *= 2
+    second = fd.Function(V)
+    pyt_op(queue, u=u, result_function=second)
+
+    err = fd.sqrt(fd.assemble(fd.inner(second - 2 * first, second - 2 * first)
+                              * fd.dx))
+    norm = fd.sqrt(fd.assemble(fd.inner(second, second) * fd.dx))
+    assert err / norm < 1e-10
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import numpy as np
+import numpy.linalg as la
+import pytest
+
+pyamg = pytest.importorskip("pyamg")
+pytest.importorskip("firedrake")
+
+# The hierarchy cache lives in the Helmholtz example
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir,
+                                'examples', 'HelmholtzSommerfeldProblem'))
+
+from methods.preconditioners.two_D_helmholtz import (  # noqa: E402
+    hierarchy_fingerprint, _save_hierarchy, _load_hierarchy, _cache_file_name)
+
+
+def test_hierarchy_round_trip(tmpdir):
+    cache_dir = str(tmpdir)
+    smoother = ('gauss_seidel', {'iterations': 1})
+
+    A = pyamg.gallery.poisson((16, 16), format='csr')
+    x, y = np.meshgrid(np.linspace(0, 1, 16), np.linspace(0, 1, 16))
+    vertices = np.stack([x.ravel(), y.ravel(), np.zeros(x.size)], axis=1)
+    ml = pyamg.smoothed_aggregation_solver(A, max_coarse=10,
+                                           presmoother=smoother,
+                                           postsmoother=smoother)
+
+    fingerprint = hierarchy_fingerprint(A, vertices, ('params',))
+    # Only the sparsity pattern counts without values
+    assert hierarchy_fingerprint(2 * A, vertices, ('params',)) != fingerprint
+    assert hierarchy_fingerprint(A, vertices, ('params',), with_values=False) \
+        == hierarchy_fingerprint(2 * A, vertices, ('params',), with_values=False)
+    assert hierarchy_fingerprint(A, vertices, ('other',)) != fingerprint
+
+    assert _load_hierarchy(cache_dir, fingerprint, smoother, 'pinv') is None
+    _save_hierarchy(cache_dir, fingerprint, ml)
+    loaded = _load_hierarchy(cache_dir, fingerprint, smoother, 'pinv')
+
+    assert len(loaded.levels) == len(ml.levels)
+    b = np.random.RandomState(3).rand(A.shape[0])
+    assert la.norm(loaded.solve(b, maxiter=5) - ml.solve(b, maxiter=5)) \
+        < 1e-10 * la.norm(ml.solve(b, maxiter=5))
+
+    # A truncated pickle is a miss, not an error
+    file_name = _cache_file_name(cache_dir, fingerprint)
+    with open(file_name, 'rb') as in_file:
+        data = in_file.read()
+    with open(file_name, 'wb') as out_file:
+        out_file.write(data[:len(data) // 2])
+    assert _load_hierarchy(cache_dir, fingerprint, smoother, 'pinv') is None
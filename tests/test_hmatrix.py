@@ -0,0 +1,78 @@
+import numpy as np
+import numpy.linalg as la
+import pytest
+
+from fd2mm.hmatrix import ClusterTree, HMatrix, _source_partition
+
+
+@pytest.mark.parametrize('tol', [1e-4, 1e-8])
+def test_hmatrix_matvec(tol):
+    np.random.seed(17)
+    # Sources on the unit circle, targets on a circle of radius 3
+    angles = np.random.rand(400) * 2 * np.pi
+    sources = np.array([np.cos(angles), np.sin(angles)])
+    angles = np.random.rand(300) * 2 * np.pi
+    targets = 3 * np.array([np.cos(angles), np.sin(angles)])
+
+    # Laplace single layer kernel
+    diff = targets[:, :, np.newaxis] - sources[:, np.newaxis, :]
+    mat = np.log(la.norm(diff, axis=0))
+
+    target_tree = ClusterTree(targets, leaf_size=32)
+    source_tree = ClusterTree(sources, leaf_size=32)
+    hmat = HMatrix(mat.shape, 1, 1, mat.dtype)
+    for target_leaf in target_tree.leaves():
+        tgt = target_leaf.indices
+        for source_cluster, admissible in _source_partition(target_leaf,
+                                                            source_tree, 1.0):
+            src = source_cluster.indices
+            hmat.add_block(tgt, src, mat[np.ix_(tgt, src)],
+                           tol if admissible else None)
+
+    x = np.random.rand(mat.shape[1])
+    rel_err = la.norm(hmat.matvec(x) - mat.dot(x)) / la.norm(mat.dot(x))
+    assert rel_err < 10 * tol
+    assert hmat.compression_ratio() > 1
+
+    # Several vectors at once
+    X = np.random.rand(mat.shape[1], 3)
+    rel_err = la.norm(hmat.matmat(X) - mat.dot(X)) / la.norm(mat.dot(X))
+    assert rel_err < 10 * tol
+
+
+def test_hmatrix_mode_matches_dense():
+    import pyopencl as cl
+    import firedrake as fd
+    from sumpy.kernel import LaplaceKernel
+    from pytential import sym
+    import fd2mm
+
+    cl_ctx = cl.create_some_context()
+    queue = cl.CommandQueue(cl_ctx)
+
+    # Source on the left side of the square, target on the right
+    mesh = fd.UnitSquareMesh(32, 32)
+    V = fd.FunctionSpace(mesh, 'CG', 2)
+    fspace_analog = fd2mm.FunctionSpaceAnalog(
+        cl_ctx, fd2mm.MeshAnalog(mesh), V)
+
+    x, y = fd.SpatialCoordinate(mesh)
+    u = fd.Function(V).interpolate(fd.sin(3 * y) + x)
+
+    kernel = LaplaceKernel(2)
+    op = sym.S(kernel, sym.var("u"), qbx_forced_limit=None) \
+        + sym.D(kernel, sym.var("u"), qbx_forced_limit=None)
+    qbx_kwargs = {'fine_order': 4, 'fmm_order': 10, 'qbx_order': 2}
+
+    results = {}
+    for mode in ['dense', 'hmatrix']:
+        pyt_op = fd2mm.fd_bind(cl_ctx, fspace_analog, op, source=(V, 1),
+                               target=(V, 2), qbx_kwargs=qbx_kwargs, mode=mode,
+                               hmatrix_kwargs={'tol': 1e-8, 'leaf_size': 16})
+        result = fd.Function(V)
+        pyt_op(queue, result, u=u)
+        results[mode] = result.dat.data_ro.copy()
+
+    rel_err = la.norm(results['hmatrix'] - results['dense']) \
+        / la.norm(results['dense'])
+    assert rel_err < 1e-6